@@ -0,0 +1,34 @@
+"""Unique player session start, for the connect upsert
+
+Revision ID: 3a7c9e2d5b80
+Revises: 8e3f1b6a2c95
+Create Date: 2023-06-03 10:21:44.630187
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3a7c9e2d5b80"
+down_revision = "8e3f1b6a2c95"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest of the sessions recorded twice
+    op.execute(
+        """DELETE FROM player_sessions a USING player_sessions b
+        WHERE a.playersteamid_id = b.playersteamid_id
+        AND a.start = b.start AND a.id > b.id"""
+    )
+    op.create_index(
+        "ix_player_sessions_player_start",
+        "player_sessions",
+        ["playersteamid_id", "start"],
+        unique=True,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_player_sessions_player_start", table_name="player_sessions")
@@ -0,0 +1,103 @@
+"""Store the players of the server counts as presence intervals
+
+Revision ID: 4b8d2f6a9c31
+Revises: 3a7c9e2d5b80
+Create Date: 2023-06-05 21:12:09.318402
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4b8d2f6a9c31"
+down_revision = "3a7c9e2d5b80"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "player_presence",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("server_number", sa.Integer(), nullable=True),
+        sa.Column("playersteamid_id", sa.Integer(), nullable=False),
+        sa.Column("start", sa.TIMESTAMP(), nullable=False),
+        sa.Column("end", sa.TIMESTAMP(), nullable=False),
+        sa.Column("vip", sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(["playersteamid_id"], ["steam_id_64.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "server_number",
+            "playersteamid_id",
+            "start",
+            name="unique_player_presence",
+        ),
+    )
+    op.create_index(
+        op.f("ix_player_presence_playersteamid_id"),
+        "player_presence",
+        ["playersteamid_id"],
+    )
+    op.create_index(
+        "ix_player_presence_server_start_end",
+        "player_presence",
+        ["server_number", "start", "end"],
+    )
+
+    # Gaps and islands: the minutes of a player minus their rank are the same
+    # for consecutive minutes, each group is one interval
+    op.execute("""INSERT INTO player_presence
+            (server_number, playersteamid_id, start, "end", vip)
+        SELECT server_number, playersteamid_id, min(datapoint_time),
+            max(datapoint_time), vip
+        FROM (
+            SELECT c.server_number, p.playersteamid_id, c.datapoint_time,
+                p.vip,
+                c.datapoint_time - interval '1 minute' * row_number() OVER (
+                    PARTITION BY c.server_number, p.playersteamid_id, p.vip
+                    ORDER BY c.datapoint_time
+                ) AS island
+            FROM player_at_count p
+            JOIN server_counts c ON c.id = p.servercount_id
+        ) minutes
+        GROUP BY server_number, playersteamid_id, vip, island
+        ON CONFLICT DO NOTHING""")
+    op.drop_table("player_at_count")
+
+
+def downgrade():
+    op.create_table(
+        "player_at_count",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("playersteamid_id", sa.Integer(), nullable=False),
+        sa.Column("servercount_id", sa.Integer(), nullable=False),
+        sa.Column("vip", sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(["playersteamid_id"], ["steam_id_64.id"]),
+        sa.ForeignKeyConstraint(["servercount_id"], ["server_counts.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "playersteamid_id", "servercount_id", name="unique_player_at_count"
+        ),
+    )
+    op.create_index(
+        op.f("ix_player_at_count_playersteamid_id"),
+        "player_at_count",
+        ["playersteamid_id"],
+    )
+    op.create_index(
+        op.f("ix_player_at_count_servercount_id"),
+        "player_at_count",
+        ["servercount_id"],
+    )
+    op.execute("""INSERT INTO player_at_count (playersteamid_id, servercount_id, vip)
+        SELECT p.playersteamid_id, c.id, p.vip
+        FROM player_presence p
+        JOIN server_counts c ON c.server_number IS NOT DISTINCT FROM p.server_number
+            AND c.datapoint_time BETWEEN p.start AND p."end"
+        ON CONFLICT DO NOTHING""")
+    op.drop_index("ix_player_presence_server_start_end", table_name="player_presence")
+    op.drop_index(
+        op.f("ix_player_presence_playersteamid_id"), table_name="player_presence"
+    )
+    op.drop_table("player_presence")
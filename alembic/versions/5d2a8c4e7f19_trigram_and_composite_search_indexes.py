@@ -0,0 +1,58 @@
+"""Trigram and composite indexes for the log and player searches
+
+Revision ID: 5d2a8c4e7f19
+Revises: b1f6e0c2d7a4
+Create Date: 2023-05-20 11:04:52.118306
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5d2a8c4e7f19"
+down_revision = "b1f6e0c2d7a4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    # unaccent() is only STABLE so it can't be used in an index, the dictionary
+    # is pinned to make the wrapper immutable
+    op.execute("""CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+        $func$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $func$
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT""")
+
+    for column in ("player1_name", "player2_name"):
+        op.create_index(
+            f"ix_log_lines_{column}_trgm",
+            "log_lines",
+            [column],
+            postgresql_using="gin",
+            postgresql_ops={column: "gin_trgm_ops"},
+        )
+    op.execute(
+        "CREATE INDEX ix_log_lines_server_event_time ON log_lines (server, event_time DESC)"
+    )
+    op.create_index("ix_log_lines_type_event_time", "log_lines", ["type", "event_time"])
+
+    op.execute("""CREATE INDEX ix_player_names_name_unaccent_trgm
+        ON player_names USING gin (f_unaccent(name) gin_trgm_ops)""")
+    op.create_index(
+        "ix_steam_id_64_steam_id_64_trgm",
+        "steam_id_64",
+        ["steam_id_64"],
+        postgresql_using="gin",
+        postgresql_ops={"steam_id_64": "gin_trgm_ops"},
+    )
+
+
+def downgrade():
+    op.drop_index("ix_steam_id_64_steam_id_64_trgm", table_name="steam_id_64")
+    op.drop_index("ix_player_names_name_unaccent_trgm", table_name="player_names")
+    op.drop_index("ix_log_lines_type_event_time", table_name="log_lines")
+    op.drop_index("ix_log_lines_server_event_time", table_name="log_lines")
+    op.drop_index("ix_log_lines_player2_name_trgm", table_name="log_lines")
+    op.drop_index("ix_log_lines_player1_name_trgm", table_name="log_lines")
+    op.execute("DROP FUNCTION IF EXISTS f_unaccent(text)")
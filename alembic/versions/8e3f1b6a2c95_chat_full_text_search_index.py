@@ -0,0 +1,28 @@
+"""Full text search index on the chat log lines
+
+Revision ID: 8e3f1b6a2c95
+Revises: 5d2a8c4e7f19
+Create Date: 2023-05-27 16:48:31.902215
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8e3f1b6a2c95"
+down_revision = "5d2a8c4e7f19"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The 'simple' configuration doesn't stem, players write in many languages
+    op.execute(
+        """CREATE INDEX ix_log_lines_chat_content_fts ON log_lines
+        USING gin (to_tsvector('simple'::regconfig, content))
+        WHERE type LIKE 'CHAT%'"""
+    )
+
+
+def downgrade():
+    op.drop_index("ix_log_lines_chat_content_fts", table_name="log_lines")
@@ -0,0 +1,96 @@
+"""Partition log_lines by month on event_time
+
+Revision ID: b1f6e0c2d7a4
+Revises: 22e3790f2095
+Create Date: 2023-05-14 18:32:07.415920
+
+"""
+
+import datetime
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b1f6e0c2d7a4"
+down_revision = "22e3790f2095"
+branch_labels = None
+depends_on = None
+
+# Partitions are created up to that many months after the current one, the
+# create_log_lines_partitions job keeps creating them afterwards
+MONTHS_AHEAD = 2
+
+
+def _add_months(dt, months):
+    years, month = divmod(dt.month - 1 + months, 12)
+    return dt.replace(year=dt.year + years, month=month + 1)
+
+
+def _copy_table(src, dest):
+    op.execute(f"""INSERT INTO {dest} (id, version, creation_time, event_time, type,
+            player1_name, player1_steamid, player2_name, player2_steamid, weapon, raw,
+            content, server)
+        SELECT id, version, creation_time, event_time, type, player1_name,
+            player1_steamid, player2_name, player2_steamid, weapon, raw, content, server
+        FROM {src}""")
+
+
+def _add_constraints_and_indexes(primary_key):
+    op.create_primary_key("log_lines_pkey", "log_lines", primary_key)
+    op.create_unique_constraint("unique_log_line", "log_lines", ["event_time", "raw"])
+    for column in ("player1_steamid", "player2_steamid"):
+        op.create_foreign_key(
+            f"log_lines_{column}_fkey", "log_lines", "steam_id_64", [column], ["id"]
+        )
+    for column in ("event_time", "player1_steamid", "player2_steamid"):
+        op.create_index(op.f(f"ix_log_lines_{column}"), "log_lines", [column])
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    op.execute("ALTER TABLE log_lines RENAME TO log_lines_unpartitioned")
+    # The sequence would be dropped with the old table otherwise
+    op.execute("ALTER SEQUENCE log_lines_id_seq OWNED BY NONE")
+    op.execute("""CREATE TABLE log_lines_partitioned
+        (LIKE log_lines_unpartitioned INCLUDING DEFAULTS)
+        PARTITION BY RANGE (event_time)""")
+    op.execute(
+        "CREATE TABLE log_lines_default PARTITION OF log_lines_partitioned DEFAULT"
+    )
+
+    first_event, last_event = conn.execute(
+        "SELECT min(event_time), max(event_time) FROM log_lines_unpartitioned"
+    ).first()
+    current = datetime.datetime.now().replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    start = (first_event or current).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    end = max(_add_months(current, MONTHS_AHEAD + 1), last_event or current)
+    while start < end:
+        next_start = _add_months(start, 1)
+        op.execute(f"""CREATE TABLE log_lines_y{start.year}m{start.month:02d}
+            PARTITION OF log_lines_partitioned
+            FOR VALUES FROM ('{start.isoformat()}') TO ('{next_start.isoformat()}')""")
+        start = next_start
+
+    _copy_table("log_lines_unpartitioned", "log_lines_partitioned")
+    op.execute("DROP TABLE log_lines_unpartitioned")
+    op.execute("ALTER TABLE log_lines_partitioned RENAME TO log_lines")
+    op.execute("ALTER SEQUENCE log_lines_id_seq OWNED BY log_lines.id")
+    _add_constraints_and_indexes(["id", "event_time"])
+
+
+def downgrade():
+    op.execute("ALTER TABLE log_lines RENAME TO log_lines_partitioned")
+    op.execute("ALTER SEQUENCE log_lines_id_seq OWNED BY NONE")
+    op.execute("""CREATE TABLE log_lines_unpartitioned
+        (LIKE log_lines_partitioned INCLUDING DEFAULTS)""")
+    _copy_table("log_lines_partitioned", "log_lines_unpartitioned")
+    # Drops the partitions as well
+    op.execute("DROP TABLE log_lines_partitioned")
+    op.execute("ALTER TABLE log_lines_unpartitioned RENAME TO log_lines")
+    op.execute("ALTER SEQUENCE log_lines_id_seq OWNED BY log_lines.id")
+    _add_constraints_and_indexes(["id"])
@@ -19,7 +19,12 @@ then
   ./manage.py collectstatic --noinput
   echo "from django.contrib.auth.models import User; User.objects.create_superuser('admin', 'admin@example.com', 'admin') if not User.objects.filter(username='admin').first() else None" | python manage.py shell
   export LOGGING_FILENAME=api_$SERVER_NUMBER.log
-  gunicorn --preload -w $NB_API_WORKERS -k gthread --threads $NB_API_THREADS -t 120 -b 0.0.0.0 rconweb.wsgi
+  if [ "$RCONWEB_ASGI" != '' ]
+  then
+    gunicorn --preload -w $NB_API_WORKERS -k uvicorn.workers.UvicornWorker -t 120 -b 0.0.0.0 rconweb.asgi
+  else
+    gunicorn --preload -w $NB_API_WORKERS -k gthread --threads $NB_API_THREADS -t 120 -b 0.0.0.0 rconweb.wsgi
+  fi
   cd ..
   ./manage.py unregister_api
 else
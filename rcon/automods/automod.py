@@ -26,6 +26,7 @@ from rcon.game_logs import on_connected, on_kill
 from rcon.hooks import inject_player_ids
 from rcon.rcon import Rcon
 from rcon.settings import SERVER_INFO
+from rcon.team_view import get_fresh_team_view
 from rcon.types import StructuredLogLineType
 
 logger = logging.getLogger(__name__)
@@ -34,7 +35,7 @@ first_run_done_key = "first_run_done"
 
 def get_punitions_to_apply(rcon, moderators) -> PunitionsToApply:
     logger.debug("Getting team info")
-    team_view = rcon.get_team_view()
+    team_view = get_fresh_team_view(rcon)
     gamestate = rcon.get_gamestate()
     punitions_to_apply = PunitionsToApply()
 
@@ -2,10 +2,12 @@ import functools
 import logging
 import os
 import pickle
+import time
 from contextlib import contextmanager
 
 import redis
 import simplejson
+from cachetools import TTLCache
 from cachetools.func import ttl_cache as cachetools_ttl_cache
 
 logger = logging.getLogger(__name__)
@@ -117,6 +119,151 @@ class RedisCached:
         #   logger.debug("Cache CLEARED for %s", keys)
 
 
+class RedisBatchCached(RedisCached):
+    """Cache the results of a batch lookup function per item instead of per call
+
+    The cached function must take a list of keys (steam IDs for instance) as its
+    first argument and return a dict of key -> value (or None on failure).
+    Cached items are read with a single MGET, only the missing keys are passed to
+    the function (in chunks of `batch_size`) and the results are written back one
+    key per item so that overlapping lists share their cache entries.
+    """
+
+    def __init__(self, *args, batch_size=100, falsy_ttl_seconds=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size
+        self.falsy_ttl_seconds = falsy_ttl_seconds
+
+    def item_key(self, item):
+        return f"{self.key_prefix}__{item}"
+
+    def __call__(self, items, *args, **kwargs):
+        items = list(dict.fromkeys(items))
+        if not items:
+            return {}
+
+        results = {}
+        cached = [None] * len(items)
+        try:
+            cached = self.red.mget([self.item_key(i) for i in items])
+        except redis.exceptions.RedisError:
+            logger.exception("Unable to use cache")
+
+        missing = []
+        for item, val in zip(items, cached):
+            if val is None:
+                missing.append(item)
+            else:
+                results[item] = self.deserializer(val)
+
+        for idx in range(0, len(missing), self.batch_size):
+            chunk = missing[idx : idx + self.batch_size]
+            fetched = self.function(chunk, *args, **kwargs)
+            if fetched is None:
+                # The whole chunk failed, don't cache anything so it's retried
+                continue
+            results.update({i: fetched.get(i) for i in chunk})
+            self._set_many({i: fetched.get(i) for i in chunk})
+
+        return results
+
+    def _set_many(self, values):
+        try:
+            with self.red.pipeline(transaction=False) as pipe:
+                for item, val in values.items():
+                    ttl = self.ttl_seconds
+                    if not val:
+                        if self.falsy_ttl_seconds:
+                            ttl = self.falsy_ttl_seconds
+                        elif not self.cache_falsy:
+                            continue
+                    pipe.setex(self.item_key(item), ttl, self.serializer(val))
+                pipe.execute()
+        except redis.exceptions.RedisError:
+            logger.exception("Unable to set cache")
+
+    def get_cached_value_for(self, item):
+        return self.red.get(self.item_key(item))
+
+    def clear_for(self, *items):
+        keys = [self.item_key(i) for i in items]
+        logger.debug("Invalidating cache for %s", keys)
+        if keys:
+            self.red.delete(*keys)
+
+
+class MemoryBatchCached:
+    """In memory fallback of RedisBatchCached when redis is not configured
+
+    With `falsy_ttl_seconds` the falsy values are kept in a second cache
+    expiring after that many seconds, like the redis keys of RedisBatchCached.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds,
+        function,
+        batch_size=100,
+        cache_falsy=True,
+        maxsize=10000,
+        falsy_ttl_seconds=None,
+        timer=time.monotonic,
+    ):
+        self.function = function
+        self.batch_size = batch_size
+        self.cache_falsy = cache_falsy
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl_seconds, timer=timer)
+        self.falsy_cache = None
+        if falsy_ttl_seconds:
+            self.falsy_cache = TTLCache(
+                maxsize=maxsize, ttl=falsy_ttl_seconds, timer=timer
+            )
+
+    def _caches(self):
+        if self.falsy_cache is None:
+            return (self.cache,)
+        return (self.cache, self.falsy_cache)
+
+    def __call__(self, items, *args, **kwargs):
+        items = list(dict.fromkeys(items))
+        results = {}
+        for cache in self._caches():
+            results.update({i: cache[i] for i in items if i in cache})
+        missing = [i for i in items if i not in results]
+
+        for idx in range(0, len(missing), self.batch_size):
+            chunk = missing[idx : idx + self.batch_size]
+            fetched = self.function(chunk, *args, **kwargs)
+            if fetched is None:
+                continue
+            for i in chunk:
+                val = fetched.get(i)
+                results[i] = val
+                if val:
+                    self.cache[i] = val
+                elif self.falsy_cache is not None:
+                    self.falsy_cache[i] = val
+                elif self.cache_falsy:
+                    self.cache[i] = val
+
+        return results
+
+    def get_cached_value_for(self, item):
+        for cache in self._caches():
+            if item in cache:
+                return cache[item]
+        return None
+
+    def clear_for(self, *items):
+        for i in items:
+            for cache in self._caches():
+                cache.pop(i, None)
+
+    def clear_all(self):
+        for cache in self._caches():
+            cache.clear()
+
+
 def get_redis_pool(decode_responses=True):
     global _REDIS_POOL
     redis_url = os.getenv("REDIS_URL")
@@ -172,6 +319,50 @@ def ttl_cache(ttl, *args, is_method=True, cache_falsy=True, **kwargs):
     return decorator
 
 
+def batch_ttl_cache(ttl, batch_size=100, cache_falsy=True, falsy_ttl=None):
+    """Per item cache for functions looking up a list of keys at once
+
+    See RedisBatchCached, the decorated function must return a dict of
+    key -> value for the keys it received, or None if the lookup failed.
+    """
+    pool = get_redis_pool(decode_responses=False)
+
+    def decorator(func):
+        if not pool:
+            logger.debug("REDIS_URL is not set falling back to memory cache")
+            cached_func = MemoryBatchCached(
+                ttl,
+                function=func,
+                batch_size=batch_size,
+                cache_falsy=cache_falsy,
+                falsy_ttl_seconds=falsy_ttl,
+            )
+        else:
+            cached_func = RedisBatchCached(
+                pool,
+                ttl,
+                function=func,
+                is_method=False,
+                cache_falsy=cache_falsy,
+                serializer=pickle.dumps,
+                deserializer=pickle.loads,
+                batch_size=batch_size,
+                falsy_ttl_seconds=falsy_ttl,
+            )
+
+        def wrapper(items, *args, **kwargs):
+            return cached_func(items, *args, **kwargs)
+
+        functools.update_wrapper(wrapper, func)
+        wrapper.cache_clear = cached_func.clear_all
+        wrapper.get_cached_value_for = cached_func.get_cached_value_for
+        wrapper.clear_for = cached_func.clear_for
+        wrapper.cache = cached_func
+        return wrapper
+
+    return decorator
+
+
 @contextmanager
 def invalidates(*cached_funcs):
     for f in cached_funcs:
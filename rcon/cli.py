@@ -45,6 +45,34 @@ def run_stats_loop():
         sys.exit(1)
 
 
+@cli.command(name="stats_loop")
+def run_series_loop():
+    """Record the server metrics time series"""
+    from rcon import stats_loop
+
+    try:
+        stats_loop.run()
+    except KeyboardInterrupt:
+        sys.exit(0)
+    except:
+        logger.exception("Time series loop stopped")
+        sys.exit(1)
+
+
+@cli.command(name="team_view_loop")
+def run_team_view_loop():
+    """Publish the team view and its diffs to redis"""
+    from rcon import team_view
+
+    try:
+        team_view.run()
+    except KeyboardInterrupt:
+        sys.exit(0)
+    except:
+        logger.exception("Team view loop stopped")
+        sys.exit(1)
+
+
 @cli.command(name="record_server_stats_inception")
 def save_stats():
     save_server_stats_since_inception()
@@ -56,14 +84,101 @@ def save_recent_stats():
 
 
 @cli.command(name="enrich_db_users")
-def run_enrich_db_users():
+@click.option(
+    "--restart", is_flag=True, help="Ignore the checkpoint of an interrupted run"
+)
+def run_enrich_db_users(restart):
     try:
-        enrich_db_users()
+        enrich_db_users(resume=not restart)
     except:
         logger.exception("DB users enrichment stopped")
         sys.exit(1)
 
 
+@cli.command(name="steam_api_standin")
+@click.option("-h", "--host", default="127.0.0.1")
+@click.option("-p", "--port", default=8765)
+@click.option("-l", "--latency-ms", default=0)
+def run_steam_api_standin(host, port, latency_ms):
+    from rcon.steam_api_standin import make_standin_server
+
+    server = make_standin_server(host=host, port=port, latency_ms=latency_ms)
+    print(f"Steam API stand-in listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+@cli.command(name="steam_api_benchmark")
+@click.option("-n", "--nb-players", default=1000)
+@click.option("-s", "--nb-single-lookups", default=200)
+def run_steam_api_benchmark(nb_players, nb_single_lookups):
+    from pprint import pprint
+
+    from rcon.steam_api_standin import run_benchmark
+    from rcon.steam_client import get_steam_client
+    from rcon.steam_utils import get_steam_api_key
+
+    client = get_steam_client(get_steam_api_key() or "standin")
+    pprint(run_benchmark(client, nb_players, nb_single_lookups))
+
+
+@cli.command(name="server_stats_benchmark")
+@click.option("-d", "--days", default=30)
+@click.option("-p", "--players", default=3000)
+@click.option("--no-reference", is_flag=True, help="Only time the sweep line engine")
+def run_server_stats_benchmark(days, players, no_reference):
+    """Time the per minute server occupancy on synthetic sessions"""
+    from pprint import pprint
+
+    from rcon.server_stats_benchmark import run_benchmark
+
+    pprint(run_benchmark(days, players, with_reference=not no_reference))
+
+
+@cli.command(name="game_server_standin")
+@click.option("--port", default=7779)
+@click.option("--slow-ms", default=3000)
+def run_game_server_standin(port, slow_ms):
+    """Serve a stand-in game server to load test the API against"""
+    from rcon.game_server_standin import serve
+
+    serve(port, slow_ms=slow_ms)
+
+
+@cli.command(name="api_load_test")
+@click.option("--nb-slow", default=20)
+@click.option("--nb-fast", default=50)
+@click.option("--slow-ms", default=3000)
+@click.option("--nb-threads", default=8, help="Threads of the sync API workers")
+@click.option("--timeout-secs", default=2)
+@click.option("--api-url", help="Load test this API, its game server the stand-in")
+@click.option("--sessionid", help="The session cookie of a user of the API")
+def run_api_load_test(
+    nb_slow, nb_fast, slow_ms, nb_threads, timeout_secs, api_url, sessionid
+):
+    """Compare the sync workers and the command executor on a slow stand-in server,
+    or send the burst to a running API with --api-url"""
+    from pprint import pprint
+
+    from rcon.game_server_standin import run_api_load_test, run_load_test
+
+    if api_url:
+        pprint(run_api_load_test(api_url, sessionid, nb_slow=nb_slow, nb_fast=nb_fast))
+        return
+
+    pprint(
+        run_load_test(
+            nb_slow=nb_slow,
+            nb_fast=nb_fast,
+            slow_ms=slow_ms,
+            nb_threads=nb_threads,
+            timeout_secs=timeout_secs,
+        )
+    )
+
+
 @cli.command(name="log_loop")
 def run_log_loop():
     try:
@@ -110,6 +225,151 @@ def run_log_recorder(frequency_min, now):
     game_logs.LogRecorder(frequency_min, now).run()
 
 
+@cli.command(name="create_log_lines_partitions")
+@click.option("-m", "--months-ahead", default=2)
+def run_create_log_lines_partitions(months_ahead):
+    from rcon.log_partitions import create_log_partitions
+
+    print(f"Created partitions: {create_log_partitions(months_ahead)}")
+
+
+@cli.command(name="detach_old_log_lines_partitions")
+@click.argument("retention_months", type=int)
+@click.option("--drop", is_flag=True, help="Drop the partitions instead of detaching")
+def run_detach_old_log_lines_partitions(retention_months, drop):
+    from rcon.log_partitions import detach_old_log_partitions
+
+    print(f"Removed partitions: {detach_old_log_partitions(retention_months, drop)}")
+
+
+@cli.command(name="explain_historical_logs")
+@click.option("--from", "from_", type=click.DateTime(), default=None)
+@click.option("--till", type=click.DateTime(), default=None)
+@click.option("-p", "--player-name", default=None)
+@click.option("-a", "--action", default=None)
+@click.option("-s", "--server", default=None)
+def run_explain_historical_logs(from_, till, player_name, action, server):
+    """Print the plan of the historical logs query and the partitions it scans"""
+    from rcon.game_logs import get_historical_logs_query
+    from rcon.log_partitions import explain_query, scanned_partitions
+    from rcon.models import enter_session
+
+    with enter_session() as sess:
+        plan = explain_query(
+            sess,
+            get_historical_logs_query(
+                sess,
+                player_name=player_name,
+                action=action,
+                from_=from_,
+                till=till,
+                server_filter=server,
+            ),
+        )
+    print("\n".join(plan))
+    print(f"Scanned partitions: {scanned_partitions(plan)}")
+
+
+@cli.command(name="log_search_benchmark")
+@click.argument("db_url")
+@click.option("-r", "--rows", default=10_000_000)
+@click.option("-p", "--players", default=200_000)
+@click.option("--no-generate", is_flag=True, help="Reuse the data already generated")
+@click.option("-v", "--verbose", is_flag=True, help="Print the query plans")
+def run_log_search_benchmark(db_url, rows, players, no_generate, verbose):
+    """Time the log and player searches on a scratch DB filled with synthetic data"""
+    from rcon.log_search_benchmark import run_benchmark
+
+    results = run_benchmark(
+        db_url, nb_rows=rows, nb_players=players, generate=not no_generate
+    )
+    for label, result in results.items():
+        print(f"{label}: {result['ms']} ms")
+        if verbose:
+            print("\n".join(result["plan"]))
+
+
+@cli.command(name="backfill_player_stats")
+@click.argument("start", type=click.DateTime())
+@click.argument("end", type=click.DateTime(), required=False)
+@click.option("-s", "--server-number", type=int, default=None)
+@click.option(
+    "--force", is_flag=True, help="Overwrite the stats that were already recorded"
+)
+@click.option("-w", "--workers", default=4, help="Number of processes")
+@click.option(
+    "--restart", is_flag=True, help="Ignore the progress of an interrupted run"
+)
+def run_backfill_player_stats(start, end, server_number, force, workers, restart):
+    """Recompute the players stats of the maps started between START and END"""
+    from rcon.stats_backfill import backfill_player_stats
+
+    def print_progress(progress):
+        print(
+            "{done}/{total} maps, {failed} failed, {inserted} stats inserted, "
+            "{updated} updated, {maps_per_sec} maps/s, ETA {eta_secs}s".format(
+                **progress
+            )
+        )
+
+    progress = backfill_player_stats(
+        start,
+        end,
+        server_number=server_number,
+        force=force,
+        workers=workers,
+        resume=not restart,
+        on_progress=print_progress,
+    )
+    print_progress(progress)
+    if progress["failed"]:
+        sys.exit(1)
+
+
+@cli.command(name="compare_stats_engines")
+@click.argument("start", type=click.DateTime())
+@click.argument("end", type=click.DateTime(), required=False)
+@click.option("-s", "--server-number", type=int, default=None)
+def run_compare_stats_engines(start, end, server_number):
+    """Compare the line by line and columnar stats of the maps started between START and END"""
+    import time
+
+    from rcon.columnar_stats import ColumnarTimeWindowStats, diff_players_stats
+    from rcon.models import Maps, enter_session
+    from rcon.scoreboard import TimeWindowStats
+    from rcon.stats_backfill import get_maps_to_backfill
+
+    reference, columnar = TimeWindowStats(), ColumnarTimeWindowStats()
+    with enter_session() as sess:
+        map_ids = get_maps_to_backfill(
+            sess, start, end or datetime.now(), server_number
+        )
+        maps = [
+            (m.id, m.start, m.end, str(m.server_number))
+            for m in sess.query(Maps).filter(Maps.id.in_(map_ids)).order_by(Maps.start)
+        ]
+
+    nb_diffs = 0
+    for map_id, map_start, map_end, server in maps:
+        started = time.perf_counter()
+        expected = reference.get_players_stats_at_time(map_start, map_end, server)
+        reference_secs = time.perf_counter() - started
+        started = time.perf_counter()
+        actual = columnar.get_players_stats_at_time(map_start, map_end, server)
+        columnar_secs = time.perf_counter() - started
+
+        diffs = diff_players_stats(expected, actual)
+        nb_diffs += len(diffs)
+        print(
+            f"Map {map_id}: {len(expected)} players, {len(diffs)} differences, "
+            f"line by line {reference_secs:.2f}s, columnar {columnar_secs:.2f}s"
+        )
+        for diff in diffs:
+            print(f"  {diff}")
+    if nb_diffs:
+        sys.exit(1)
+
+
 def init(force=False):
     # init_db(force)
     install_unaccent()
@@ -206,9 +466,12 @@ def process_games(start_day_offset, end_day_offset=0, force=False):
         for map_ in all_maps:
             print("Reprocessing map: ", map_.to_dict())
             try:
-                record_stats_from_map(sess, map_, dict(), force=force)
+                counts = record_stats_from_map(sess, map_, dict(), force=force)
                 sess.commit()
-                print("Done")
+                print(
+                    "Done: %(inserted)s players stats inserted, %(updated)s updated"
+                    % counts
+                )
             except IntegrityError as e:
                 sess.rollback()
                 # logger.exception("Failed")
@@ -0,0 +1,436 @@
+"""Columnar implementation of the TimeWindowStats scoreboard
+
+TimeWindowStats walks the logs of the time window line by line for every
+player. Here the lines are loaded as columns in a DataFrame (only the columns
+the stats need, no ORM objects) and every stat is computed with grouped
+operations. The result has the same shape as
+`TimeWindowStats.get_players_stats_at_time`, `diff_players_stats` compares
+the output of both engines.
+"""
+
+import datetime
+import logging
+import os
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.orm import aliased
+
+from rcon.game_logs import get_historical_logs_query
+from rcon.models import LogLine, PlayerSteamID, enter_session
+from rcon.player_history import get_player_profile_by_steam_ids
+from rcon.scoreboard import TimeWindowStats
+
+logger = logging.getLogger(__name__)
+
+LOG_COLUMNS = [
+    "event_time",
+    "log_time",
+    "action",
+    "player",
+    "steam_id_64_1",
+    "player2",
+    "steam_id_64_2",
+    "weapon",
+    "raw",
+]
+# Lowercase, the weapon of older kill lines is only in the raw line
+KILL_ACTIONS = ("kill", "team kill")
+# Stats compared as numbers by diff_players_stats, the others must be equal
+NUMERIC_STATS = (
+    "kills",
+    "kills_streak",
+    "deaths",
+    "deaths_without_kill_streak",
+    "teamkills",
+    "teamkills_streak",
+    "deaths_by_tk",
+    "deaths_by_tk_streak",
+    "nb_vote_started",
+    "nb_voted_yes",
+    "nb_voted_no",
+    "longest_life_secs",
+    "shortest_life_secs",
+    "time_seconds",
+    "kills_per_minute",
+    "deaths_per_minute",
+    "kill_death_ratio",
+)
+
+
+def load_logs_frame(sess, from_, until, server_number=None) -> pd.DataFrame:
+    """Load the columns of the logs needed by the stats, in chronological order"""
+    steamid1 = aliased(PlayerSteamID)
+    steamid2 = aliased(PlayerSteamID)
+    query = get_historical_logs_query(
+        sess,
+        from_=from_,
+        till=until,
+        time_sort="asc",
+        server_filter=server_number,
+        limit=None,
+    )
+    # The raw line is only needed for the votes and the kills recorded before
+    # the weapon column existed
+    raw = case(
+        [
+            (
+                or_(
+                    LogLine.type == "VOTE",
+                    and_(
+                        func.lower(LogLine.type).in_(KILL_ACTIONS),
+                        func.coalesce(LogLine.weapon, "") == "",
+                    ),
+                ),
+                LogLine.raw,
+            )
+        ],
+        else_=None,
+    )
+    rows = (
+        query.outerjoin(steamid1, LogLine.player1_steamid == steamid1.id)
+        .outerjoin(steamid2, LogLine.player2_steamid == steamid2.id)
+        .with_entities(
+            LogLine.event_time,
+            LogLine.type,
+            LogLine.player1_name,
+            steamid1.steam_id_64,
+            LogLine.player2_name,
+            steamid2.steam_id_64,
+            LogLine.weapon,
+            raw,
+        )
+        .all()
+    )
+    df = pd.DataFrame.from_records(
+        rows,
+        columns=[c for c in LOG_COLUMNS if c != "log_time"],
+    )
+    df["event_time"] = pd.to_datetime(df["event_time"])
+    # What the line by line engine gets from the timestamp_ms of the lines
+    df["log_time"] = df["event_time"].dt.floor("ms")
+
+    missing_weapon = df["action"].str.lower().isin(KILL_ACTIONS) & (
+        df["weapon"].fillna("") == ""
+    )
+    df.loc[missing_weapon, "weapon"] = (
+        df.loc[missing_weapon, "raw"].str.rsplit(" with ", n=1).str[-1]
+    )
+    return df[LOG_COLUMNS]
+
+
+def logs_frame_from_dicts(logs) -> pd.DataFrame:
+    """Build the frame from structured log lines, from redis or compatible_dict()"""
+    # Naive local times without the milliseconds, like LogLine.event_time
+    records = [
+        (
+            log.get(
+                "event_time",
+                datetime.datetime.fromtimestamp(log["timestamp_ms"] // 1000),
+            ),
+            datetime.datetime.fromtimestamp(log["timestamp_ms"] / 1000),
+            log["action"],
+            log.get("player"),
+            log.get("steam_id_64_1"),
+            log.get("player2"),
+            log.get("steam_id_64_2"),
+            log.get("weapon"),
+            log.get("raw"),
+        )
+        for log in logs
+    ]
+    df = pd.DataFrame.from_records(records, columns=LOG_COLUMNS)
+    df["event_time"] = pd.to_datetime(df["event_time"])
+    df["log_time"] = pd.to_datetime(df["log_time"])
+    return df
+
+
+def _by_player_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """One row per (line, player) for each player named in a line
+
+    The rows of a player are in the order the line by line engine sees them
+    """
+    df = df.reset_index(drop=True)
+    df["seq"] = np.arange(len(df))
+    parts = []
+    for role, (name_col, steam_id_col) in enumerate(
+        (("player", "steam_id_64_1"), ("player2", "steam_id_64_2"))
+    ):
+        part = df[df[name_col].notna() & (df[name_col] != "")].copy()
+        part["name"] = part[name_col]
+        part["steam_id_64"] = part[steam_id_col]
+        part["role"] = role
+        parts.append(part)
+    rows = pd.concat(parts, ignore_index=True)
+    # Sorting and grouping by an integer is much faster than by the names
+    rows["pid"] = pd.factorize(rows["name"])[0]
+    order = np.lexsort((rows["role"], rows["seq"], rows["pid"]))
+    return rows.iloc[order].reset_index(drop=True)
+
+
+def _sum_ns(times, players, index):
+    return times.astype("int64").groupby(players).sum().reindex(index, fill_value=0)
+
+
+def _session_times(rows, from_, until, warmup_secs, cooldown_secs):
+    """Return the (first appearance, total seconds) of the players
+
+    Same rules as TimeWindowStats._set_start_end_times: a session starts on a
+    CONNECTED or at the start of the window (plus the warmup) for the players
+    already there, it ends on a DISCONNECTED or at the end of the window (minus
+    the cooldown). Players with unbalanced sessions get no time.
+    """
+    is_connected = rows["action"] == "CONNECTED"
+    is_disconnected = rows["action"] == "DISCONNECTED"
+    not_disconnected = (~is_disconnected).astype(int)
+    # Number of lines other than disconnections seen before, the player has no
+    # session until then
+    seen_before = not_disconnected.groupby(rows["pid"]).cumsum() - not_disconnected
+
+    is_start = is_connected | ((not_disconnected == 1) & (seen_before == 0))
+    is_end = is_disconnected & (seen_before > 0)
+    window_start = pd.Timestamp(from_ + datetime.timedelta(seconds=warmup_secs))
+    starts = rows["event_time"].where(is_connected, window_start).where(is_start)
+
+    nb_starts = is_start.groupby(rows["pid"]).sum()
+    nb_ends = is_end.groupby(rows["pid"]).sum()
+    # Sum of the session durations = sum of the ends - sum of the starts
+    start_ns = _sum_ns(starts[is_start], rows["pid"][is_start], nb_starts.index)
+    end_ns = _sum_ns(rows["event_time"][is_end], rows["pid"][is_end], nb_starts.index)
+
+    window_end = pd.Timestamp(until - datetime.timedelta(seconds=cooldown_secs))
+    still_there = nb_starts == nb_ends + 1
+    end_ns = end_ns + still_there * window_end.value
+    nb_ends = nb_ends + still_there
+    total = ((end_ns - start_ns) / 1e9).where(
+        (nb_starts > 0) & (nb_starts == nb_ends), 0.0
+    )
+    first_start = starts[is_start].groupby(rows["pid"][is_start]).first()
+    return first_start, total
+
+
+def _max_streak(rows, increments, resets):
+    """Longest number of increments between two resets, by player"""
+    segment = resets.astype(int).groupby(rows["pid"]).cumsum()
+    per_segment = increments.astype(int).groupby([rows["pid"], segment]).sum()
+    return per_segment.groupby(level=0).max()
+
+
+def _counts_by(rows, mask, key):
+    counts = defaultdict(dict)
+    grouped = rows.loc[mask].groupby(["pid", key], sort=False, dropna=False).size()
+    for (pid, value), count in grouped.items():
+        counts[pid][None if pd.isna(value) else value] = int(count)
+    return counts
+
+
+def compute_players_stats(
+    df: pd.DataFrame,
+    from_: datetime.datetime,
+    until: datetime.datetime,
+    warmup_secs=180,
+    cooldown_secs=100,
+) -> dict[str, dict]:
+    """Compute the stats of the players of the logs, by player name
+
+    The combat, offense, defense, support are 0 and steaminfo is None, they
+    come from elsewhere
+    """
+    if df.empty:
+        return {}
+    rows = _by_player_rows(df)
+    if rows.empty:
+        return {}
+    first_start, total_time = _session_times(
+        rows, from_, until, warmup_secs, cooldown_secs
+    )
+
+    action = rows["action"]
+    is_kill = rows["player"] == rows["name"]
+    is_death = rows["player2"] == rows["name"]
+    kill = action == "KILL"
+    team_kill = action == "TEAM KILL"
+    kills = kill & is_kill
+    deaths = kill & is_death & ~is_kill
+    teamkills = team_kill & is_kill
+    is_vote = action == "VOTE"
+    votes = rows.loc[is_vote, "raw"].fillna("")
+    voted_no = pd.Series(False, index=rows.index)
+    voted_no[is_vote] = votes.str.contains("PV_Against", regex=False)
+    voted_yes = pd.Series(False, index=rows.index)
+    voted_yes[is_vote] = ~voted_no[is_vote] & votes.str.contains(
+        "PV_Favour", regex=False
+    )
+
+    by_player = rows["pid"]
+    counters = (
+        pd.DataFrame(
+            {
+                "kills": kills,
+                "deaths": deaths,
+                "teamkills": teamkills,
+                "deaths_by_tk": team_kill & is_death & ~is_kill,
+                "nb_vote_started": action == "VOTE STARTED",
+                "nb_voted_yes": voted_yes,
+                "nb_voted_no": voted_no,
+            }
+        )
+        .astype(int)
+        .groupby(by_player)
+        .sum()
+    )
+    streaks = pd.DataFrame(
+        {
+            "kills_streak": _max_streak(rows, kills, deaths),
+            "deaths_without_kill_streak": _max_streak(rows, deaths, kills),
+            "teamkills_streak": _max_streak(rows, teamkills, kills),
+            "deaths_by_tk_streak": _max_streak(rows, team_kill & is_death, deaths),
+        }
+    )
+
+    # Life times: a death or a connection is a spawn, a death or a disconnection
+    # ends a life. The first spawn is the first appearance of the player
+    died = deaths | (team_kill & is_death)
+    is_disconnected = action == "DISCONNECTED"
+    is_spawn = died | (action == "CONNECTED")
+    spawns = rows["log_time"].where(is_spawn)
+    last_spawn = spawns.groupby(by_player).ffill().groupby(by_player).shift(1)
+    initial_spawn = by_player.map(first_start)
+    # Players only seen disconnecting have no first appearance, their first
+    # disconnection is used as the spawn instead
+    first_row = ~by_player.duplicated()
+    no_appearance = initial_spawn.isna()
+    initial_spawn = initial_spawn.fillna(
+        rows["log_time"].where(first_row).groupby(by_player).transform("first")
+    )
+    last_spawn = last_spawn.fillna(initial_spawn)
+    ends_life = (died | is_disconnected) & ~(no_appearance & first_row)
+    lives = (rows["log_time"] - last_spawn).dt.total_seconds().where(ends_life)
+    longest = lives.groupby(by_player).max()
+    shortest = lives.groupby(by_player).min()
+    final_spawn = spawns.groupby(by_player).last().reindex(longest.index)
+    final_spawn = final_spawn.fillna(initial_spawn.groupby(by_player).first())
+
+    weapons = _counts_by(rows, kills, "weapon")
+    most_killed = _counts_by(rows, kills, "player2")
+    death_by_weapons = _counts_by(rows, kill & is_death, "weapon")
+    death_by = _counts_by(rows, kill & is_death, "player")
+
+    # A name seen with several steam IDs gets the first one
+    players = rows[rows["steam_id_64"].notna() & (rows["steam_id_64"] != "")]
+    players = players.drop_duplicates("pid")
+    stats_by_player = {}
+    for pid, name, steam_id_64 in zip(
+        players["pid"], players["name"], players["steam_id_64"]
+    ):
+        longest_life = longest.get(pid)
+        shortest_life = shortest.get(pid)
+        time_seconds = float(total_time.get(pid, 0))
+        stats = {
+            "player": name,
+            "steam_id_64": steam_id_64,
+            "steaminfo": None,
+            "kills": int(counters.at[pid, "kills"]),
+            "kills_streak": int(streaks.at[pid, "kills_streak"]),
+            "deaths": int(counters.at[pid, "deaths"]),
+            "death_by_weapons": death_by_weapons.get(pid, {}),
+            "deaths_without_kill_streak": int(
+                streaks.at[pid, "deaths_without_kill_streak"]
+            ),
+            "teamkills": int(counters.at[pid, "teamkills"]),
+            "teamkills_streak": int(streaks.at[pid, "teamkills_streak"]),
+            "deaths_by_tk": int(counters.at[pid, "deaths_by_tk"]),
+            "deaths_by_tk_streak": int(streaks.at[pid, "deaths_by_tk_streak"]),
+            "nb_vote_started": int(counters.at[pid, "nb_vote_started"]),
+            "nb_voted_yes": int(counters.at[pid, "nb_voted_yes"]),
+            "nb_voted_no": int(counters.at[pid, "nb_voted_no"]),
+            "longest_life_secs": (
+                max(float(longest_life), 0) if pd.notna(longest_life) else 0
+            ),
+            "shortest_life_secs": (
+                min(float(shortest_life), 9999) if pd.notna(shortest_life) else 9999
+            ),
+            "last_spawn": final_spawn[pid].to_pydatetime(),
+            "time_seconds": time_seconds,
+            "weapons": weapons.get(pid, {}),
+            "death_by": death_by.get(pid, {}),
+            "most_killed": most_killed.get(pid, {}),
+            "combat": 0,
+            "offense": 0,
+            "defense": 0,
+            "support": 0,
+        }
+        stats_by_player[name] = stats
+    return stats_by_player
+
+
+class ColumnarTimeWindowStats(TimeWindowStats):
+    """Drop-in replacement of TimeWindowStats computing the stats with pandas"""
+
+    def _get_players_stats_for_frame(
+        self, df, from_, until, offset_cooldown_time_seconds=100
+    ):
+        stats_by_player = compute_players_stats(
+            df, from_, until, cooldown_secs=offset_cooldown_time_seconds
+        )
+        with enter_session() as sess:
+            profiles_by_id = {
+                profile.steam_id_64: profile
+                for profile in get_player_profile_by_steam_ids(
+                    sess, [s["steam_id_64"] for s in stats_by_player.values()]
+                )
+            }
+            for name, stats in stats_by_player.items():
+                profile = profiles_by_id.get(stats["steam_id_64"])
+                if profile and profile.steaminfo:
+                    stats["steaminfo"] = profile.steaminfo.to_dict()
+                stats_by_player[name] = self._compute_stats(stats)
+        return stats_by_player
+
+    def _get_players_stats_for_logs(
+        self,
+        logs,
+        from_,
+        until,
+        offset_warmup_time_seconds=120,
+        offset_cooldown_time_seconds=100,
+    ):
+        return self._get_players_stats_for_frame(
+            logs_frame_from_dicts(logs),
+            from_,
+            until,
+            offset_cooldown_time_seconds=offset_cooldown_time_seconds,
+        )
+
+    def get_players_stats_at_time(self, from_, until, server_number=None):
+        server_number = server_number or os.getenv("SERVER_NUMBER")
+        with enter_session() as sess:
+            df = load_logs_frame(sess, from_, until, server_number)
+        return self._get_players_stats_for_frame(df, from_, until)
+
+
+def diff_players_stats(expected: dict, actual: dict, tolerance=0.01) -> list[str]:
+    """Return the differences between the output of two stats engines"""
+    diffs = []
+    for name in sorted(set(expected) | set(actual), key=str):
+        if name not in actual or name not in expected:
+            diffs.append(
+                f"{name}: only in {'expected' if name in expected else 'actual'}"
+            )
+            continue
+        for key, value in expected[name].items():
+            other = actual[name].get(key)
+            if key in NUMERIC_STATS:
+                if abs((value or 0) - (other or 0)) > tolerance:
+                    diffs.append(f"{name}.{key}: {value} != {other}")
+            elif key == "last_spawn":
+                if isinstance(value, datetime.datetime) and (
+                    not isinstance(other, datetime.datetime)
+                    or abs((value - other).total_seconds()) > tolerance
+                ):
+                    diffs.append(f"{name}.{key}: {value} != {other}")
+            elif value != other:
+                diffs.append(f"{name}.{key}: {value} != {other}")
+    return diffs
@@ -0,0 +1,224 @@
+"""Bounded executor for the game server commands of the API
+
+The commands run on a fixed pool of threads with a timeout per request. A
+timed out command keeps its thread and its game server connection until the
+server answers, so each command only runs `max_per_command` times at once and
+its other calls wait in its own queue: a stalled command can't take all the
+threads and the other commands keep being served.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable
+
+from rcon.commands import CommandFailedError
+from rcon.models import get_pool_settings
+
+logger = logging.getLogger(__name__)
+
+# Commands fanning out to every player, they get twice the timeout
+SLOW_COMMANDS = ("get_detailed_players", "get_team_view", "get_players")
+
+_EXECUTOR = None
+
+
+class CommandTimeoutError(CommandFailedError):
+    # The command already sent to the game server, it may still be applied
+    future: Future | None = None
+
+
+class CommandBusyError(CommandFailedError):
+    pass
+
+
+class CommandExecutor:
+    def __init__(
+        self,
+        max_workers: int,
+        max_per_command: int,
+        timeout_secs: float,
+        timeouts: dict[str, float] | None = None,
+        max_waiting_per_command=50,
+    ):
+        self.pool = ThreadPoolExecutor(max_workers, thread_name_prefix="rcon_command")
+        self.max_per_command = max_per_command
+        self.max_waiting_per_command = max_waiting_per_command
+        self.timeout_secs = timeout_secs
+        self.timeouts = timeouts or {}
+        self._lock = threading.Lock()
+        self._running: dict[str, int] = {}
+        self._waiting: dict[str, deque] = {}
+
+    def get_timeout(self, name: str) -> float:
+        return self.timeouts.get(name, self.timeout_secs)
+
+    def running(self, name: str) -> int:
+        return self._running.get(name, 0)
+
+    def waiting(self, name: str) -> int:
+        return len(self._waiting.get(name, ()))
+
+    def submit(self, name: str, func: Callable, arguments: dict) -> Future:
+        """The future of the command, it waits for a slot of the command if they
+        are all taken"""
+        future = Future()
+        with self._lock:
+            if self.running(name) < self.max_per_command:
+                self._running[name] = self.running(name) + 1
+            elif self.waiting(name) < self.max_waiting_per_command:
+                self._waiting.setdefault(name, deque()).append(
+                    (future, func, arguments)
+                )
+                return future
+            else:
+                raise CommandBusyError(
+                    f"Too many {name} commands waiting, try again later"
+                )
+        self._start(name, future, func, arguments)
+        return future
+
+    def _start(self, name, future: Future, func, arguments):
+        if not future.set_running_or_notify_cancel():
+            # Timed out while waiting
+            self._start_next(name)
+            return
+        try:
+            command = self.pool.submit(func, **arguments)
+        except Exception as e:
+            future.set_exception(e)
+            self._start_next(name)
+            return
+        command.add_done_callback(lambda c: self._done(name, future, c))
+
+    def _done(self, name, future: Future, command: Future):
+        if (exception := command.exception()) is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(command.result())
+        self._start_next(name)
+
+    def _start_next(self, name):
+        """Give the slot of a command that finished to its next call"""
+        with self._lock:
+            waiting = self._waiting.get(name)
+            while waiting:
+                future, func, arguments = waiting.popleft()
+                if not future.cancelled():
+                    break
+            else:
+                self._running[name] -= 1
+                return
+        self._start(name, future, func, arguments)
+
+    def run(self, name: str, func: Callable, arguments: dict):
+        """Run the command and wait for its result, for the sync views"""
+        future = self.submit(name, func, arguments)
+        timeout = self.get_timeout(name)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise self._timeout_error(future, f"{name} took more than {timeout}s")
+
+    @staticmethod
+    def _timeout_error(future: Future, message: str) -> CommandTimeoutError:
+        error = CommandTimeoutError(message)
+        # Only drops it if it is still waiting for a slot
+        if not future.cancel():
+            error.future = future
+        return error
+
+    def run_many(
+        self,
+        calls: list[tuple[str, Callable, dict]],
+        max_concurrent: int,
+        max_duration_secs: float | None = None,
+    ) -> list[tuple[Any, Exception | None]]:
+        """Run the (name, func, arguments) calls with at most `max_concurrent` of
+        them at once, for the batch views
+
+        The results are `(result, None)` or `(None, exception)` in the order of
+        the calls, each call gets the timeout of its command from its submission
+        and a timed out call no longer holds up the rest of the batch. Nothing
+        is waited for past `max_duration_secs`, the calls left time out.
+        """
+        batch_deadline = (
+            time.monotonic() + max_duration_secs if max_duration_secs else None
+        )
+        slots = threading.Condition()
+        # The calls taking a slot, with their deadline
+        in_flight: list[tuple[Future, float]] = []
+
+        def release(_):
+            with slots:
+                slots.notify()
+
+        submitted = []
+        for name, func, arguments in calls:
+            timeout = self.get_timeout(name)
+            deadline = time.monotonic() + timeout
+            error = f"{name} took more than {timeout}s"
+            if batch_deadline is not None and batch_deadline < deadline:
+                deadline = batch_deadline
+                error = f"The batch took more than {max_duration_secs}s"
+            future = Future()
+            with slots:
+                while True:
+                    now = time.monotonic()
+                    in_flight[:] = [
+                        (f, d) for f, d in in_flight if not f.done() and d > now
+                    ]
+                    if len(in_flight) < max_concurrent or now >= deadline:
+                        break
+                    slots.wait(min(deadline, *(d for _, d in in_flight)) - now)
+
+                if now >= deadline:
+                    future.set_exception(CommandTimeoutError(error))
+                else:
+                    try:
+                        future = self.submit(name, func, arguments)
+                        in_flight.append((future, deadline))
+                    except CommandBusyError as e:
+                        future.set_exception(e)
+            future.add_done_callback(release)
+            submitted.append((future, deadline, error))
+
+        results = []
+        for future, deadline, error in submitted:
+            try:
+                result = future.result(timeout=max(0, deadline - time.monotonic()))
+                results.append((result, None))
+            except FutureTimeoutError:
+                results.append((None, self._timeout_error(future, error)))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    async def arun(self, name: str, func: Callable, arguments: dict):
+        """Run the command and await its result, for the async views"""
+        future = self.submit(name, func, arguments)
+        timeout = self.get_timeout(name)
+        try:
+            # Cancels the future on timeout
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            raise self._timeout_error(future, f"{name} took more than {timeout}s")
+
+
+def get_command_executor() -> CommandExecutor:
+    global _EXECUTOR
+
+    if _EXECUTOR is None:
+        settings = get_pool_settings()
+        timeout = settings.api_command_timeout_secs
+        _EXECUTOR = CommandExecutor(
+            max_workers=settings.thread_pool_size,
+            max_per_command=settings.api_max_concurrent_per_command,
+            timeout_secs=timeout,
+            timeouts={name: timeout * 2 for name in SLOW_COMMANDS},
+        )
+    return _EXECUTOR
@@ -0,0 +1,200 @@
+"""SQLAlchemy engine pool with checkout metrics
+
+Every process (the API workers, the loops, the rq workers) has its own engine
+and pool. Each of them periodically publishes how many connections it has in
+use and how long checkouts waited in a redis hash, `get_db_pool_metrics`
+returns the metrics of all the processes.
+"""
+
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+import simplejson
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "db_pool_metrics"
+PUBLISH_EVERY_SECS = 15
+# Processes that stopped publishing are ignored after that
+METRICS_MAX_AGE_SECS = 5 * 60
+
+
+class PoolMetrics:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.wait_total_secs = 0.0
+        # Reset every time the metrics are published
+        self.window_checkouts = 0
+        self.window_wait_secs = 0.0
+        self.window_wait_max_secs = 0.0
+        self.last_publish = clock()
+
+    def record_wait(self, secs: float):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total_secs += secs
+            self.window_checkouts += 1
+            self.window_wait_secs += secs
+            self.window_wait_max_secs = max(self.window_wait_max_secs, secs)
+
+    def checked_out(self):
+        with self.lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def checked_in(self):
+        with self.lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def snapshot(self, reset_window=False) -> dict:
+        with self.lock:
+            avg = (
+                self.window_wait_secs / self.window_checkouts
+                if self.window_checkouts
+                else 0
+            )
+            snapshot = {
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "wait_total_ms": round(self.wait_total_secs * 1000, 3),
+                "wait_avg_ms": round(avg * 1000, 3),
+                "wait_max_ms": round(self.window_wait_max_secs * 1000, 3),
+            }
+            if reset_window:
+                self.window_checkouts = 0
+                self.window_wait_secs = 0.0
+                self.window_wait_max_secs = 0.0
+                self.last_publish = self.clock()
+                self.peak_in_use = self.in_use
+            return snapshot
+
+    def should_publish(self) -> bool:
+        return self.clock() - self.last_publish >= PUBLISH_EVERY_SECS
+
+
+METRICS = PoolMetrics()
+
+
+class _TimedCheckout:
+    """Time how long getting a connection from the pool takes
+
+    With a QueuePool that's mostly the wait for a connection to be returned
+    when all of them are in use, with a NullPool it's the connection time
+    """
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            METRICS.record_wait(time.monotonic() - started)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    pass
+
+
+def _process_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _process_name():
+    return " ".join(os.path.basename(arg) for arg in sys.argv[:2])
+
+
+def publish_pool_metrics(settings: dict | None = None):
+    from rcon.cache_utils import get_redis_client
+
+    metrics = METRICS.snapshot(reset_window=True)
+    metrics.update(
+        process=_process_name(), timestamp=time.time(), settings=settings or {}
+    )
+    red = get_redis_client()
+    red.hset(METRICS_KEY, _process_id(), simplejson.dumps(metrics))
+    red.expire(METRICS_KEY, METRICS_MAX_AGE_SECS)
+
+
+def get_db_pool_metrics() -> dict[str, dict]:
+    """Return the last metrics published by each process, by hostname:pid"""
+    from rcon.cache_utils import get_redis_client
+
+    red = get_redis_client()
+    now = time.time()
+    metrics = {}
+    for process_id, raw in red.hgetall(METRICS_KEY).items():
+        try:
+            data = simplejson.loads(raw)
+        except ValueError:
+            continue
+        if now - data.get("timestamp", 0) > METRICS_MAX_AGE_SECS:
+            red.hdel(METRICS_KEY, process_id)
+            continue
+        metrics[process_id] = data
+    return metrics
+
+
+def create_pooled_engine(
+    url: str,
+    pool_size: int,
+    max_overflow: int,
+    pool_pre_ping: bool,
+    pool_recycle: int,
+    pgbouncer: bool = False,
+):
+    """Create the engine of the process
+
+    In pgbouncer mode the connections are pooled by pgbouncer, the engine opens
+    a connection per session and doesn't keep any session state around
+    """
+    settings = dict(
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=pool_pre_ping,
+        pool_recycle=pool_recycle,
+        pgbouncer=pgbouncer,
+    )
+    if pgbouncer:
+        engine = create_engine(
+            url, echo=False, poolclass=TimedNullPool, pool_pre_ping=pool_pre_ping
+        )
+    else:
+        engine = create_engine(
+            url,
+            echo=False,
+            poolclass=TimedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=pool_pre_ping,
+            pool_recycle=pool_recycle,
+        )
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(*_):
+        METRICS.checked_out()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(*_):
+        METRICS.checked_in()
+        if not METRICS.should_publish():
+            return
+        try:
+            publish_pool_metrics(settings)
+        except Exception:
+            logger.debug("Unable to publish the DB pool metrics", exc_info=True)
+
+    return engine
@@ -0,0 +1,167 @@
+"""Forwarding of the API requests to the other CRCON servers
+
+The requests are sent to all the servers at once, on keep-alive connections
+shared by the process, and each server gets a result, failures included:
+
+    {"host": ..., "ok": True, "status_code": 200, "response": {...},
+     "error": None, "elapsed_ms": 42}
+
+A call never takes more than the overall deadline, the servers that didn't
+answer in time are reported as failed.
+"""
+
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rcon.utils import ApiKey
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT_SECS = 5
+DEADLINE_SECS = 8
+MAX_CONCURRENT_HOSTS = 16
+# How long the results of a forward job are kept
+JOB_RESULT_TTL_SECS = 60 * 10
+
+_SESSION = None
+_POOL = None
+
+
+def get_http_session() -> requests.Session:
+    global _SESSION
+
+    if _SESSION is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=MAX_CONCURRENT_HOSTS, pool_maxsize=MAX_CONCURRENT_HOSTS
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # The session is shared by all the users, the cookies of each request
+        # are passed along with it and never kept
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        _SESSION = session
+    return _SESSION
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _POOL
+
+    if _POOL is None:
+        _POOL = ThreadPoolExecutor(MAX_CONCURRENT_HOSTS, thread_name_prefix="forward")
+    return _POOL
+
+
+def get_other_hosts() -> list[str]:
+    api_key = ApiKey()
+    my_key = api_key.get_key()
+    return [host for host, key in api_key.get_all_keys().items() if key != my_key]
+
+
+def _request_host(host, path, params, json, cookies, timeout):
+    started = time.monotonic()
+    result = {"host": host, "ok": False, "status_code": None, "response": None}
+    try:
+        res = get_http_session().get(
+            f"http://{host}{path}",
+            params=params,
+            json=json,
+            timeout=timeout,
+            cookies=cookies,
+        )
+        result["status_code"] = res.status_code
+        result["ok"] = res.ok
+        try:
+            result["response"] = res.json()
+        except ValueError:
+            result["response"] = res.text
+        result["error"] = None if res.ok else f"HTTP {res.status_code}"
+    except requests.exceptions.RequestException as e:
+        logger.warning("Unable to connect with %s: %s", host, e)
+        result["error"] = repr(e)
+    result["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+    return result
+
+
+def fan_out(
+    hosts,
+    path,
+    params=None,
+    json=None,
+    cookies=None,
+    timeout=REQUEST_TIMEOUT_SECS,
+    deadline=DEADLINE_SECS,
+) -> list[dict]:
+    """Send the request to all the hosts at once, the results are in the order
+    of the hosts"""
+    futures = {
+        host: _get_pool().submit(
+            _request_host, host, path, params, json, cookies, timeout
+        )
+        for host in hosts
+    }
+    wait(futures.values(), timeout=deadline)
+
+    results = []
+    for host, future in futures.items():
+        if future.done():
+            results.append(future.result())
+            continue
+        # Still running, its thread is freed by the request timeout
+        future.cancel()
+        logger.warning("%s did not answer %s within %ss", host, path, deadline)
+        results.append(
+            {
+                "host": host,
+                "ok": False,
+                "status_code": None,
+                "response": None,
+                "error": f"No answer within {deadline}s",
+                "elapsed_ms": round(deadline * 1000),
+            }
+        )
+    return results
+
+
+def forward_to_servers(path, params=None, json=None, sessionid=None) -> list[dict]:
+    """Send the request to all the other servers"""
+    results = fan_out(
+        get_other_hosts(),
+        path,
+        params=params,
+        json=json,
+        cookies=dict(sessionid=sessionid),
+    )
+    for result in results:
+        if result["ok"]:
+            logger.info("Forwarded %s to %s", path, result["host"])
+        else:
+            logger.warning(
+                "Forwarding %s to %s failed %s", path, result["host"], result["error"]
+            )
+    return results
+
+
+def enqueue_forward_to_servers(path, params=None, json=None, sessionid=None) -> str:
+    """Forward the request from a worker, the results are read with
+    `rcon.workers.get_job_results` and the returned job id"""
+    from rcon.workers import get_queue
+
+    job_id = f"forward_{uuid.uuid4().hex}"
+    get_queue().enqueue(
+        forward_to_servers,
+        path,
+        params=params,
+        json=json,
+        sessionid=sessionid,
+        job_id=job_id,
+        result_ttl=JOB_RESULT_TTL_SECS,
+        job_timeout=DEADLINE_SECS * 4,
+    )
+    return job_id
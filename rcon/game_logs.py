@@ -1,4 +1,6 @@
 import datetime
+import hashlib
+import json
 import logging
 import os
 import sys
@@ -6,12 +8,15 @@ import time
 import unicodedata
 from typing import Callable, Dict, List
 
-from sqlalchemy import and_, desc, or_
+from cachetools import LRUCache
+from sqlalchemy import Float, and_, cast, desc, func, literal_column, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 
 from rcon.cache_utils import get_redis_client
 from rcon.config import get_config
 from rcon.discord import send_to_discord_audit
+from rcon.live_updates import publish_updates
 from rcon.models import LogLine, PlayerSteamID, enter_session
 from rcon.player_history import (
     add_player_to_blacklist,
@@ -26,7 +31,7 @@ from rcon.types import (
     PlayerStat,
     StructuredLogLineWithMetaData,
 )
-from rcon.utils import FixedLenList, MapsHistory
+from rcon.utils import FixedLenList, MapPlayerStats, MapsHistory
 
 logger = logging.getLogger(__name__)
 
@@ -126,6 +131,9 @@ class LogLoop:
         self.red = get_redis_client()
         self.duplicate_guard_key = "unique_logs"
         self.log_history = self.get_log_history_list()
+        # The player scores last sent to the MapPlayerStats of the current map
+        self.player_stats_key = None
+        self.sent_player_stats: dict[str, PlayerStat] = {}
 
         logger.info("Registered hooks: %s", HOOKS)
 
@@ -143,10 +151,17 @@ class LogLoop:
                 since_min_ago=since_min
             )
             since_min = 5
+            new_lines = []
             for log in reversed(logs["logs"]):
                 line = self.record_line(log)
                 if line:
+                    new_lines.append(line)
                     self.process_hooks(line)
+            if new_lines:
+                try:
+                    publish_updates("logs", new_lines)
+                except Exception:
+                    logger.exception("Unable to publish the new log lines")
             if (
                 datetime.datetime.now() - last_cleanup_time
             ).total_seconds() >= cleanup_frequency_minutes * 60:
@@ -175,23 +190,26 @@ class LogLoop:
         # from the previous map may leak into the current one
         if m["start"] > datetime.datetime.now().timestamp() - 30:
             return
-        for steam_id in players:
-            player = players.get(steam_id)
-            map_players = m.setdefault("player_stats", dict())
-            p = map_players.get(
-                steam_id,
-                PlayerStat(
-                    combat=player["combat"],
-                    offense=player["offense"],
-                    defense=player["defense"],
-                    support=player["support"],
-                ),
+
+        map_stats = MapPlayerStats(m)
+        if map_stats.key != self.player_stats_key:
+            self.player_stats_key = map_stats.key
+            self.sent_player_stats = {}
+        # Only the players whose scores changed since the previous loop are sent,
+        # the merge in redis keeps the max of each score
+        changed = {}
+        for steam_id, player in players.items():
+            stat = PlayerStat(
+                combat=player["combat"],
+                offense=player["offense"],
+                defense=player["defense"],
+                support=player["support"],
             )
-            for stat in ["combat", "offense", "defense", "support"]:
-                if player[stat] > p[stat]:
-                    p[stat] = player[stat]
-            map_players[steam_id] = p
-        maps.update(0, m)
+            if self.sent_player_stats.get(steam_id) != stat:
+                changed[steam_id] = stat
+        if changed:
+            map_stats.merge(changed)
+            self.sent_player_stats.update(changed)
 
     def record_line(self, log: StructuredLogLineWithMetaData):
         id_ = f"{log['timestamp_ms']}|{log['line_without_time']}"
@@ -263,79 +281,173 @@ class LogLoop:
         )
 
 
+def log_line_hash(log: StructuredLogLineWithMetaData) -> str:
+    """Identify a line of the log history, several lines can share a timestamp"""
+    return hashlib.sha1(
+        f"{log['timestamp_ms']}|{log['line_without_time']}".encode()
+    ).hexdigest()
+
+
 class LogRecorder:
-    def __init__(self, dump_frequency_min=5, run_immediately=False):
+    watermark_key = "log_recorder_watermark"
+    _log_hash = staticmethod(log_line_hash)
+
+    def __init__(
+        self,
+        dump_frequency_min=5,
+        run_immediately=False,
+        insert_batch_size=1000,
+        steam_ids_cache_size=10000,
+    ):
         self.dump_frequency_min = dump_frequency_min
         self.run_immediately = run_immediately
         self.server_id = os.getenv("SERVER_NUMBER")
         if not self.server_id:
             raise ValueError("SERVER_NUMBER is not set, can't record logs")
+        self.insert_batch_size = insert_batch_size
+        self.steam_ids_cache = LRUCache(maxsize=steam_ids_cache_size)
+
+    def _get_watermark(self) -> dict | None:
+        watermark = get_redis_client().get(self.watermark_key)
+        return json.loads(watermark) if watermark else None
+
+    def _set_watermark(self, log: StructuredLogLineWithMetaData):
+        get_redis_client().set(
+            self.watermark_key,
+            json.dumps(
+                {"timestamp_ms": log["timestamp_ms"], "hash": self._log_hash(log)}
+            ),
+        )
 
     def _get_new_logs(self, sess):
+        """Return the lines of the log history newer than the watermark, newest first
+
+        The history is read from its head and only until the last recorded line
+        """
+        watermark = self._get_watermark()
+        if watermark:
+            min_timestamp_ms, last_hash = watermark["timestamp_ms"], watermark["hash"]
+        else:
+            # No watermark yet, start from the last line in the DB, event_time is
+            # stored in seconds so lines of that second are read again and skipped
+            # by the insert
+            last_log = (
+                sess.query(LogLine)
+                .filter(LogLine.server == self.server_id)
+                .order_by(desc(LogLine.event_time))
+                .limit(1)
+                .one_or_none()
+            )
+            min_timestamp_ms = (
+                int(last_log.event_time.timestamp()) * 1000 if last_log else 0
+            )
+            last_hash = None
+        logger.info("Getting new logs from %s", min_timestamp_ms)
+
         to_store: list[StructuredLogLineWithMetaData] = []
-        last_log = (
-            sess.query(LogLine)
-            .filter(LogLine.server == self.server_id)
-            .order_by(desc(LogLine.event_time))
-            .limit(1)
-            .one_or_none()
-        )
-        logger.info("Getting new logs from %s", last_log.event_time if last_log else 0)
+        seen = set()
         log: StructuredLogLineWithMetaData
-        for log in LogLoop.get_log_history_list():
+        for log in LogLoop.get_log_history_list().iter_chunked():
             if not isinstance(log, dict):
                 logger.warning("Log is invalid, not a dict: %s", log)
                 continue
-            if (
-                not last_log
-                or int(log["timestamp_ms"]) / 1000 > last_log.event_time.timestamp()
-            ):
-                to_store.append(log)
-            if (
-                last_log
-                and not int(log["timestamp_ms"]) / 1000
-                == last_log.event_time.timestamp()
-                and last_log.raw == log["raw"]
-            ):
+            if int(log["timestamp_ms"]) < min_timestamp_ms:
+                break
+            log_hash = self._log_hash(log)
+            if log_hash == last_hash:
                 logger.info("New logs collection at: %s", log)
-                return to_store
+                break
+            if log_hash not in seen:
+                seen.add(log_hash)
+                to_store.append(log)
         return to_store
 
-    def _get_steamid_record(self, sess, steam_id_64):
-        if not steam_id_64:
-            return None
-        return (
-            sess.query(PlayerSteamID)
-            .filter(PlayerSteamID.steam_id_64 == steam_id_64)
-            .one_or_none()
+    def _get_steamid_ids(self, sess, steam_ids_64) -> dict[str, int]:
+        """Map steam IDs to their PlayerSteamID.id, unknown players are left out
+
+        IDs not in the LRU are resolved with a single query
+        """
+        steam_ids_64 = {s for s in steam_ids_64 if s}
+        ids = {
+            s: self.steam_ids_cache[s]
+            for s in steam_ids_64
+            if s in self.steam_ids_cache
+        }
+        missing = steam_ids_64 - ids.keys()
+        if missing:
+            rows = (
+                sess.query(PlayerSteamID.steam_id_64, PlayerSteamID.id)
+                .filter(PlayerSteamID.steam_id_64.in_(missing))
+                .all()
+            )
+            for steam_id_64, id_ in rows:
+                ids[steam_id_64] = self.steam_ids_cache[steam_id_64] = id_
+        return ids
+
+    def _log_line_values(self, log: StructuredLogLineWithMetaData, steam_ids, now):
+        return dict(
+            version=log["version"],
+            creation_time=now,
+            event_time=datetime.datetime.fromtimestamp(log["timestamp_ms"] // 1000),
+            type=log["action"],
+            player1_name=log["player"],
+            player2_name=log["player2"],
+            player1_steamid=steam_ids.get(log["steam_id_64_1"]),
+            player2_steamid=steam_ids.get(log["steam_id_64_2"]),
+            raw=log["raw"],
+            content=log["message"],
+            server=self.server_id,
+            weapon=log["weapon"],
         )
 
-    def _save_logs(self, sess, to_store: list[StructuredLogLineWithMetaData]):
-        for log in to_store:
-            steamid_1 = self._get_steamid_record(sess, log["steam_id_64_1"])
-            steamid_2 = self._get_steamid_record(sess, log["steam_id_64_2"])
-            try:
-                sess.add(
-                    LogLine(
-                        version=log["version"],
-                        event_time=datetime.datetime.fromtimestamp(
-                            log["timestamp_ms"] // 1000
-                        ),
-                        type=log["action"],
-                        player1_name=log["player"],
-                        player2_name=log["player2"],
-                        steamid1=steamid_1,
-                        steamid2=steamid_2,
-                        raw=log["raw"],
-                        content=log["message"],
-                        server=os.getenv("SERVER_NUMBER"),
-                        weapon=log["weapon"],
-                    )
-                )
-                sess.commit()
-            except IntegrityError:
-                sess.rollback()
-                logger.exception("Unable to recorder %s", log)
+    def _insert_log_lines(self, sess, rows) -> int:
+        inserted = 0
+        for idx in range(0, len(rows), self.insert_batch_size):
+            res = sess.execute(
+                insert(LogLine.__table__)
+                .values(rows[idx : idx + self.insert_batch_size])
+                .on_conflict_do_nothing()
+            )
+            inserted += res.rowcount
+        return inserted
+
+    def _save_logs(self, sess, to_store: list[StructuredLogLineWithMetaData]) -> int:
+        """Record the lines in one transaction, lines already in the DB are skipped
+
+        Falls back to a line by line insert if the batch can't be written
+        """
+        if not to_store:
+            return 0
+
+        steam_ids = self._get_steamid_ids(
+            sess,
+            [log["steam_id_64_1"] for log in to_store]
+            + [log["steam_id_64_2"] for log in to_store],
+        )
+        now = datetime.datetime.utcnow()
+        rows = [self._log_line_values(log, steam_ids, now) for log in to_store]
+
+        try:
+            inserted = self._insert_log_lines(sess, rows)
+            sess.commit()
+        except IntegrityError:
+            sess.rollback()
+            logger.exception("Unable to record log lines in bulk, recording one by one")
+            inserted = 0
+            for row in rows:
+                try:
+                    inserted += self._insert_log_lines(sess, [row])
+                    sess.commit()
+                except IntegrityError:
+                    sess.rollback()
+                    logger.exception("Unable to record %s", row)
+
+        logger.info(
+            "Recorded %s log lines, %s were already recorded",
+            inserted,
+            len(rows) - inserted,
+        )
+        return inserted
 
     def run(self):
         last_run = datetime.datetime.now()
@@ -353,6 +465,10 @@ class LogRecorder:
                 logger.info("%s log lines to record", len(to_store))
 
                 self._save_logs(sess, to_store)
+                # Moved once the lines are committed, if that fails they are read
+                # again next time and skipped by the insert
+                if to_store:
+                    self._set_watermark(to_store[0])
 
                 last_run = datetime.datetime.now()
 
@@ -399,6 +515,52 @@ def is_action(action_filter, action, exact_match=False):
     return False
 
 
+class LogTail:
+    """Read the lines added to the log history since the previous read
+
+    Only the head of the history is read, down to the last line returned by the
+    previous call
+    """
+
+    def __init__(self, chunk_size=100):
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        self.last_timestamp_ms = None
+        self.last_hash = None
+
+    def read(self, min_timestamp_ms=0) -> list[StructuredLogLineWithMetaData]:
+        """Return the new lines, oldest first"""
+        logs = []
+        # Lines pushed while reading shift the list, the same line can be read twice
+        seen = set()
+        log: StructuredLogLineWithMetaData
+        for log in LogLoop.get_log_history_list().iter_chunked(self.chunk_size):
+            if not isinstance(log, dict):
+                continue
+            timestamp_ms = int(log["timestamp_ms"])
+            if timestamp_ms < min_timestamp_ms:
+                break
+            if (
+                self.last_timestamp_ms is not None
+                and timestamp_ms < self.last_timestamp_ms
+            ):
+                break
+            log_hash = log_line_hash(log)
+            if log_hash == self.last_hash:
+                break
+            if log_hash not in seen:
+                seen.add(log_hash)
+                logs.append(log)
+
+        if logs:
+            self.last_timestamp_ms = int(logs[0]["timestamp_ms"])
+            self.last_hash = log_line_hash(logs[0])
+        logs.reverse()
+        return logs
+
+
 def get_recent_logs(
     start=0,
     end=100000,
@@ -614,7 +776,7 @@ def auto_ban_if_tks_right_after_connection(
                 last_action_is_connect = False
 
 
-def get_historical_logs_records(
+def get_historical_logs_query(
     sess,
     player_name=None,
     action=None,
@@ -626,7 +788,13 @@ def get_historical_logs_records(
     exact_player_match=False,
     exact_action=True,
     server_filter=None,
+    after=None,
 ):
+    """Build the historical logs query
+
+    `after` is an (event_time, id) tuple, from `decode_log_cursor`, to return
+    the lines following it in the `time_sort` order
+    """
     names = []
     name_filters = []
 
@@ -678,14 +846,141 @@ def get_historical_logs_records(
     if server_filter:
         q = q.filter(LogLine.server == server_filter)
 
+    if after:
+        keyset = tuple_(LogLine.event_time, LogLine.id)
+        q = q.filter(
+            keyset < tuple_(*after) if time_sort == "desc" else keyset > tuple_(*after)
+        )
+
     if time_sort:
+        # The id breaks ties between lines of the same second for the cursors
         q = q.order_by(
-            LogLine.event_time.desc()
-            if time_sort == "desc"
-            else LogLine.event_time.asc()
+            *(
+                (LogLine.event_time.desc(), LogLine.id.desc())
+                if time_sort == "desc"
+                else (LogLine.event_time.asc(), LogLine.id.asc())
+            )
         ).limit(limit)
 
-    return q.all()
+    return q
+
+
+def get_historical_logs_records(sess, *args, **kwargs):
+    return get_historical_logs_query(sess, *args, **kwargs).all()
+
+
+def encode_log_cursor(line: LogLine) -> str:
+    return f"{line.event_time.isoformat()}_{line.id}"
+
+
+def decode_log_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        event_time, id_ = cursor.rsplit("_", 1)
+        return datetime.datetime.fromisoformat(event_time), int(id_)
+    except ValueError:
+        raise ValueError(f"Invalid cursor {cursor}")
+
+
+def _historical_log_dict(line: LogLine, output=None):
+    r = line.to_dict()
+    if output != "CSV" and output != "csv":
+        r["event_time"] = r["event_time"].timestamp()
+    else:
+        del r["id"]
+        del r["version"]
+        del r["creation_time"]
+        del r["raw"]
+    return r
+
+
+# Must match the expression of the chat full text search index
+CHAT_SEARCH_CONFIG = "'simple'::regconfig"
+
+
+def _chat_tsvector():
+    return func.to_tsvector(literal_column(CHAT_SEARCH_CONFIG), LogLine.content)
+
+
+def search_chat(
+    sess,
+    search,
+    server_filter=None,
+    from_=None,
+    till=None,
+    player_name=None,
+    limit=100,
+    sort="time",
+    after=None,
+):
+    """Full text search of the chat lines, returns (LogLine, rank) rows
+
+    `search` uses the web search syntax: "quoted phrase", or, -excluded. Lines
+    are sorted by time, or by rank when `sort` is "rank", newest first. `after`
+    is the key of the last row of the previous page, from `decode_chat_cursor`
+    """
+    tsquery = func.websearch_to_tsquery(literal_column(CHAT_SEARCH_CONFIG), search)
+    # ts_rank_cd is a real, compared to the float of the cursor the rows tied
+    # with the last rank of the page would never be after it
+    rank = cast(func.ts_rank_cd(_chat_tsvector(), tsquery), Float(53))
+    q = (
+        sess.query(LogLine, rank.label("rank"))
+        .filter(LogLine.type.like(literal_column("'CHAT%'")))
+        .filter(_chat_tsvector().op("@@")(tsquery))
+    )
+    if server_filter:
+        q = q.filter(LogLine.server == server_filter)
+    if from_:
+        q = q.filter(LogLine.event_time >= from_)
+    if till:
+        q = q.filter(LogLine.event_time <= till)
+    if player_name:
+        q = q.filter(LogLine.player1_name.ilike(f"%{player_name}%"))
+
+    keyset = [LogLine.event_time, LogLine.id]
+    if sort == "rank":
+        keyset.insert(0, rank)
+    if after:
+        q = q.filter(tuple_(*keyset) < tuple_(*after))
+    return q.order_by(*(k.desc() for k in keyset)).limit(limit)
+
+
+def encode_chat_cursor(line: LogLine, rank: float, sort="time") -> str:
+    cursor = encode_log_cursor(line)
+    return f"{rank!r}_{cursor}" if sort == "rank" else cursor
+
+
+def decode_chat_cursor(cursor: str, sort="time") -> tuple:
+    if sort != "rank":
+        return decode_log_cursor(cursor)
+    try:
+        rank, cursor = cursor.split("_", 1)
+        return (float(rank), *decode_log_cursor(cursor))
+    except ValueError:
+        raise ValueError(f"Invalid cursor {cursor}")
+
+
+def get_chat_search_page(search, cursor=None, limit=100, sort="time", **filters):
+    with enter_session() as sess:
+        rows = search_chat(
+            sess,
+            search,
+            limit=limit,
+            sort=sort,
+            after=decode_chat_cursor(cursor, sort) if cursor else None,
+            **filters,
+        ).all()
+
+        logs = []
+        for line, rank in rows:
+            log = _historical_log_dict(line)
+            log["rank"] = rank
+            logs.append(log)
+        return dict(
+            logs=logs,
+            next_cursor=(
+                encode_chat_cursor(*rows[-1], sort=sort) if len(rows) == limit else None
+            ),
+        )
 
 
 def get_historical_logs(
@@ -715,15 +1010,35 @@ def get_historical_logs(
             exact_action,
             server_filter,
         )
-        lines = []
-        for r in res:
-            r = r.to_dict()
-            if output != "CSV" and output != "csv":
-                r["event_time"] = r["event_time"].timestamp()
-            else:
-                del r["id"]
-                del r["version"]
-                del r["creation_time"]
-                del r["raw"]
-            lines.append(r)
-        return lines
+        return [_historical_log_dict(r, output) for r in res]
+
+
+def get_historical_logs_page(cursor=None, limit=1000, **filters):
+    """Return a page of lines and the cursor of the next one, None on the last page"""
+    with enter_session() as sess:
+        res = get_historical_logs_records(
+            sess,
+            limit=limit,
+            after=decode_log_cursor(cursor) if cursor else None,
+            **filters,
+        )
+        return dict(
+            logs=[_historical_log_dict(r) for r in res],
+            next_cursor=encode_log_cursor(res[-1]) if len(res) == limit else None,
+        )
+
+
+def iter_historical_logs(output=None, chunk_size=1000, **filters):
+    """Yield the lines from a server side cursor, `chunk_size` rows at a time
+
+    Memory doesn't grow with the number of lines, the session stays open until
+    the generator is exhausted or closed
+    """
+    with enter_session() as sess:
+        query = (
+            get_historical_logs_query(sess, **filters)
+            .execution_options(stream_results=True)
+            .yield_per(chunk_size)
+        )
+        for line in query:
+            yield _historical_log_dict(line, output)
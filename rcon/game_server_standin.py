@@ -0,0 +1,264 @@
+"""Local stand-in for the game server RCON, with a configurable latency per command
+
+Speaks the XOR protocol of the game server for a handful of read commands so the
+API command executor can be load tested offline:
+
+    ./manage.py api_load_test --slow-ms 3000 --nb-slow 20 --nb-fast 50
+
+The load test sends a burst of slow commands followed by fast ones, first on a
+fixed pool of threads calling the game server directly, like the gthread API
+workers, then awaited through the bounded CommandExecutor the async views use.
+It only compares the two ways of running the commands, to load test the API
+itself run it against the stand-in and send the burst over HTTP:
+
+    ./manage.py game_server_standin --port 7779 --slow-ms 3000
+    ./manage.py api_load_test --api-url http://localhost:8010 --sessionid ...
+"""
+
+import asyncio
+import logging
+import signal
+import socketserver
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests as http
+
+from rcon.command_executor import (
+    CommandBusyError,
+    CommandExecutor,
+    CommandTimeoutError,
+)
+from rcon.commands import ServerCtl
+
+logger = logging.getLogger(__name__)
+
+XOR_KEY = b"\x13\x37\x42\x99"
+PASSWORD = "standin"
+MSGLEN = 32_768
+
+
+def _xor(msg: bytes) -> bytes:
+    return bytes(b ^ XOR_KEY[i % len(XOR_KEY)] for i, b in enumerate(msg))
+
+
+def standin_response(command: str) -> bytes:
+    if command == "get name":
+        return b"Stand-in server"
+    if command == "get map":
+        return b"foy_warfare"
+    if command == "get slots":
+        return b"2/100"
+    if command == "get playerids":
+        return b"2\tplayer_1 : 76561198000000001\tplayer_2 : 76561198000000002\t"
+    return b"FAIL"
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.sendall(XOR_KEY)
+        while True:
+            raw = self.request.recv(MSGLEN)
+            if not raw:
+                return
+            command = _xor(raw).decode()
+            if command.startswith("login "):
+                ok = command == f"login {PASSWORD}"
+                self.request.sendall(_xor(b"SUCCESS" if ok else b"FAIL"))
+                continue
+            time.sleep(self.server.get_latency_secs(command))
+            self.request.sendall(_xor(standin_response(command)))
+
+
+class GameServerStandin(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency_ms=5, command_latencies_ms=None):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency_ms = latency_ms
+        self.command_latencies_ms = command_latencies_ms or {}
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def get_latency_secs(self, command: str) -> float:
+        return self.command_latencies_ms.get(command, self.latency_ms) / 1000
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def _summary(latencies: list[float]) -> dict:
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000),
+        "max_ms": round(latencies[-1] * 1000),
+    }
+
+
+def _timed(func, started):
+    """The outcome of the request and its time since `started`, waiting included"""
+    try:
+        func()
+        outcome = "ok"
+    except CommandTimeoutError:
+        outcome = "timeout"
+    except CommandBusyError:
+        outcome = "busy"
+    return outcome, time.perf_counter() - started
+
+
+async def _atimed(coroutine, started):
+    try:
+        await coroutine
+        outcome = "ok"
+    except CommandTimeoutError:
+        outcome = "timeout"
+    except CommandBusyError:
+        outcome = "busy"
+    return outcome, time.perf_counter() - started
+
+
+def _results(requests, outcomes, wall_secs):
+    results = {"wall_secs": round(wall_secs, 2)}
+    for kind in ("slow", "fast"):
+        kind_outcomes = [o for r, o in zip(requests, outcomes) if r == kind]
+        results[kind] = {
+            "outcomes": {
+                outcome: sum(1 for o, _ in kind_outcomes if o == outcome)
+                for outcome in {o for o, _ in kind_outcomes}
+            },
+            **_summary([secs for o, secs in kind_outcomes if o == "ok"]),
+        }
+    return results
+
+
+def run_thread_workers(ctl, requests, nb_threads):
+    """Each request holds one of the threads until the game server answers"""
+    commands = {"slow": ctl.get_playerids, "fast": ctl.get_map}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(nb_threads) as pool:
+        futures = [
+            pool.submit(_timed, commands[kind], time.perf_counter())
+            for kind in requests
+        ]
+        outcomes = [f.result() for f in futures]
+    return _results(requests, outcomes, time.perf_counter() - started)
+
+
+def run_command_executor(ctl, requests, executor: CommandExecutor):
+    """Every request is awaited, the commands run on the bounded executor"""
+    commands = {
+        "slow": ("get_playerids", ctl.get_playerids),
+        "fast": ("get_map", ctl.get_map),
+    }
+
+    async def run_all():
+        return await asyncio.gather(
+            *(
+                _atimed(executor.arun(*commands[kind], {}), time.perf_counter())
+                for kind in requests
+            )
+        )
+
+    started = time.perf_counter()
+    outcomes = asyncio.run(run_all())
+    return _results(requests, outcomes, time.perf_counter() - started)
+
+
+def run_load_test(
+    nb_slow=20,
+    nb_fast=50,
+    slow_ms=3000,
+    fast_ms=5,
+    nb_threads=8,
+    pool_size=20,
+    max_per_command=5,
+    timeout_secs=2,
+):
+    server = GameServerStandin(
+        latency_ms=fast_ms, command_latencies_ms={"get playerids": slow_ms}
+    ).start()
+    config = {"host": "127.0.0.1", "port": server.port, "password": PASSWORD}
+    # The slow commands come in first, like a stalled team view polled by every tab
+    requests = ["slow"] * nb_slow + ["fast"] * nb_fast
+    try:
+        results = {
+            "thread_workers": run_thread_workers(
+                ServerCtl(config, max_open=pool_size, max_idle=pool_size),
+                requests,
+                nb_threads,
+            ),
+            "command_executor": run_command_executor(
+                ServerCtl(config, max_open=pool_size, max_idle=pool_size),
+                requests,
+                CommandExecutor(pool_size, max_per_command, timeout_secs),
+            ),
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def serve(port, slow_ms=3000, fast_ms=5):
+    """Run the stand-in until interrupted, for an API whose game server is
+    127.0.0.1:`port` with the password `standin`"""
+    server = GameServerStandin(
+        port=port, latency_ms=fast_ms, command_latencies_ms={"get playerids": slow_ms}
+    )
+    signal.signal(signal.SIGTERM, lambda *_: server.shutdown())
+    logger.info("Game server stand-in listening on %s", port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def _api_request(session, url, started):
+    try:
+        res = session.get(url, timeout=60)
+    except http.RequestException:
+        return "error", time.perf_counter() - started
+    elapsed = time.perf_counter() - started
+    if res.status_code == 504:
+        return "timeout", elapsed
+    if res.status_code == 503:
+        return "busy", elapsed
+    if not res.ok or res.json().get("failed"):
+        return "error", elapsed
+    return "ok", elapsed
+
+
+def run_api_load_test(api_url, sessionid, nb_slow=20, nb_fast=50, nb_clients=None):
+    """Send the burst to a running API, through its views and workers, the API
+    must use the stand-in as its game server"""
+    endpoints = {
+        "slow": f"{api_url.rstrip('/')}/api/get_playerids",
+        "fast": f"{api_url.rstrip('/')}/api/get_map",
+    }
+    requests = ["slow"] * nb_slow + ["fast"] * nb_fast
+    session = http.Session()
+    session.cookies.set("sessionid", sessionid)
+    session.mount(
+        "http://", http.adapters.HTTPAdapter(pool_maxsize=nb_clients or len(requests))
+    )
+
+    started = time.perf_counter()
+    # One client per request, they are all sent at once
+    with ThreadPoolExecutor(nb_clients or len(requests)) as pool:
+        futures = [
+            pool.submit(_api_request, session, endpoints[kind], time.perf_counter())
+            for kind in requests
+        ]
+        outcomes = [f.result() for f in futures]
+    return _results(requests, outcomes, time.perf_counter() - started)
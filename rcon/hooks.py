@@ -5,7 +5,7 @@ from collections import defaultdict
 from datetime import datetime
 from functools import partial, wraps
 from threading import Timer
-from typing import DefaultDict, Dict, List, Optional, Sequence, Union
+from typing import Callable, DefaultDict, Dict, List, Optional, Sequence, Union
 
 from discord_webhook import DiscordEmbed
 
@@ -30,16 +30,17 @@ from rcon.game_logs import (
 )
 from rcon.models import LogLineWebHookField, enter_session
 from rcon.player_history import (
-    _get_set_player,
+    cache_player_id,
     get_player,
+    get_player_connect_state,
+    record_player_connection,
     safe_save_player_action,
     save_end_player_session,
-    save_player,
-    save_start_player_session,
+    upsert_player_id,
 )
 from rcon.rcon import Rcon, StructuredLogLineType
-from rcon.steam_utils import get_player_bans, get_steam_profile, update_db_player_info
-from rcon.types import PlayerFlagType, SteamBansType, VACGameBansConfigType
+from rcon.steam_utils import get_player_bans, get_steam_profile, upsert_steam_profiles
+from rcon.types import BlackListType, SteamBansType, VACGameBansConfigType
 from rcon.user_config import CameraConfig, RealVipConfig
 from rcon.utils import LOG_MAP_NAMES_TO_MAP, MapsHistory, get_server_number
 from rcon.vote_map import VoteMap
@@ -160,50 +161,54 @@ def record_map_end(rcon: Rcon, struct_log):
 def ban_if_blacklisted(rcon: Rcon, steam_id_64, name):
     with enter_session() as sess:
         player = get_player(sess, steam_id_64)
-
         if not player:
             logger.error("Can't check blacklist, player not found %s", steam_id_64)
             return
+        blacklist = player.blacklist.to_dict() if player.blacklist else None
+
+    _ban_if_blacklisted(rcon, steam_id_64, name, blacklist)
 
-        if player.blacklist and player.blacklist.is_blacklisted:
+
+def _ban_if_blacklisted(rcon: Rcon, steam_id_64, name, blacklist: BlackListType | None):
+    if blacklist and blacklist["is_blacklisted"]:
+        try:
+            logger.info(
+                "Player %s was banned due blacklist, reason: %s",
+                str(name),
+                blacklist["reason"],
+            )
+            rcon.do_perma_ban(
+                player=name,
+                reason=blacklist["reason"],
+                by=f"BLACKLIST: {blacklist['by']}",
+            )
+            safe_save_player_action(
+                rcon=rcon,
+                player_name=name,
+                action_type="PERMABAN",
+                reason=blacklist["reason"],
+                by=f"BLACKLIST: {blacklist['by']}",
+                steam_id_64=steam_id_64,
+            )
             try:
-                logger.info(
-                    "Player %s was banned due blacklist, reason: %s",
-                    str(name),
-                    player.blacklist.reason,
-                )
-                rcon.do_perma_ban(
-                    player=name,
-                    reason=player.blacklist.reason,
-                    by=f"BLACKLIST: {player.blacklist.by}",
-                )
-                safe_save_player_action(
-                    rcon=rcon,
-                    player_name=name,
-                    action_type="PERMABAN",
-                    reason=player.blacklist.reason,
-                    by=f"BLACKLIST: {player.blacklist.by}",
-                    steam_id_64=steam_id_64,
-                )
-                try:
-                    send_to_discord_audit(
-                        f"`BLACKLIST` -> {dict_to_discord(dict(player=name, reason=player.blacklist.reason))}",
-                        "BLACKLIST",
-                    )
-                except:
-                    logger.error("Unable to send blacklist to audit log")
-            except:
                 send_to_discord_audit(
-                    "Failed to apply ban on blacklisted players, please check the logs and report the error",
-                    "ERROR",
+                    f"`BLACKLIST` -> {dict_to_discord(dict(player=name, reason=blacklist['reason']))}",
+                    "BLACKLIST",
                 )
+            except:
+                logger.error("Unable to send blacklist to audit log")
+        except:
+            send_to_discord_audit(
+                "Failed to apply ban on blacklisted players, please check the logs and report the error",
+                "ERROR",
+            )
 
 
 def should_ban(
     bans: SteamBansType | None,
     max_game_bans: float,
     max_days_since_ban: int,
-    player_flags: list[PlayerFlagType] = [],
+    player_flags: list[str] = [],
     whitelist_flags: list[str] = [],
 ) -> bool | None:
     if not bans:
@@ -230,6 +235,18 @@ def should_ban(
 
 
 def ban_if_has_vac_bans(rcon: Rcon, steam_id_64, name):
+    with enter_session() as sess:
+        player = get_player(sess, steam_id_64)
+        if not player:
+            logger.error("Can't check VAC history, player not found %s", steam_id_64)
+            return
+        flags = [f.flag for f in player.flags]
+
+    _ban_if_has_vac_bans(rcon, steam_id_64, name, flags)
+
+
+def _ban_if_has_vac_bans(rcon: Rcon, steam_id_64, name, player_flags: list[str]):
+    """Must not be called with a session open, it calls the Steam API"""
     try:
         config: VACGameBansConfigType = get_config()["VAC_GAME_BANS"]
     except KeyError:
@@ -247,53 +264,44 @@ def ban_if_has_vac_bans(rcon: Rcon, steam_id_64, name):
     if max_days_since_ban <= 0:
         return  # Feature is disabled
 
-    with enter_session() as sess:
-        player = get_player(sess, steam_id_64)
-
-        if not player:
-            logger.error("Can't check VAC history, player not found %s", steam_id_64)
-            return
+    bans: SteamBansType | None = get_player_bans(steam_id_64)
+    if not bans or not isinstance(bans, dict):
+        logger.warning("Can't fetch Bans for player %s, received %s", steam_id_64, bans)
+        # Player couldn't be fetched properly (logged by get_player_bans)
+        return
 
-        bans: SteamBansType | None = get_player_bans(steam_id_64)
-        if not bans or not isinstance(bans, dict):
-            logger.warning(
-                "Can't fetch Bans for player %s, received %s", steam_id_64, bans
-            )
-            # Player couldn't be fetched properly (logged by get_player_bans)
-            return
+    if should_ban(
+        bans,
+        max_game_bans,
+        max_days_since_ban,
+        player_flags=player_flags,
+        whitelist_flags=whitelist_flags,
+    ):
+        reason = config["ban_on_vac_history_reason"].format(
+            DAYS_SINCE_LAST_BAN=bans.get("DaysSinceLastBan"),
+            MAX_DAYS_SINCE_BAN=str(max_days_since_ban),
+        )
+        logger.info(
+            "Player %s was banned due VAC history, last ban: %s days ago",
+            steam_id_64,
+            bans.get("DaysSinceLastBan"),
+        )
+        rcon.do_perma_ban(player=name, reason=reason, by="VAC BOT")
 
-        if should_ban(
-            bans,
-            max_game_bans,
-            max_days_since_ban,
-            player_flags=player.flags,
-            whitelist_flags=whitelist_flags,
-        ):
-            reason = config["ban_on_vac_history_reason"].format(
-                DAYS_SINCE_LAST_BAN=bans.get("DaysSinceLastBan"),
-                MAX_DAYS_SINCE_BAN=str(max_days_since_ban),
+        try:
+            audit_params = dict(
+                player=name,
+                steam_id_64=steam_id_64,
+                reason=reason,
+                days_since_last_ban=bans.get("DaysSinceLastBan"),
+                vac_banned=bans.get("VACBanned"),
+                number_of_game_bans=bans.get("NumberOfGameBans"),
             )
-            logger.info(
-                "Player %s was banned due VAC history, last ban: %s days ago",
-                str(player),
-                bans.get("DaysSinceLastBan"),
+            send_to_discord_audit(
+                f"`VAC/GAME BAN` -> {dict_to_discord(audit_params)}", "AUTOBAN"
             )
-            rcon.do_perma_ban(player=name, reason=reason, by="VAC BOT")
-
-            try:
-                audit_params = dict(
-                    player=name,
-                    steam_id_64=player.steam_id_64,
-                    reason=reason,
-                    days_since_last_ban=bans.get("DaysSinceLastBan"),
-                    vac_banned=bans.get("VACBanned"),
-                    number_of_game_bans=bans.get("NumberOfGameBans"),
-                )
-                send_to_discord_audit(
-                    f"`VAC/GAME BAN` -> {dict_to_discord(audit_params)}", "AUTOBAN"
-                )
-            except:
-                logger.exception("Unable to send vac ban to audit log")
+        except:
+            logger.exception("Unable to send vac ban to audit log")
 
 
 def inject_player_ids(func):
@@ -306,6 +314,16 @@ def inject_player_ids(func):
     return wrapper
 
 
+# The hooks given the state handle_on_connect loaded for the player, instead
+# of each querying it: f(rcon, struct_log, name, steam_id_64, state)
+CONNECT_STATE_HOOKS: list[Callable] = []
+
+
+def on_player_connected(func):
+    CONNECT_STATE_HOOKS.append(func)
+    return func
+
+
 @on_connected
 @inject_player_ids
 def handle_on_connect(rcon: Rcon, struct_log, name, steam_id_64):
@@ -323,14 +341,31 @@ def handle_on_connect(rcon: Rcon, struct_log, name, steam_id_64):
             struct_log,
         )
         return
-    save_player(
-        struct_log["player"],
-        steam_id_64,
-        timestamp=int(struct_log["timestamp_ms"]) / 1000,
-    )
-    save_start_player_session(steam_id_64, timestamp=timestamp)
-    ban_if_blacklisted(rcon, steam_id_64, struct_log["player"])
-    ban_if_has_vac_bans(rcon, steam_id_64, struct_log["player"])
+
+    with enter_session() as sess:
+        player_id = record_player_connection(sess, steam_id_64, name, timestamp)
+        sess.commit()
+        cache_player_id(steam_id_64, player_id)
+
+        state = get_player_connect_state(sess, player_id)
+
+    # The session is closed before calling the game server and Steam
+    if not state:
+        logger.error("Can't check connection, player not found %s", steam_id_64)
+        return
+    _ban_if_blacklisted(rcon, steam_id_64, name, state["blacklist"])
+    for hook in CONNECT_STATE_HOOKS:
+        try:
+            hook(rcon, struct_log, name, steam_id_64, state)
+        except Exception:
+            logger.exception("Connect hook %s failed for %s", hook.__name__, name)
+    # Last, the hooks don't wait for the Steam API
+    try:
+        _ban_if_has_vac_bans(
+            rcon, steam_id_64, name, [f["flag"] for f in state["flags"]]
+        )
+    except Exception:
+        logger.exception("Unable to check VAC bans of %s", steam_id_64)
 
 
 @on_disconnected
@@ -358,11 +393,10 @@ def update_player_steaminfo_on_connect(rcon, struct_log, _, steam_id_64):
 
     logger.info("Updating steam profile for player %s", struct_log["player"])
     with enter_session() as sess:
-        player = _get_set_player(
-            sess, player_name=struct_log["player"], steam_id_64=steam_id_64
-        )
-        update_db_player_info(player, profile)
+        player_id = upsert_player_id(sess, steam_id_64)
+        upsert_steam_profiles(sess, {steam_id_64: player_id}, {steam_id_64: profile})
         sess.commit()
+        cache_player_id(steam_id_64, player_id)
 
 
 pendingTimers = {}
@@ -0,0 +1,277 @@
+"""Incremental updates of the live data, for the push API
+
+Each topic is a redis stream. The producers append what changed:
+
+- logs: the new log lines, appended by the log loop
+- team_view: the diffs of the team view service, see rcon.team_view
+- live_stats, live_game_stats: the stats of the players that changed since
+  the previous refresh of the live stats loop, and the players gone
+
+A consumer keeps the id of the last entry read of each topic and resumes from
+there, see `encode_cursors`.
+"""
+
+import asyncio
+import pickle
+import threading
+import time
+from logging import getLogger
+from typing import Iterable
+
+from rcon.cache_utils import get_redis_client
+from rcon.team_view import DIFFS_KEY as TEAM_VIEW_DIFFS_KEY
+
+logger = getLogger(__name__)
+
+# Approximate number of entries kept in each stream
+MAX_UPDATES = 1000
+TOPICS = {
+    "logs": "live_updates:logs",
+    "team_view": TEAM_VIEW_DIFFS_KEY,
+    "live_stats": "live_updates:live_stats",
+    "live_game_stats": "live_updates:live_game_stats",
+}
+# The id of the entries before the first one of a stream
+START_ID = "0-0"
+
+
+def publish_updates(topic: str, payloads: Iterable, red=None, maxlen=MAX_UPDATES):
+    """Append the payloads to the stream of the topic, in one round trip"""
+    red = red or get_redis_client(decode_responses=False)
+    pipeline = red.pipeline(transaction=False)
+    for payload in payloads:
+        pipeline.xadd(
+            TOPICS[topic],
+            {"data": pickle.dumps(payload)},
+            maxlen=maxlen,
+            approximate=True,
+        )
+    return pipeline.execute()
+
+
+def read_updates(
+    cursors: dict[str, str], count=100, block_ms=None, red=None
+) -> list[tuple[str, str, object]]:
+    """(topic, id, payload) of the entries after the cursor of each topic"""
+    red = red or get_redis_client(decode_responses=False)
+    topics_by_key = {TOPICS[topic]: topic for topic in cursors}
+    streams = red.xread(
+        {TOPICS[topic]: cursor for topic, cursor in cursors.items()},
+        count=count,
+        block=block_ms,
+    )
+    updates = []
+    for key, entries in streams or []:
+        topic = topics_by_key[_decode(key)]
+        for stream_id, fields in entries:
+            # The team view stream stores its payload under its own field
+            data = fields.get(b"data") or fields[b"diff"]
+            updates.append((topic, _decode(stream_id), pickle.loads(data)))
+    return updates
+
+
+def iter_updates(
+    cursors: dict[str, str],
+    max_duration_secs=55,
+    block_ms=15000,
+    red=None,
+    clock=time.monotonic,
+):
+    """Yield (topic, payload, cursors) as the updates are published, `cursors`
+    is updated in place
+
+    None is yielded when nothing was published for `block_ms`, to keep the
+    connection alive. It stops after `max_duration_secs`, the consumer then
+    reconnects with the last cursors.
+    """
+    red = red or get_redis_client(decode_responses=False)
+    deadline = clock() + max_duration_secs
+    while clock() < deadline:
+        block = max(1, min(block_ms, int((deadline - clock()) * 1000)))
+        updates = read_updates(cursors, block_ms=block, red=red)
+        if not updates:
+            yield None
+        for topic, stream_id, payload in updates:
+            cursors[topic] = stream_id
+            yield topic, payload, cursors
+
+
+async def aiter_updates(
+    cursors: dict[str, str],
+    max_duration_secs=55,
+    poll_secs=0.5,
+    keepalive_secs=15,
+    red=None,
+    clock=time.monotonic,
+):
+    """`iter_updates` for the async views, the streams are polled without
+    blocking so an open stream holds no thread between two reads
+
+    redis is pinned to 3.5 which has no asyncio client, each read runs on the
+    default executor and only takes it for one round trip.
+    """
+    red = red or get_redis_client(decode_responses=False)
+    deadline = clock() + max_duration_secs
+    last_sent = clock()
+    while clock() < deadline:
+        updates = await asyncio.to_thread(read_updates, cursors, red=red)
+        for topic, stream_id, payload in updates:
+            cursors[topic] = stream_id
+            yield topic, payload, cursors
+        if updates:
+            last_sent = clock()
+            continue
+        if clock() - last_sent >= keepalive_secs:
+            last_sent = clock()
+            yield None
+        await asyncio.sleep(poll_secs)
+
+
+class StreamSlots:
+    """Caps the streams open at once, under the sync workers each stream holds a
+    thread for its whole duration"""
+
+    def __init__(self, max_streams: int):
+        self.max_streams = max_streams
+        self.open = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.open >= self.max_streams:
+                return False
+            self.open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+    def hold(self, iterable: Iterable) -> "_HeldStream":
+        """The stream, its slot is released when it's closed or exhausted, the
+        slot must have been acquired"""
+        return _HeldStream(iterable, self)
+
+
+class _HeldStream:
+    def __init__(self, iterable: Iterable, slots: StreamSlots):
+        self.iterator = iter(iterable)
+        self.slots = slots
+        self.released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if self.released:
+            return
+        self.released = True
+        try:
+            if hasattr(self.iterator, "close"):
+                self.iterator.close()
+        finally:
+            self.slots.release()
+
+
+def get_last_ids(topics: Iterable[str], red=None) -> dict[str, str]:
+    """The id of the last entry of each topic, to only read the next ones"""
+    red = red or get_redis_client(decode_responses=False)
+    pipeline = red.pipeline(transaction=False)
+    topics = list(topics)
+    for topic in topics:
+        pipeline.xrevrange(TOPICS[topic], count=1)
+    return {
+        topic: _decode(entries[0][0]) if entries else START_ID
+        for topic, entries in zip(topics, pipeline.execute())
+    }
+
+
+def get_stale_topics(cursors: dict[str, str], red=None) -> list[str]:
+    """The topics whose cursor is older than the first entry left in the stream,
+    the entries after the cursor may have been trimmed off"""
+    red = red or get_redis_client(decode_responses=False)
+    pipeline = red.pipeline(transaction=False)
+    for topic in cursors:
+        pipeline.xrange(TOPICS[topic], count=1)
+    return [
+        topic
+        for (topic, cursor), entries in zip(cursors.items(), pipeline.execute())
+        if entries and _parse_id(cursor) < _parse_id(_decode(entries[0][0]))
+    ]
+
+
+def encode_cursors(cursors: dict[str, str]) -> str:
+    """The cursors as one event id: `logs:1-0,team_view:2-0`"""
+    return ",".join(f"{topic}:{cursor}" for topic, cursor in sorted(cursors.items()))
+
+
+def decode_cursors(event_id: str) -> dict[str, str]:
+    """The cursors of an event id, the unknown topics and invalid ids are ignored"""
+    cursors = {}
+    for item in (event_id or "").split(","):
+        topic, _, cursor = item.partition(":")
+        if topic in TOPICS and _is_valid_id(cursor):
+            cursors[topic] = cursor
+    return cursors
+
+
+def _is_valid_id(stream_id: str) -> bool:
+    try:
+        _parse_id(stream_id)
+    except ValueError:
+        return False
+    return True
+
+
+def _parse_id(stream_id: str) -> tuple[int, int]:
+    millis, _, seq = stream_id.partition("-")
+    return int(millis), int(seq or 0)
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def diff_players_by_id(previous: dict[str, dict], current: dict[str, dict]) -> dict:
+    """The players whose stats changed, with all their stats, and the ones gone
+
+    Applying the same update twice gives the same result, so a consumer can
+    apply the updates published while it was loading the full stats.
+    """
+    return {
+        "changed": [
+            stats for key, stats in current.items() if previous.get(key) != stats
+        ],
+        "left": [key for key in previous if key not in current],
+    }
+
+
+class StatsUpdatesPublisher:
+    """Publishes the changes between two refreshes of the stats of a topic"""
+
+    def __init__(self, topic: str, red=None):
+        self.topic = topic
+        self.red = red
+        self.previous: dict[str, dict] | None = None
+
+    def publish(self, stats: list[dict], snapshot_timestamp: float) -> dict | None:
+        current = {self._key(stat): stat for stat in stats}
+        update = diff_players_by_id(self.previous or {}, current)
+        update["reset"] = self.previous is None
+        update["snapshot_timestamp"] = snapshot_timestamp
+        self.previous = current
+        if not (update["reset"] or update["changed"] or update["left"]):
+            return None
+        publish_updates(self.topic, [update], red=self.red)
+        return update
+
+    @staticmethod
+    def _key(stat: dict) -> str:
+        return stat.get("steam_id_64") or stat.get("player")
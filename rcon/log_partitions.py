@@ -0,0 +1,159 @@
+"""Monthly partitions of the log_lines table
+
+log_lines is partitioned by range on event_time, one partition per month
+(log_lines_y2023m05) plus a default partition catching lines outside of them.
+Partitions are created ahead of time by `create_log_partitions` and the ones
+past the retention are detached by `detach_old_log_partitions`.
+"""
+
+import datetime
+import logging
+import re
+
+from sqlalchemy.dialects import postgresql
+
+from rcon.models import enter_session
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLE = "log_lines"
+DEFAULT_PARTITION = "log_lines_default"
+
+_BOUNDS_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def month_start(dt: datetime.datetime) -> datetime.datetime:
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(dt: datetime.datetime, months: int) -> datetime.datetime:
+    years, month = divmod(dt.month - 1 + months, 12)
+    return dt.replace(year=dt.year + years, month=month + 1)
+
+
+def partition_name(start: datetime.datetime) -> str:
+    return f"{PARTITIONED_TABLE}_y{start.year}m{start.month:02d}"
+
+
+def get_log_partitions(sess) -> list[tuple[str, datetime.datetime, datetime.datetime]]:
+    """Return the (name, start, end) of the monthly partitions, oldest first"""
+    rows = sess.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:table AS regclass)
+        """,
+        {"table": PARTITIONED_TABLE},
+    )
+    partitions = []
+    for name, bounds in rows:
+        match = _BOUNDS_RE.search(bounds)
+        if not match:
+            continue
+        start, end = (datetime.datetime.fromisoformat(v) for v in match.groups())
+        partitions.append((name, start, end))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def create_partition(sess, start: datetime.datetime):
+    end = add_months(start, 1)
+    name = partition_name(start)
+    in_default = sess.execute(
+        f"""SELECT EXISTS (
+            SELECT 1 FROM {DEFAULT_PARTITION}
+            WHERE event_time >= :start AND event_time < :end
+        )""",
+        {"start": start, "end": end},
+    ).scalar()
+
+    if in_default:
+        # Postgres refuses to create a partition for rows sitting in the default
+        # one, move them in the new partition
+        sess.execute(
+            f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {DEFAULT_PARTITION}"
+        )
+    sess.execute(
+        f"CREATE TABLE {name} PARTITION OF {PARTITIONED_TABLE} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+    if in_default:
+        params = {"start": start, "end": end}
+        moved = sess.execute(
+            f"""INSERT INTO {PARTITIONED_TABLE} SELECT * FROM {DEFAULT_PARTITION}
+            WHERE event_time >= :start AND event_time < :end""",
+            params,
+        ).rowcount
+        logger.warning(
+            "Moved %s lines out of the default partition into %s", moved, name
+        )
+        sess.execute(
+            f"""DELETE FROM {DEFAULT_PARTITION}
+            WHERE event_time >= :start AND event_time < :end""",
+            params,
+        )
+        sess.execute(
+            f"ALTER TABLE {PARTITIONED_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"
+        )
+    logger.info("Created log lines partition %s", name)
+
+
+def create_log_partitions(months_ahead=2, now: datetime.datetime | None = None):
+    """Make sure the partitions of the current month and `months_ahead` next ones exist"""
+    current = month_start(now or datetime.datetime.now())
+    created = []
+    with enter_session() as sess:
+        existing = {name for name, _, _ in get_log_partitions(sess)}
+        for idx in range(months_ahead + 1):
+            start = add_months(current, idx)
+            if partition_name(start) in existing:
+                continue
+            create_partition(sess, start)
+            sess.commit()
+            created.append(partition_name(start))
+    return created
+
+
+def detach_old_log_partitions(
+    retention_months: int, drop=False, now: datetime.datetime | None = None
+):
+    """Detach the partitions ending more than `retention_months` months ago
+
+    Detached partitions are regular tables that can be archived or dropped
+    """
+    if retention_months < 1:
+        raise ValueError("The retention must be at least one month")
+
+    cutoff = add_months(month_start(now or datetime.datetime.now()), -retention_months)
+    detached = []
+    with enter_session() as sess:
+        for name, _, end in get_log_partitions(sess):
+            if end > cutoff:
+                continue
+            sess.execute(f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name}")
+            if drop:
+                sess.execute(f"DROP TABLE {name}")
+            sess.commit()
+            logger.info(
+                "%s log lines partition %s", "Dropped" if drop else "Detached", name
+            )
+            detached.append(name)
+    return detached
+
+
+def explain_query(sess, query, analyze=False) -> list[str]:
+    """Return the plan of an ORM query, to check which partitions and indexes it uses
+
+    With `analyze` the query is run and the plan includes the timings
+    """
+    compiled = query.statement.compile(dialect=postgresql.dialect())
+    cursor = sess.connection().connection.cursor()
+    try:
+        explain = "EXPLAIN (ANALYZE, BUFFERS)" if analyze else "EXPLAIN"
+        cursor.execute(f"{explain} {compiled}", compiled.params)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def scanned_partitions(plan: list[str]) -> list[str]:
+    return sorted(set(re.findall(rf"on ({PARTITIONED_TABLE}_\w+)", "\n".join(plan))))
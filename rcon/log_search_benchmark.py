@@ -0,0 +1,151 @@
+"""Benchmark of the historical logs and player searches on synthetic data
+
+Fills a scratch database (migrated with `alembic upgrade head`) with generated
+players and log lines then prints the plan and timing of the searches:
+
+    DB_URL=postgresql://... alembic upgrade head
+    ./manage.py log_search_benchmark postgresql://... --rows 10000000
+
+Never point it at the production database, it inserts millions of rows.
+"""
+
+import datetime
+import logging
+import re
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from rcon.game_logs import get_historical_logs_query
+from rcon.log_partitions import (
+    add_months,
+    create_partition,
+    explain_query,
+    get_log_partitions,
+    month_start,
+    partition_name,
+)
+from rcon.models import PlayerName, PlayerSteamID
+from rcon.player_history import f_unaccent
+
+logger = logging.getLogger(__name__)
+
+FIRST_STEAM_ID = 76561198000000000
+INSERT_CHUNK_SIZE = 1_000_000
+
+
+def _player_name_sql(player_expr):
+    return f"'player_' || substr(md5(({player_expr})::text), 1, 10)"
+
+
+def generate_players(sess, nb_players):
+    sess.execute(
+        f"""INSERT INTO steam_id_64 (steam_id_64, created)
+        SELECT ({FIRST_STEAM_ID} + p)::text, now()
+        FROM generate_series(0, :nb_players - 1) AS p
+        ON CONFLICT DO NOTHING""",
+        {"nb_players": nb_players},
+    )
+    sess.execute(
+        f"""INSERT INTO player_names (playersteamid_id, name, created, last_seen)
+        SELECT s.id, {_player_name_sql(f"s.steam_id_64::bigint - {FIRST_STEAM_ID}")},
+            now(), now()
+        FROM steam_id_64 s
+        WHERE s.steam_id_64::bigint BETWEEN {FIRST_STEAM_ID}
+            AND {FIRST_STEAM_ID} + :nb_players - 1
+        ON CONFLICT DO NOTHING""",
+        {"nb_players": nb_players},
+    )
+    sess.commit()
+
+
+def generate_log_lines(sess, nb_rows, nb_players, days=330, nb_servers=3):
+    """Insert `nb_rows` lines spread over the last `days` days, in chunks"""
+    start = datetime.datetime.now() - datetime.timedelta(days=days)
+    existing = {name for name, _, _ in get_log_partitions(sess)}
+    month = month_start(start)
+    while month <= datetime.datetime.now():
+        if partition_name(month) not in existing:
+            create_partition(sess, month)
+        month = add_months(month, 1)
+    sess.commit()
+
+    step_secs = days * 24 * 60 * 60 / nb_rows
+    for first in range(0, nb_rows, INSERT_CHUNK_SIZE):
+        last = min(first + INSERT_CHUNK_SIZE, nb_rows) - 1
+        sess.execute(
+            f"""INSERT INTO log_lines (version, creation_time, event_time, type,
+                player1_name, player2_name, weapon, raw, content, server)
+            SELECT 1, now(),
+                CAST(:start AS timestamp) + i * :step * interval '1 second',
+                (ARRAY['KILL', 'TEAM KILL', 'CHAT', 'CONNECTED', 'DISCONNECTED'])[1 + i % 5],
+                {_player_name_sql("i % :nb_players")},
+                {_player_name_sql("(i * 7) % :nb_players")},
+                'M1 GARAND', 'synthetic line ' || i, 'synthetic line ' || i,
+                (1 + i % :nb_servers)::text
+            FROM generate_series(:first, :last) AS i
+            ON CONFLICT DO NOTHING""",
+            dict(
+                start=start,
+                step=step_secs,
+                nb_players=nb_players,
+                nb_servers=nb_servers,
+                first=first,
+                last=last,
+            ),
+        )
+        sess.commit()
+        logger.info("Inserted %s of %s log lines", last + 1, nb_rows)
+    sess.execute("ANALYZE log_lines")
+    sess.execute("ANALYZE steam_id_64")
+    sess.execute("ANALYZE player_names")
+    sess.commit()
+
+
+def _execution_ms(plan):
+    match = re.search(r"Execution Time: ([\d.]+) ms", "\n".join(plan))
+    return float(match.group(1)) if match else None
+
+
+def get_benchmark_queries(sess, nb_players):
+    # A name shared by a handful of players to exercise the trigram indexes
+    name = sess.execute(
+        f"SELECT substr({_player_name_sql(nb_players // 2)}, 8, 6)"
+    ).scalar()
+    now = datetime.datetime.now()
+    return {
+        "player name search": get_historical_logs_query(sess, player_name=name),
+        "server latest logs": get_historical_logs_query(sess, server_filter="1"),
+        "action in time range": get_historical_logs_query(
+            sess,
+            action="CHAT",
+            from_=now - datetime.timedelta(days=7),
+            till=now - datetime.timedelta(days=6),
+        ),
+        "players by name": sess.query(PlayerSteamID)
+        .join(PlayerSteamID.names)
+        .filter(f_unaccent(PlayerName.name).ilike(f"%{name}%"))
+        .limit(50),
+        "players by steam id": sess.query(PlayerSteamID)
+        .filter(PlayerSteamID.steam_id_64.ilike(f"%{FIRST_STEAM_ID + 4242}%"))
+        .limit(50),
+    }
+
+
+def run_benchmark(db_url, nb_rows=10_000_000, nb_players=200_000, generate=True):
+    sess = sessionmaker(bind=create_engine(db_url))()
+    try:
+        if generate:
+            started = time.perf_counter()
+            generate_players(sess, nb_players)
+            generate_log_lines(sess, nb_rows, nb_players)
+            logger.info("Generated the dataset in %.1fs", time.perf_counter() - started)
+
+        results = {}
+        for label, query in get_benchmark_queries(sess, nb_players).items():
+            plan = explain_query(sess, query, analyze=True)
+            results[label] = {"ms": _execution_ms(plan), "plan": plan}
+        return results
+    finally:
+        sess.close()
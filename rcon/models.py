@@ -13,9 +13,10 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
-    create_engine,
+    text,
 )
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
@@ -24,17 +25,18 @@ from sqlalchemy.orm import relationship, sessionmaker
 from sqlalchemy.orm.session import object_session
 from sqlalchemy.schema import UniqueConstraint
 
+from rcon.db_pool import create_pooled_engine
 from rcon.types import (
     AuditLogType,
     BlackListType,
     DBLogLineType,
     MapsType,
     PlayerActionType,
-    PlayerAtCountType,
     PlayerCommentType,
     PlayerFlagType,
     PlayerNameType,
     PlayerOptinsType,
+    PlayerPresenceType,
     PlayerProfileType,
     PlayerSessionType,
     PlayerStatsType,
@@ -46,6 +48,36 @@ from rcon.types import (
 logger = logging.getLogger(__name__)
 
 _ENGINE = None
+_SESSION_MAKER = None
+
+# Environment variables overriding the pool settings of ADVANCED_CRCON_SETTINGS
+POOL_SETTINGS_ENV = {
+    "db_pool_size": "DB_POOL_SIZE",
+    "db_max_overflow": "DB_MAX_OVERFLOW",
+    "db_pool_pre_ping": "DB_POOL_PRE_PING",
+    "db_pool_recycle_secs": "DB_POOL_RECYCLE_SECS",
+    "db_pgbouncer_mode": "DB_PGBOUNCER_MODE",
+}
+
+
+def get_pool_settings() -> "AdvancedConfigOptions":
+    from rcon.config import get_config
+
+    try:
+        settings = dict(get_config().get("ADVANCED_CRCON_SETTINGS") or {})
+    except Exception:
+        logger.exception("Unable to load the config, using the default pool settings")
+        settings = {}
+    settings.setdefault("thread_pool_size", 20)
+    for field, env_var in POOL_SETTINGS_ENV.items():
+        if (value := os.getenv(env_var)) not in (None, ""):
+            settings[field] = value
+
+    try:
+        return AdvancedConfigOptions(**settings)
+    except ValueError as e:
+        logger.exception(e)
+        return AdvancedConfigOptions(thread_pool_size=settings["thread_pool_size"])
 
 
 def get_engine():
@@ -59,7 +91,15 @@ def get_engine():
         logger.error(msg)
         raise ValueError(msg)
 
-    _ENGINE = create_engine(url, echo=False)
+    settings = get_pool_settings()
+    _ENGINE = create_pooled_engine(
+        url,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_recycle=settings.db_pool_recycle_secs,
+        pgbouncer=settings.db_pgbouncer_mode,
+    )
     return _ENGINE
 
 
@@ -68,6 +108,14 @@ Base = declarative_base()
 
 class PlayerSteamID(Base):
     __tablename__ = "steam_id_64"
+    __table_args__ = (
+        Index(
+            "ix_steam_id_64_steam_id_64_trgm",
+            "steam_id_64",
+            postgresql_using="gin",
+            postgresql_ops={"steam_id_64": "gin_trgm_ops"},
+        ),
+    )
     id = Column(Integer, primary_key=True)
     steam_id_64 = Column(String, nullable=False, index=True, unique=True)
     created = Column(DateTime, default=datetime.utcnow)
@@ -280,6 +328,12 @@ class PlayerName(Base):
     __tablename__ = "player_names"
     __table_args__ = (
         UniqueConstraint("playersteamid_id", "name", name="unique_name_steamid"),
+        # f_unaccent is an immutable wrapper of unaccent, see the migration
+        Index(
+            "ix_player_names_name_unaccent_trgm",
+            text("f_unaccent(name) gin_trgm_ops"),
+            postgresql_using="gin",
+        ),
     )
 
     id = Column(Integer, primary_key=True)
@@ -302,6 +356,11 @@ class PlayerName(Base):
 
 class PlayerSession(Base):
     __tablename__ = "player_sessions"
+    __table_args__ = (
+        Index(
+            "ix_player_sessions_player_start", "playersteamid_id", "start", unique=True
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     playersteamid_id = Column(
@@ -366,12 +425,37 @@ class PlayersAction(Base):
 
 class LogLine(Base):
     __tablename__ = "log_lines"
-    __table_args__ = (UniqueConstraint("event_time", "raw", name="unique_log_line"),)
+    # Monthly partitions, see rcon.log_partitions
+    # The partition key has to be part of the primary key and unique constraints
+    __table_args__ = (
+        UniqueConstraint("event_time", "raw", name="unique_log_line"),
+        Index(
+            "ix_log_lines_player1_name_trgm",
+            "player1_name",
+            postgresql_using="gin",
+            postgresql_ops={"player1_name": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_log_lines_player2_name_trgm",
+            "player2_name",
+            postgresql_using="gin",
+            postgresql_ops={"player2_name": "gin_trgm_ops"},
+        ),
+        Index("ix_log_lines_server_event_time", "server", text("event_time DESC")),
+        Index("ix_log_lines_type_event_time", "type", "event_time"),
+        Index(
+            "ix_log_lines_chat_content_fts",
+            text("to_tsvector('simple'::regconfig, content)"),
+            postgresql_using="gin",
+            postgresql_where=text("type LIKE 'CHAT%'"),
+        ),
+        {"postgresql_partition_by": "RANGE (event_time)"},
+    )
 
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     version = Column(Integer, default=1)
     creation_time = Column(TIMESTAMP, default=datetime.utcnow)
-    event_time = Column(DateTime, nullable=False, index=True)
+    event_time = Column(DateTime, nullable=False, index=True, primary_key=True)
     type = Column(String, nullable=True)
     player1_name = Column(String, nullable=True)
     player1_steamid = Column(
@@ -604,61 +688,63 @@ class ServerCount(Base):
     )
     count = Column(Integer, nullable=False)
     vip_count = Column(Integer, nullable=False)
-    players = relationship("PlayerAtCount", back_populates="data_point")
     map = relationship("Maps", lazy="joined")
 
-    def to_dict(self, players_as_tuple=False, with_player_list=True) -> ServerCountType:
-        players = []
-
-        if with_player_list and self.players:
-            for p in self.players:
-                p = p.to_dict()
-                if players_as_tuple:
-                    players.append((p["name"], p["steam_id_64"], p["vip"]))
-                else:
-                    players.append(p)
-
+    def to_dict(self, players: list | None = None) -> ServerCountType:
+        """`players` are the players present at that minute, they are stored as
+        PlayerPresence intervals"""
         return dict(
             server_number=self.server_number,
             minute=self.datapoint_time,
             count=self.count,
-            players=players,
+            players=players or [],
             map=self.map.map_name,
             vip_count=self.vip_count,
         )
 
 
-class PlayerAtCount(Base):
-    __tablename__ = "player_at_count"
+class PlayerPresence(Base):
+    """Consecutive minutes a player was counted on the server
+
+    Replaces the PlayerAtCount row per player and per minute, one interval
+    covers the minutes from `start` to `end` (both included) of a ServerCount
+    """
+
+    __tablename__ = "player_presence"
     __table_args__ = (
         UniqueConstraint(
-            "playersteamid_id", "servercount_id", name="unique_player_at_count"
+            "server_number",
+            "playersteamid_id",
+            "start",
+            name="unique_player_presence",
         ),
+        Index("ix_player_presence_server_start_end", "server_number", "start", "end"),
     )
+
     id = Column(Integer, primary_key=True)
+    server_number = Column(Integer)
     playersteamid_id = Column(
         Integer,
         ForeignKey("steam_id_64.id"),
         nullable=False,
         index=True,
     )
-    servercount_id = Column(
-        Integer,
-        ForeignKey("server_counts.id"),
-        nullable=False,
-        index=True,
-    )
+    start = Column(TIMESTAMP, nullable=False)
+    end = Column(TIMESTAMP, nullable=False)
     vip = Column(Boolean)
-    data_point = relationship("ServerCount", back_populates="players")
-    steamid = relationship("PlayerSteamID", lazy="joined")
+    steamid = relationship("PlayerSteamID")
+
+    @property
+    def minutes(self) -> int:
+        return int((self.end - self.start).total_seconds() // 60) + 1
 
-    def to_dict(self) -> PlayerAtCountType:
-        try:
-            name = self.steamid.names[0].name
-        except:
-            logger.exception("Unable to load name for %s", self.steamid.steam_id_64)
-            name = ""
-        return dict(steam_id_64=self.steamid.steam_id_64, name=name, vip=self.vip)
+    def to_dict(self) -> PlayerPresenceType:
+        return dict(
+            steam_id_64=self.steamid.steam_id_64,
+            start=self.start,
+            end=self.end,
+            vip=self.vip,
+        )
 
 
 class PlayerVIP(Base):
@@ -720,10 +806,11 @@ def install_unaccent():
 
 
 def get_session_maker():
-    engine = get_engine()
-    sess = sessionmaker()
-    sess.configure(bind=engine)
-    return sess
+    global _SESSION_MAKER
+
+    if _SESSION_MAKER is None:
+        _SESSION_MAKER = sessionmaker(bind=get_engine())
+    return _SESSION_MAKER
 
 
 @contextmanager
@@ -765,3 +852,10 @@ class AdvancedConfigOptions(pydantic.BaseModel):
     """ADVANCED_CRCON_SETTINGS in config.yml"""
 
     thread_pool_size: pydantic.conint(ge=1, le=100)
+    db_pool_size: pydantic.conint(ge=1, le=100) = 5
+    db_max_overflow: pydantic.conint(ge=0, le=100) = 10
+    db_pool_pre_ping: bool = True
+    db_pool_recycle_secs: int = 1800
+    db_pgbouncer_mode: bool = False
+    api_command_timeout_secs: pydantic.conint(ge=1, le=120) = 15
+    api_max_concurrent_per_command: pydantic.conint(ge=1, le=100) = 5
@@ -2,11 +2,14 @@ import datetime
 import logging
 import math
 import os
+import threading
 import unicodedata
 from functools import cmp_to_key
 
-from sqlalchemy import func
-from sqlalchemy.orm import contains_eager, defaultload
+from cachetools import LRUCache
+from sqlalchemy import and_, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import contains_eager, defaultload, joinedload
 from sqlalchemy.sql.functions import ReturnTypeFromArgs
 
 from rcon.commands import CommandFailedError
@@ -18,14 +21,16 @@ from rcon.models import (
     PlayersAction,
     PlayerSession,
     PlayerSteamID,
+    PlayerVIP,
     SteamInfo,
     WatchList,
     enter_session,
 )
+from rcon.types import PlayerConnectStateType
 
 
-class unaccent(ReturnTypeFromArgs):
-    pass
+class f_unaccent(ReturnTypeFromArgs):
+    """Immutable unaccent wrapper, the trigram index on player names is built on it"""
 
 
 logger = logging.getLogger(__name__)
@@ -175,7 +180,7 @@ def get_players_by_appearance(
         if player_name:
             search = PlayerName.name
             if ignore_accent:
-                search = unaccent(PlayerName.name)
+                search = f_unaccent(PlayerName.name)
                 player_name = remove_accent(player_name)
             if not exact_name_match:
                 query = query.join(PlayerSteamID.names).filter(
@@ -246,12 +251,12 @@ def get_players_by_appearance(
                     "names_by_match": sorted(
                         (n.name for n in p[0].names), key=cmp_to_key(sort_name_match)
                     ),
-                    "first_seen_timestamp_ms": int(p[1].timestamp() * 1000)
-                    if p[1]
-                    else None,
-                    "last_seen_timestamp_ms": int(p[2].timestamp() * 1000)
-                    if p[2]
-                    else None,
+                    "first_seen_timestamp_ms": (
+                        int(p[1].timestamp() * 1000) if p[1] else None
+                    ),
+                    "last_seen_timestamp_ms": (
+                        int(p[2].timestamp() * 1000) if p[2] else None
+                    ),
                     "vip_expiration": p[0].vip.expiration if p[0].vip else None,
                 }
                 for p in players
@@ -380,6 +385,126 @@ def save_start_player_session(
         sess.commit()
 
 
+# steam_id_64 -> PlayerSteamID.id, only filled with committed players
+_PLAYER_IDS: LRUCache = LRUCache(maxsize=10000)
+_PLAYER_IDS_LOCK = threading.Lock()
+
+
+def cache_player_id(steam_id_64, player_id):
+    with _PLAYER_IDS_LOCK:
+        _PLAYER_IDS[steam_id_64] = player_id
+
+
+def upsert_player_id(sess, steam_id_64) -> int:
+    """Return the player ID of a steam ID, creating the player if needed
+
+    An ID created here is only cached once the caller committed it, with
+    `cache_player_id`
+    """
+    with _PLAYER_IDS_LOCK:
+        player_id = _PLAYER_IDS.get(steam_id_64)
+    if player_id is not None:
+        return player_id
+
+    player_id = sess.execute(
+        insert(PlayerSteamID.__table__)
+        .values(steam_id_64=steam_id_64, created=datetime.datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["steam_id_64"])
+        .returning(PlayerSteamID.__table__.c.id)
+    ).scalar()
+    if player_id is not None:
+        logger.info("Adding first time seen steamid %s", steam_id_64)
+        return player_id
+
+    player_id = (
+        sess.query(PlayerSteamID.id)
+        .filter(PlayerSteamID.steam_id_64 == steam_id_64)
+        .scalar()
+    )
+    cache_player_id(steam_id_64, player_id)
+    return player_id
+
+
+def upsert_player_name(sess, player_id, player_name, last_seen: datetime.datetime):
+    stmt = insert(PlayerName.__table__).values(
+        playersteamid_id=player_id,
+        name=player_name,
+        created=datetime.datetime.utcnow(),
+        last_seen=last_seen,
+    )
+    sess.execute(
+        stmt.on_conflict_do_update(
+            constraint="unique_name_steamid",
+            set_=dict(last_seen=stmt.excluded.last_seen),
+        )
+    )
+
+
+def record_player_connection(
+    sess, steam_id_64, player_name, timestamp, server_name=None, server_number=None
+) -> int:
+    """Save the player, its name and the start of its session, return its ID
+
+    Three statements whatever the player is known or not, the caller commits
+    """
+    start_time = datetime.datetime.fromtimestamp(timestamp)
+    player_id = upsert_player_id(sess, steam_id_64)
+    if player_name:
+        upsert_player_name(sess, player_id, player_name, start_time)
+    sess.execute(
+        insert(PlayerSession.__table__)
+        .values(
+            playersteamid_id=player_id,
+            start=start_time,
+            created=datetime.datetime.utcnow(),
+            server_name=server_name or os.getenv("SERVER_SHORT_NAME"),
+            server_number=server_number or os.getenv("SERVER_NUMBER"),
+        )
+        .on_conflict_do_nothing(index_elements=["playersteamid_id", "start"])
+    )
+    return player_id
+
+
+def get_player_connect_state(
+    sess, player_id, server_number=None
+) -> PlayerConnectStateType | None:
+    """The blacklist, watchlist, flags and VIP of a player, from a single query
+
+    The state doesn't need the session, the hooks using it can call the game
+    server or Steam once it's closed
+    """
+    server_number = server_number or os.getenv("SERVER_NUMBER")
+    row = (
+        sess.query(PlayerSteamID, PlayerVIP)
+        .outerjoin(
+            PlayerVIP,
+            and_(
+                PlayerVIP.playersteamid_id == PlayerSteamID.id,
+                PlayerVIP.server_number == server_number,
+            ),
+        )
+        .options(
+            joinedload(PlayerSteamID.blacklist),
+            joinedload(PlayerSteamID.watchlist),
+            joinedload(PlayerSteamID.flags),
+        )
+        .filter(PlayerSteamID.id == player_id)
+        .first()
+    )
+    if not row:
+        return None
+
+    player, vip = row
+    return dict(
+        player_id=player.id,
+        steam_id_64=player.steam_id_64,
+        blacklist=player.blacklist.to_dict() if player.blacklist else None,
+        watchlist=player.watchlist.to_dict() if player.watchlist else None,
+        flags=[f.to_dict() for f in player.flags],
+        vip_expiration=vip.expiration if vip else None,
+    )
+
+
 def save_end_player_session(steam_id_64, timestamp):
     with enter_session() as sess:
         player = get_player(sess, steam_id_64)
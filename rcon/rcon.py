@@ -212,7 +212,6 @@ class Rcon(ServerCtl):
 
     @ttl_cache(ttl=2, cache_falsy=False)
     def get_team_view(self):
-        teams = {}
         detailed_players = self.get_detailed_players()
         players_by_id = detailed_players["players"]
         fail_count = detailed_players["fail_count"]
@@ -230,6 +229,11 @@ class Rcon(ServerCtl):
             logger.exception("Failed to get VIPs")
             vips = set()
 
+        return self.build_team_view(players_by_id, fail_count, steam_profiles, vips)
+
+    def build_team_view(self, players_by_id, fail_count, steam_profiles, vips):
+        """Group the detailed players by team and squad, with the squad and team totals"""
+        teams = {}
         for player in players_by_id.values():
             steam_id_64 = player[STEAMID]
             profile = steam_profiles.get(player.get("steam_id_64"), {}) or {}
@@ -315,19 +319,18 @@ class Rcon(ServerCtl):
         # Defined here to avoid circular imports with commands.py
         return super().get_timed_logs(*args, **kwargs)
 
-    def get_playerids(self, as_dict=False):
-        raw_list = super().get_playerids()
-
+    @staticmethod
+    def parse_playerids(raw_list) -> list[tuple[str, str]]:
+        """(name, steam_id_64) of the players of the raw `get playerids` list"""
         player_list = []
-        player_dict = {}
         for playerinfo in raw_list:
             name, steamid = playerinfo.rsplit(":", 1)
-            name = name[:-1]
-            steamid = steamid[1:]
-            player_dict[name] = steamid
-            player_list.append((name, steamid))
+            player_list.append((name[:-1], steamid[1:]))
+        return player_list
 
-        return player_dict if as_dict else player_list
+    def get_playerids(self, as_dict=False):
+        player_list = self.parse_playerids(super().get_playerids())
+        return dict(player_list) if as_dict else player_list
 
     def get_vips_count(self):
         players = self.get_playerids()
@@ -820,13 +823,18 @@ class Rcon(ServerCtl):
             Rcon.get_team_objective_scores,
             Rcon.get_round_time_remaining,
         ):
-            (
-                raw_team_size,
-                raw_score,
-                raw_time_remaining,
-                raw_current_map,
-                raw_next_map,
-            ) = super().get_gamestate()
+            return self.parse_gamestate(super().get_gamestate())
+
+    @staticmethod
+    def parse_gamestate(lines: list[str]) -> GameState:
+        """Parse the lines of the raw `get gamestate` response"""
+        (
+            raw_team_size,
+            raw_score,
+            raw_time_remaining,
+            raw_current_map,
+            raw_next_map,
+        ) = lines
 
         num_allied_players, num_axis_players = re.match(
             r"Players: Allied: (\d+) - Axis: (\d+)", raw_team_size
@@ -4,17 +4,20 @@ import os
 import pickle
 import re
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+from sqlalchemy.orm import joinedload
 
 from rcon.cache_utils import get_redis_client
 from rcon.config import get_config
-from rcon.game_logs import get_historical_logs_records, get_recent_logs
-from rcon.models import enter_session
+from rcon.game_logs import LogTail, get_historical_logs_query, get_recent_logs
+from rcon.live_updates import StatsUpdatesPublisher
+from rcon.models import LogLine, enter_session
 from rcon.player_history import _get_profiles, get_player_profile_by_steam_ids
 from rcon.rcon import Rcon
 from rcon.settings import SERVER_INFO
 from rcon.types import StructuredLogLineWithMetaData
-from rcon.utils import MapsHistory
+from rcon.utils import MapPlayerStats, MapsHistory
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +36,12 @@ class BaseStats:
         self.voted_yes_regex = re.compile(".*PV_Favour.*")
         self.voted_no_regex = re.compile(".*PV_Against.*")
         self.red = get_redis_client()
+        self.actions_processors = {
+            "KILL": self._add_kill,
+            "TEAM KILL": self._add_tk,
+            "VOTE STARTED": self._add_vote_started,
+            "VOTE": self._add_vote,
+        }
 
     def _is_player_death(self, player, log):
         return player["name"] == log["player2"]
@@ -142,6 +151,44 @@ class BaseStats:
     def _get_player_first_appearance(self, player):
         raise NotImplementedError("_get_player_first_appearance")
 
+    def _new_player_stats(self, player, profile):
+        return {
+            "player": player["name"],
+            "steam_id_64": player.get("steam_id_64"),
+            "steaminfo": (
+                profile.steaminfo.to_dict() if profile and profile.steaminfo else None
+            ),
+            "kills": 0,
+            "kills_streak": 0,
+            "deaths": 0,
+            "death_by_weapons": {},
+            "deaths_without_kill_streak": 0,
+            "teamkills": 0,
+            "teamkills_streak": 0,
+            "deaths_by_tk": 0,
+            "deaths_by_tk_streak": 0,
+            "nb_vote_started": 0,
+            "nb_voted_yes": 0,
+            "nb_voted_no": 0,
+            "longest_life_secs": 0,
+            "shortest_life_secs": 9999,
+            "last_spawn": self._get_player_first_appearance(player),
+            "time_seconds": self._get_player_session_time(player),
+            "weapons": {},
+            "death_by": {},
+            "most_killed": {},
+            "combat": 0,
+            "offense": 0,
+            "defense": 0,
+            "support": 0,
+        }
+
+    def _process_player_log(self, player, log, stats, streaks):
+        processor = self.actions_processors.get(log["action"])
+        if processor:
+            processor(stats=stats, player=player, log=log)
+        self._streaks_accumulator(player, log, stats, streaks)
+
     def get_stats_by_player(
         self,
         indexed_logs: dict[str, list[StructuredLogLineWithMetaData]],
@@ -154,57 +201,15 @@ class BaseStats:
         """
         stats_by_player = {}
 
-        actions_processors = {
-            "KILL": self._add_kill,
-            "TEAM KILL": self._add_tk,
-            "VOTE STARTED": self._add_vote_started,
-            "VOTE": self._add_vote,
-        }
         for p in players:
             logger.debug("Crunching stats for %s", p)
             player_logs: list[StructuredLogLineWithMetaData] = indexed_logs.get(
                 p["name"], []
             )
-            profile = profiles_by_id.get(p.get("steam_id_64"))
-            stats = {
-                "player": p["name"],
-                "steam_id_64": p.get("steam_id_64"),
-                "steaminfo": profile.steaminfo.to_dict()
-                if profile and profile.steaminfo
-                else None,
-                "kills": 0,
-                "kills_streak": 0,
-                "deaths": 0,
-                "death_by_weapons": {},
-                "deaths_without_kill_streak": 0,
-                "teamkills": 0,
-                "teamkills_streak": 0,
-                "deaths_by_tk": 0,
-                "deaths_by_tk_streak": 0,
-                "nb_vote_started": 0,
-                "nb_voted_yes": 0,
-                "nb_voted_no": 0,
-                "longest_life_secs": 0,
-                "shortest_life_secs": 9999,
-                "last_spawn": self._get_player_first_appearance(p),
-                "time_seconds": self._get_player_session_time(p),
-                "weapons": {},
-                "death_by": {},
-                "most_killed": {},
-                "combat": 0,
-                "offense": 0,
-                "defense": 0,
-                "support": 0,
-            }
-
+            stats = self._new_player_stats(p, profiles_by_id.get(p.get("steam_id_64")))
             streaks = Streaks()
-            # player_p = p
-            # import ipdb; ipdb.set_trace()
             for l in player_logs:
-                action = l["action"]
-                processor = actions_processors.get(action, lambda **kargs: None)
-                processor(stats=stats, player=p, log=l)
-                self._streaks_accumulator(p, l, stats, streaks)
+                self._process_player_log(p, l, stats, streaks)
 
             stats_by_player[p["name"]] = self._compute_stats(stats)
 
@@ -321,12 +326,9 @@ class LiveStats(BaseStats):
     def set_live_stats(self):
         snapshot_ts = datetime.datetime.now().timestamp()
         stats = self.get_current_players_stats()
-        self.red.set(
-            "LIVE_STATS",
-            pickle.dumps(
-                dict(snapshot_timestamp=snapshot_ts, stats=list(stats.values()))
-            ),
-        )
+        live_stats = dict(snapshot_timestamp=snapshot_ts, stats=list(stats.values()))
+        self.red.set("LIVE_STATS", pickle.dumps(live_stats))
+        return live_stats
 
     def get_cached_stats(self):
         stats = self.red.get("LIVE_STATS")
@@ -345,9 +347,10 @@ class TimeWindowStats(BaseStats):
         if log["action"] == "CONNECTED":
             players_times.setdefault(player, {"start": [], "end": []})["start"].append(
                 # Event time is a key only avaible in the dict coming from the DB and is already a datetime
+                # Otherwise the naive local time, as LogLine.event_time is recorded
                 log.get(
                     "event_time",
-                    datetime.datetime.utcfromtimestamp(log["timestamp_ms"] // 1000),
+                    datetime.datetime.fromtimestamp(log["timestamp_ms"] // 1000),
                 )
             )
         # if the player is not already in the times record we add the start of the stats window as his session start time
@@ -362,7 +365,7 @@ class TimeWindowStats(BaseStats):
             players_times.setdefault(player, {"start": [], "end": []})["end"].append(
                 log.get(
                     "event_time",
-                    datetime.datetime.utcfromtimestamp(log["timestamp_ms"] // 1000),
+                    datetime.datetime.fromtimestamp(log["timestamp_ms"] // 1000),
                 )
             )
         # if we had a player that disconnected but was not in the time record it means he did have any kill / death or other actions like chat, vote
@@ -385,6 +388,37 @@ class TimeWindowStats(BaseStats):
             )
             return 0
 
+    def _compute_session_totals(
+        self, players_times, until, offset_cooldown_time_seconds=100
+    ):
+        # Here we massage the session times for a player. 1 session should be a pair of times a start and an end
+        for player, times in players_times.items():
+            starts = times["start"]
+            ends = times["end"]
+            times["total"] = 0
+            # This is an error check, it should never happend to not have a start time
+            # If the player connected prior to the time window we're computing the start for, then the start time should be the start of that window
+            if len(starts) == 0:
+                logger.error("No start time for  %s - %s", player, times)
+            # If there's 1 start more that there are ends, it means that the player did not leave the game, and therefore we add the end of the session as the end of the window we're computing the stats for
+            # We discount the cooldown time at the end of the game to get a more accurate kill / min
+            elif len(starts) == len(ends) + 1:
+                logger.debug("Adding end time to end of range for %s", player)
+                ends.append(
+                    until - datetime.timedelta(seconds=offset_cooldown_time_seconds)
+                )
+            # If starts and ends don't match something's probably wrong the the code
+            if len(starts) != len(ends):
+                logger.error("Sessions time don't match for %s - %s", player, times)
+                continue
+
+            # We loop over the pairs of start and ends (chronologically in the order we encountered them)
+            # and we compute the total play time of the player for the window we're looking at
+            for pair in zip(starts, ends):
+                start, end = pair
+                time = end - start
+                times["total"] += time.total_seconds()
+
     def _get_players_stats_for_logs(
         self,
         logs,
@@ -421,34 +455,7 @@ class TimeWindowStats(BaseStats):
             dict(name=player_name, steam_id_64=player_steamid)
             for player_name, player_steamid in players
         ]
-        # Here we massage the session times for a player. 1 session should be a pair of times a start and an end
-        for player, times in players_times.items():
-            starts = times["start"]
-            ends = times["end"]
-            times["total"] = 0
-            # This is an error check, it should never happend to not have a start time
-            # If the player connected prior to the time window we're computing the start for, then the start time should be the start of that window
-            if len(starts) == 0:
-                logger.error("No start time for  %s - %s", player, times)
-            # If there's 1 start more that there are ends, it means that the player did not leave the game, and therefore we add the end of the session as the end of the window we're computing the stats for
-            # We discount the cooldown time at the end of the game to get a more accurate kill / min
-            elif len(starts) == len(ends) + 1:
-                logger.debug("Adding end time to end of range for %s", player)
-                ends.append(
-                    until - datetime.timedelta(seconds=offset_cooldown_time_seconds)
-                )
-            # If starts and ends don't match something's probably wrong the the code
-            if len(starts) != len(ends):
-                logger.error("Sessions time don't match for %s - %s", player, times)
-                continue
-
-            # We loop over the pairs of start and ends (chronologically in the order we encountered them)
-            # and we compute the total play time of the player for the window we're looking at
-            for pair in zip(starts, ends):
-                start, end = pair
-                time = end - start
-                times["total"] += time.total_seconds()
-
+        self._compute_session_totals(players_times, until, offset_cooldown_time_seconds)
         self.times = players_times
 
         logger.debug("Indexing profiles by id")
@@ -471,38 +478,261 @@ class TimeWindowStats(BaseStats):
                 profiles_by_id=profiles_by_id,
             )
 
-    def get_players_stats_at_time(self, from_, until, server_number=None):
+    def get_players_stats_at_time(
+        self, from_, until, server_number=None, chunk_size=5000
+    ):
         server_number = server_number or os.getenv("SERVER_NUMBER")
         with enter_session() as sess:
-            # Get the logs from the database for the given time range
-            rows = get_historical_logs_records(
-                sess,
-                from_=from_,
-                till=until,
-                time_sort="asc",
-                server_filter=server_number,
-                limit=99999999,
+            # Get the logs from the database for the given time range, streamed from
+            # a server side cursor. The steam IDs are joined otherwise compatible_dict
+            # lazy loads them line by line
+            rows = (
+                get_historical_logs_query(
+                    sess,
+                    from_=from_,
+                    till=until,
+                    time_sort="asc",
+                    server_filter=server_number,
+                    limit=None,
+                )
+                .options(joinedload(LogLine.steamid1), joinedload(LogLine.steamid2))
+                .execution_options(stream_results=True)
+                .yield_per(chunk_size)
             )
 
             return self._get_players_stats_for_logs(
-                [row.compatible_dict() for row in rows], from_, until
+                (row.compatible_dict() for row in rows), from_, until
             )
 
     def get_players_stats_from_time(self, from_timestamp):
         logs = get_recent_logs(min_timestamp=from_timestamp)
         return self._get_players_stats_for_logs(
             reversed(logs.get("logs", [])),
-            datetime.datetime.utcfromtimestamp(from_timestamp),
-            datetime.datetime.utcnow(),
+            datetime.datetime.fromtimestamp(from_timestamp),
+            datetime.datetime.now(),
             offset_cooldown_time_seconds=0,
         )
 
 
+@dataclass
+class PlayerAccumulator:
+    stats: dict | None = None
+    streaks: Streaks = field(default_factory=Streaks)
+    # Lines seen before the player has a session, see IncrementalGameStats
+    pending: list = field(default_factory=list)
+    session_start_ms: float = 0
+    last_seen_ms: float = 0
+
+
+class IncrementalGameStats(TimeWindowStats):
+    """Stats of the current game updated with the new log lines only
+
+    Gives the same result as `get_players_stats_from_time(map start)` but each
+    update only processes the lines added since the previous one. Everything is
+    reset when the map changes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tail = LogTail()
+        self.reset(None)
+
+    def reset(self, map_start):
+        self.map_start = map_start
+        self.tail.reset()
+        self.times = {}
+        self.steam_ids = {}
+        self.players: dict[str, PlayerAccumulator] = {}
+
+    def _get_player_session_time(self, player):
+        return self.times.get(player["name"], {}).get("total", 0)
+
+    def _accumulate(self, name, log):
+        acc = self.players.setdefault(name, PlayerAccumulator())
+        # The first appearance is the first start of the player's sessions, until
+        # then (the player was only seen disconnecting) the lines are kept aside
+        if name not in self.times:
+            acc.pending.append(log)
+            return
+        player = {"name": name}
+        if acc.stats is None:
+            acc.stats = self._new_player_stats(player, None)
+            for pending in acc.pending:
+                self._process_player_log(player, pending, acc.stats, acc.streaks)
+            acc.pending = []
+        self._process_player_log(player, log, acc.stats, acc.streaks)
+
+    def update(self, map_start: float):
+        if map_start != self.map_start:
+            logger.info("New map started at %s, resetting the game stats", map_start)
+            self.reset(map_start)
+        from_ = datetime.datetime.fromtimestamp(map_start)
+
+        logs = self.tail.read(min_timestamp_ms=map_start * 1000)
+        for log in logs:
+            for name_key, steam_id_key in (
+                ("player", "steam_id_64_1"),
+                ("player2", "steam_id_64_2"),
+            ):
+                if not (name := log.get(name_key)):
+                    continue
+                self._set_start_end_times(name, self.times, log, from_)
+                if steam_id := log.get(steam_id_key):
+                    self.steam_ids.setdefault(name, steam_id)
+                self._accumulate(name, log)
+        return len(logs)
+
+    def get_stats(self, until: datetime.datetime | None = None):
+        times = {
+            name: {"start": list(t["start"]), "end": list(t["end"])}
+            for name, t in self.times.items()
+        }
+        self._compute_session_totals(
+            times, until or datetime.datetime.now(), offset_cooldown_time_seconds=0
+        )
+
+        with enter_session() as sess:
+            profiles_by_id = {
+                profile.steam_id_64: profile
+                for profile in get_player_profile_by_steam_ids(
+                    sess, list(self.steam_ids.values())
+                )
+            }
+            stats_by_player = {}
+            for name, steam_id_64 in self.steam_ids.items():
+                acc = self.players[name]
+                player = {"name": name, "steam_id_64": steam_id_64}
+                profile = profiles_by_id.get(steam_id_64)
+                stats = self._new_player_stats(player, profile)
+                if acc.stats is None:
+                    streaks = Streaks()
+                    for pending in acc.pending:
+                        self._process_player_log(player, pending, stats, streaks)
+                else:
+                    stats.update(
+                        {
+                            k: v
+                            for k, v in acc.stats.items()
+                            if k not in ("steam_id_64", "steaminfo")
+                        }
+                    )
+                stats["time_seconds"] = times.get(name, {}).get("total", 0)
+                stats_by_player[name] = self._compute_stats(stats)
+            return stats_by_player
+
+
+class IncrementalLiveStats(LiveStats):
+    """Stats of the players' current session updated with the new log lines only
+
+    A player's stats start over when they connect again
+    """
+
+    # Players gone for longer than that are forgotten
+    forget_after_secs = 600
+
+    def __init__(self):
+        super().__init__()
+        self.tail = LogTail()
+        self.sessions: dict[str, PlayerAccumulator] = {}
+
+    def _get_player_session_time(self, player):
+        # Players seen connecting after the players list was fetched have no
+        # profile yet, their CONNECTED line sets their first spawn
+        if "profile" not in player:
+            return 0
+        return super()._get_player_session_time(player)
+
+    def _get_player_first_appearance(self, player):
+        if "profile" not in player:
+            return None
+        return super()._get_player_first_appearance(player)
+
+    def _new_session(self, player, session_start_ms):
+        return PlayerAccumulator(
+            stats=self._new_player_stats(player, None),
+            session_start_ms=session_start_ms,
+        )
+
+    def update(self, players, now: datetime.datetime):
+        indexed_players = {p["name"]: p for p in players}
+        if self.tail.last_timestamp_ms is None and players:
+            oldest_session_seconds = max(map(self._get_player_session_time, players))
+            min_timestamp_ms = (now.timestamp() - oldest_session_seconds) * 1000
+        else:
+            min_timestamp_ms = 0
+
+        logs = self.tail.read(min_timestamp_ms=min_timestamp_ms)
+        for log in logs:
+            for name in dict.fromkeys((log.get("player"), log.get("player2"))):
+                if not name:
+                    continue
+                player = indexed_players.get(name, {"name": name})
+                acc = self.sessions.get(name)
+                if log["action"] == "CONNECTED":
+                    acc = self._new_session(player, log["timestamp_ms"])
+                    self.sessions[name] = acc
+                elif acc is None:
+                    if name not in indexed_players:
+                        continue
+                    session_start = now.timestamp() - self._get_player_session_time(
+                        player
+                    )
+                    acc = self._new_session(player, session_start * 1000)
+                    self.sessions[name] = acc
+                if log["timestamp_ms"] < acc.session_start_ms:
+                    continue
+                acc.last_seen_ms = log["timestamp_ms"]
+                self._process_player_log(player, log, acc.stats, acc.streaks)
+                # A suicide counts for the killer and the victim
+                if log.get("player") == log.get("player2"):
+                    self._process_player_log(player, log, acc.stats, acc.streaks)
+
+        forget_before_ms = (now.timestamp() - self.forget_after_secs) * 1000
+        for name in list(self.sessions):
+            if (
+                name not in indexed_players
+                and self.sessions[name].last_seen_ms < forget_before_ms
+            ):
+                del self.sessions[name]
+        return len(logs)
+
+    def get_current_players_stats(self):
+        players = self.rcon.get_players()
+        if not players:
+            logger.debug("No players")
+            return {}
+        players = [p for p in players if p.get("steam_id_64")]
+        now = datetime.datetime.now()
+        nb_logs = self.update(players, now)
+        logger.debug("%s new log lines processed", nb_logs)
+
+        with enter_session() as sess:
+            profiles_by_id = {
+                profile.steam_id_64: profile
+                for profile in _get_profiles(
+                    sess, [p["steam_id_64"] for p in players], nb_sessions=1
+                )
+            }
+            stats_by_player = {}
+            for p in players:
+                stats = self._new_player_stats(p, profiles_by_id.get(p["steam_id_64"]))
+                if acc := self.sessions.get(p["name"]):
+                    stats.update(
+                        {
+                            k: v
+                            for k, v in acc.stats.items()
+                            if k not in ("steam_id_64", "steaminfo", "time_seconds")
+                        }
+                    )
+                stats_by_player[p["name"]] = self._compute_stats(stats)
+            return stats_by_player
+
+
 def live_stats_loop():
-    live = LiveStats()
+    live = IncrementalLiveStats()
+    game = IncrementalGameStats()
     config = get_config()
-    last_loop_session = datetime.datetime(year=2020, month=1, day=1)
-    last_loop_game = datetime.datetime(year=2020, month=1, day=1)
+    next_loop_session = next_loop_game = time.monotonic()
     live_session_sleep_seconds = config.get("LIVE_STATS", {}).get(
         "refresh_stats_seconds", 30
     )
@@ -512,29 +742,27 @@ def live_stats_loop():
     logger.debug("live_session_sleep_seconds: {}".format(live_session_sleep_seconds))
     logger.debug("live_game_sleep_seconds: {}".format(live_game_sleep_seconds))
     red = get_redis_client()
+    live_updates = StatsUpdatesPublisher("live_stats")
+    game_updates = StatsUpdatesPublisher("live_game_stats")
 
     while True:
         # Keep track of session and game timers seperately
-        last_loop_session_seconds = (
-            datetime.datetime.now() - last_loop_session
-        ).total_seconds()
-        last_loop_game_seconds = (
-            datetime.datetime.now() - last_loop_game
-        ).total_seconds()
-
-        if last_loop_session_seconds >= live_session_sleep_seconds:
-            last_loop_session = datetime.datetime.now()
+        if time.monotonic() >= next_loop_session:
+            next_loop_session = time.monotonic() + live_session_sleep_seconds
             try:
-                live.set_live_stats()
+                live_stats = live.set_live_stats()
                 logger.debug("Refreshed set_live_stats")
+                live_updates.publish(
+                    live_stats["stats"], live_stats["snapshot_timestamp"]
+                )
             except Exception:
                 logger.exception("Error while producing stats")
 
-        if last_loop_game_seconds >= live_game_sleep_seconds:
-            last_loop_game = datetime.datetime.now()
+        if time.monotonic() >= next_loop_game:
+            next_loop_game = time.monotonic() + live_game_sleep_seconds
             try:
                 snapshot_ts = datetime.datetime.now().timestamp()
-                stats = current_game_stats()
+                stats = current_game_stats(game)
                 logger.debug("Refreshed current_game_stats")
                 red.set(
                     "LIVE_GAME_STATS",
@@ -546,25 +774,32 @@ def live_stats_loop():
                         )
                     ),
                 )
+                game_updates.publish(list(stats.values()), snapshot_ts)
             except Exception:
                 logger.exception("Failed to compute live game stats")
 
-        time.sleep(0.1)
+        time.sleep(max(min(next_loop_session, next_loop_game) - time.monotonic(), 0.1))
 
 
-def current_game_stats():
+def current_game_stats(game: IncrementalGameStats | None = None):
+    """Stats of the current game, only updated with the new log lines if `game`
+    is given"""
     try:
         current_map = MapsHistory()[0]
     except IndexError:
         logger.error("No maps information available")
         return {}
 
-    stats = TimeWindowStats().get_players_stats_from_time(current_map["start"])
+    if game is None:
+        stats = TimeWindowStats().get_players_stats_from_time(current_map["start"])
+    else:
+        nb_logs = game.update(current_map["start"])
+        logger.debug("%s new log lines processed", nb_logs)
+        stats = game.get_stats()
+    map_stats = MapPlayerStats(current_map).get_all()
     for name in stats:
         stat = stats.setdefault(name)
-        map_stat = current_map.get("player_stats", dict()).get(
-            stat["steam_id_64"], None
-        )
+        map_stat = map_stats.get(stat["steam_id_64"], None)
         if map_stat is None:
             logger.info("No stats for: " + stat["steam_id_64"])
             continue
@@ -1,16 +1,20 @@
+import csv
 import datetime
+import heapq
+import io
 import logging
 import math
 import os
+from dataclasses import dataclass
 
 import pandas as pd
-from sqlalchemy import and_, func, or_
-from sqlalchemy.orm import joinedload
+from sqlalchemy import and_, desc, extract, func, literal_column, nullslast, or_, text
 from sqlalchemy.sql.functions import coalesce
 
 from rcon.models import (
     Maps,
-    PlayerAtCount,
+    PlayerName,
+    PlayerPresence,
     PlayerSession,
     PlayerSteamID,
     ServerCount,
@@ -75,6 +79,82 @@ def save_server_stats_since_inception():
     )
 
 
+def presence_intervals(
+    stats,
+) -> list[tuple[int, datetime.datetime, datetime.datetime, bool]]:
+    """Merge the players of consecutive minutes in (playersteamid_id, start, end, vip)
+    intervals, `stats` are the minutes of `_get_server_stats` with the models"""
+    running = {}
+    intervals = []
+    for item in stats:
+        minute = pd.Timestamp(item["minute"]).to_pydatetime()
+        for steamid, is_vip in item["players"]:
+            interval = running.get(steamid.id)
+            if interval and interval[2] == minute:
+                # Two sessions of the same player overlap
+                continue
+            if (
+                interval
+                and interval[2] == minute - datetime.timedelta(minutes=1)
+                and interval[3] == is_vip
+            ):
+                interval[2] = minute
+                continue
+            if interval:
+                intervals.append(tuple(interval))
+            running[steamid.id] = [steamid.id, minute, minute, is_vip]
+    intervals.extend(tuple(interval) for interval in running.values())
+    return sorted(intervals, key=lambda interval: (interval[1], interval[0]))
+
+
+def _extend_previous_presence(sess, server_number, hour, intervals):
+    """Extend the intervals of the previous hour continued by the ones starting
+    at `hour`, return the intervals left to insert"""
+    previous_minute = hour - datetime.timedelta(minutes=1)
+    continued = {interval[0]: interval for interval in intervals if interval[1] == hour}
+    if not continued:
+        return intervals
+
+    extended = set()
+    for presence in sess.query(PlayerPresence).filter(
+        PlayerPresence.server_number == server_number,
+        PlayerPresence.end == previous_minute,
+        PlayerPresence.playersteamid_id.in_(continued),
+    ):
+        interval = continued[presence.playersteamid_id]
+        if presence.vip == interval[3]:
+            presence.end = interval[2]
+            extended.add(interval)
+    return [interval for interval in intervals if interval not in extended]
+
+
+def copy_rows(sess, table: str, columns: list[str], rows):
+    """Bulk insert `rows` with COPY, the ones conflicting with existing rows are
+    skipped. Runs in the session's transaction"""
+    if not rows:
+        return
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    names = ", ".join(f'"{column}"' for column in columns)
+    tmp_table = f"tmp_copy_{table}"
+
+    # The session's DBAPI connection, so the COPY is part of its transaction
+    cursor = sess.connection().connection.cursor()
+    try:
+        cursor.execute(
+            f"CREATE TEMP TABLE {tmp_table} (LIKE {table} INCLUDING DEFAULTS)"
+        )
+        cursor.copy_expert(f"COPY {tmp_table} ({names}) FROM STDIN WITH CSV", buf)
+        cursor.execute(
+            f"""INSERT INTO {table} ({names}) SELECT {names} FROM {tmp_table}
+            ON CONFLICT DO NOTHING"""
+        )
+        cursor.execute(f"DROP TABLE {tmp_table}")
+    finally:
+        cursor.close()
+
+
 def save_server_stats_for_range(start, end):
     start = start.replace(minute=0, second=0, microsecond=0)
     end = end.replace(minute=0, second=0, microsecond=0)
@@ -95,52 +175,71 @@ def save_server_stats_for_range(start, end):
             if hour in existing_hours:
                 logger.debug("%s is already in the DB. Skipping", hour)
                 continue
-            # TODO catch failure per hour, not to block the whole batch
-            logger.debug("Getting server stats for %s", hour)
-            stats = _get_server_stats(
-                sess,
-                start=hour,
-                end=hour + datetime.timedelta(minutes=59, seconds=59, microseconds=999),
-                by_map=False,
-                return_models=True,
+            try:
+                _save_server_stats_for_hour(sess, hour.to_pydatetime(), server_number)
+                sess.commit()
+            except Exception:
+                logger.exception("Unable to save the server stats of %s", hour)
+                sess.rollback()
+
+
+def _save_server_stats_for_hour(sess, hour, server_number):
+    logger.debug("Getting server stats for %s", hour)
+    stats = _get_server_stats(
+        sess,
+        start=hour,
+        end=hour + datetime.timedelta(minutes=59, seconds=59, microseconds=999),
+        by_map=False,
+        return_models=True,
+    )
+    logger.info("Saving server stats for %s", hour)
+    counts = []
+    for item in stats:
+        if not item.get("map"):
+            if item.get("count") > 0:
+                logger.warning(
+                    "No map info despite positive player count can't record, minute: %s",
+                    item["minute"],
+                )
+            else:
+                logger.debug("No map info can't record %s", item)
+            continue
+        counts.append(item)
+
+    now = datetime.datetime.utcnow()
+    copy_rows(
+        sess,
+        "server_counts",
+        [
+            "server_number",
+            "creation_time",
+            "datapoint_time",
+            "map_id",
+            "count",
+            "vip_count",
+        ],
+        [
+            (
+                server_number,
+                now,
+                item["minute"],
+                item["map"].id,
+                item["count"],
+                item["vip_count"],
             )
-            logger.info("Saving server stats for %s", hour)
-            for item in stats:
-                if not item.get("map"):
-                    if item.get("count") > 0:
-                        logger.warning(
-                            "No map info despite positive player count can't record, minute: %s",
-                            item["minute"],
-                        )
-                    else:
-                        logger.debug("No map info can't record %s", item)
-                    continue
-
-                try:
-                    server_count = ServerCount(
-                        server_number=server_number,
-                        map_id=item["map"].id,  # TODO that might be None and crash
-                        count=item["count"],
-                        vip_count=item["vip_count"],
-                        datapoint_time=item["minute"],
-                    )
+            for item in counts
+        ],
+    )
 
-                    sess.add(server_count)
-                    sess.commit()
-                    players_at_counts = [
-                        PlayerAtCount(
-                            servercount_id=server_count.id,
-                            playersteamid_id=player.id,
-                            vip=is_vip,
-                        )
-                        for player, is_vip in item["players"]
-                    ]
-                    sess.bulk_save_objects(players_at_counts)
-                    sess.commit()
-                except Exception as e:
-                    # TODO An exception of duplicate key is always raise on round hours
-                    logger.exception("Unable to add count item %s", item)
-                    sess.rollback()
+    intervals = _extend_previous_presence(
+        sess, server_number, hour, presence_intervals(counts)
+    )
+    copy_rows(
+        sess,
+        "player_presence",
+        ["server_number", "playersteamid_id", "start", "end", "vip"],
+        [(server_number, *interval) for interval in intervals],
+    )
 
 
 def get_db_server_stats_for_range(
@@ -159,9 +258,23 @@ def get_db_server_stats_for_range(
     start = datetime.datetime.fromtimestamp(start.timestamp())
     end = datetime.datetime.fromtimestamp(end.timestamp())
     with enter_session() as sess:
-        t = datetime.datetime.now()
-        query = (
-            sess.query(ServerCount)
+        items = [
+            dict(
+                server_number=row.server_number,
+                minute=row.datapoint_time,
+                count=row.count,
+                players=[],
+                map=row.map_name,
+                vip_count=row.vip_count,
+            )
+            for row in sess.query(
+                ServerCount.server_number,
+                ServerCount.datapoint_time,
+                ServerCount.count,
+                ServerCount.vip_count,
+                Maps.map_name,
+            )
+            .join(Maps, ServerCount.map_id == Maps.id)
             .filter(
                 and_(
                     ServerCount.datapoint_time >= start,
@@ -170,54 +283,252 @@ def get_db_server_stats_for_range(
                 )
             )
             .order_by(ServerCount.datapoint_time.asc())
-        )
-
+        ]
         if with_player_list:
-            query = query.options(
-                joinedload(ServerCount.players)
-                .joinedload(PlayerAtCount.steamid)
-                .joinedload(PlayerSteamID.names)
+            _add_players_from_presence(
+                sess, items, start, end, server_number, players_as_tuple
             )
-        last_datapoint = None
+
+    last_datapoint = items[-1] if items else None
+    if by_map:
+        data = {}
+        for item in items:
+            data.setdefault(item["map"], []).append(item)
+    else:
+        data = items
+
+    if last_datapoint and last_datapoint["minute"] < (
+        end - datetime.timedelta(minutes=5)
+    ):
+        live_stats = get_server_stats_for_range(
+            start=last_datapoint["minute"] + datetime.timedelta(minutes=1),
+            end=end,
+            by_map=by_map,
+        )
+        if by_map:
+            for m, items in live_stats.items():
+                data.setdefault(m, []).extend(items)
+        else:
+            data.extend(live_stats)
+    return data
+
+
+def _add_players_from_presence(sess, items, start, end, server_number, as_tuple):
+    """Set the players of the minutes of `items` from the presence intervals"""
+    presences = (
+        sess.query(
+            PlayerPresence.start,
+            PlayerPresence.end,
+            PlayerPresence.vip,
+            PlayerPresence.playersteamid_id,
+            PlayerSteamID.steam_id_64,
+        )
+        .join(PlayerSteamID, PlayerPresence.playersteamid_id == PlayerSteamID.id)
+        .filter(
+            PlayerPresence.server_number == server_number,
+            PlayerPresence.start <= end,
+            PlayerPresence.end >= start,
+        )
+        .order_by(PlayerPresence.start, PlayerPresence.id)
+        .all()
+    )
+    names = _get_last_names(sess, {p.playersteamid_id for p in presences})
+    players = []
+    for p in presences:
+        name = names.get(p.playersteamid_id, "")
+        if as_tuple:
+            players.append((name, p.steam_id_64, p.vip))
+        else:
+            players.append(dict(steam_id_64=p.steam_id_64, name=name, vip=p.vip))
+
+    covering = iter_covering_per_minute(
+        [item["minute"] for item in items], [(p.start, p.end) for p in presences]
+    )
+    for item, idxs in zip(items, covering):
+        item["players"] = [players[idx] for idx in idxs]
+
+
+STATS_RESOLUTIONS = {
+    "minute": datetime.timedelta(minutes=1),
+    "hour": datetime.timedelta(hours=1),
+    "day": datetime.timedelta(days=1),
+}
+# The resolution picked automatically keeps the number of buckets under that
+MAX_STATS_BUCKETS = 1000
+
+
+def pick_stats_resolution(start, end, max_buckets=MAX_STATS_BUCKETS) -> str:
+    """The finest resolution giving at most `max_buckets` buckets over the range"""
+    for resolution, step in STATS_RESOLUTIONS.items():
+        if (end - start) / step <= max_buckets:
+            return resolution
+    return "day"
+
+
+def _get_resolution_step(resolution) -> datetime.timedelta:
+    try:
+        return STATS_RESOLUTIONS[resolution]
+    except KeyError:
+        raise ValueError(
+            f"Invalid resolution {resolution}, expected one of {list(STATS_RESOLUTIONS)}"
+        )
+
+
+def get_db_server_stats_buckets(
+    start, end, resolution="auto", by_map=True, server_number=None
+):
+    """Player counts of the range aggregated by Postgres in buckets of `resolution`
+
+    Every bucket has the average and max player and VIP counts of its data points.
+    With `by_map` the buckets are split per map and grouped by map name, otherwise
+    the buckets are continuous, the ones without data point have no counts.
+    The player lists are not included, see `get_db_server_stats_bucket_players`
+    """
+    if server_number is None:
+        server_number = os.getenv("SERVER_NUMBER")
+    # Turn the timestamps back to naive
+    start = datetime.datetime.fromtimestamp(start.timestamp())
+    end = datetime.datetime.fromtimestamp(end.timestamp())
+    if start > end:
+        raise ValueError("Start time can't be after end time")
+    if resolution == "auto":
+        resolution = pick_stats_resolution(start, end)
+    step = _get_resolution_step(resolution)
+
+    with enter_session() as sess:
         if by_map:
-            data = {}
-            items = query.all()
-            print(f"Query took {(datetime.datetime.now() - t).total_seconds()} seconds")
-            t = datetime.datetime.now()
-            # import ipdb; ipdb.set_trace();
-            for item in items:
-                item = item.to_dict(
-                    players_as_tuple=players_as_tuple, with_player_list=with_player_list
+            # Inlined, a bound parameter in both the SELECT and GROUP BY would be
+            # two different parameters for Postgres. The resolution is validated
+            bucket = func.date_trunc(
+                literal_column(f"'{resolution}'"), ServerCount.datapoint_time
+            )
+            rows = (
+                sess.query(
+                    bucket.label("bucket"),
+                    Maps.map_name,
+                    func.avg(ServerCount.count).label("avg_count"),
+                    func.max(ServerCount.count).label("max_count"),
+                    func.avg(ServerCount.vip_count).label("avg_vip_count"),
+                    func.max(ServerCount.vip_count).label("max_vip_count"),
+                    func.count(ServerCount.id).label("datapoints"),
                 )
-                data.setdefault(item["map"], []).append(item)
-                last_datapoint = item
-            print(
-                f"Iteration took {(datetime.datetime.now() - t).total_seconds()} seconds"
+                .join(Maps, ServerCount.map_id == Maps.id)
+                .filter(
+                    ServerCount.datapoint_time.between(start, end),
+                    ServerCount.server_number == server_number,
+                )
+                .group_by(bucket, Maps.map_name)
+                .order_by(bucket)
+                .all()
             )
         else:
-            data = [
-                item.to_dict(
-                    players_as_tuple=players_as_tuple, with_player_list=with_player_list
-                )
-                for item in query.all()
-            ]
-            last_datapoint = data[-1] if data else None
+            rows = sess.execute(
+                text(
+                    """WITH buckets AS (
+                        SELECT generate_series(
+                            date_trunc(:resolution, CAST(:start AS timestamp)),
+                            :end,
+                            :step
+                        ) AS bucket
+                    )
+                    SELECT b.bucket, NULL AS map_name,
+                        avg(c.count) AS avg_count, max(c.count) AS max_count,
+                        avg(c.vip_count) AS avg_vip_count,
+                        max(c.vip_count) AS max_vip_count,
+                        count(c.id) AS datapoints
+                    FROM buckets b
+                    LEFT JOIN server_counts c
+                        ON c.server_number = :server_number
+                        AND c.datapoint_time >= b.bucket
+                        AND c.datapoint_time < b.bucket + :step
+                        AND c.datapoint_time BETWEEN :start AND :end
+                    GROUP BY b.bucket
+                    ORDER BY b.bucket"""
+                ),
+                dict(
+                    resolution=resolution,
+                    start=start,
+                    end=end,
+                    step=step,
+                    server_number=int(server_number),
+                ),
+            ).fetchall()
+
+    buckets = [
+        dict(
+            minute=row.bucket,
+            map=row.map_name,
+            resolution=resolution,
+            count=_round(row.avg_count),
+            max_count=row.max_count,
+            vip_count=_round(row.avg_vip_count),
+            max_vip_count=row.max_vip_count,
+            datapoints=row.datapoints,
+        )
+        for row in rows
+    ]
+    if not by_map:
+        return buckets
+    data = {}
+    for item in buckets:
+        data.setdefault(item["map"], []).append(item)
+    return data
 
-        if last_datapoint and last_datapoint["minute"] < (
-            end - datetime.timedelta(minutes=5)
-        ):
-            live_stats = get_server_stats_for_range(
-                start=last_datapoint["minute"] + datetime.timedelta(minutes=1),
-                end=end,
-                by_map=by_map,
+
+def _round(value, ndigits=2):
+    return None if value is None else round(float(value), ndigits)
+
+
+def get_db_server_stats_bucket_players(
+    bucket, resolution="hour", server_number=None
+) -> list[dict]:
+    """The players recorded during one bucket with the number of minutes they were
+    seen, most present first"""
+    if server_number is None:
+        server_number = os.getenv("SERVER_NUMBER")
+    step = _get_resolution_step(resolution)
+    bucket = datetime.datetime.fromtimestamp(bucket.timestamp())
+
+    last_minute = bucket + step - datetime.timedelta(minutes=1)
+    # The minutes of each interval within the bucket, both bounds included
+    minutes = (
+        extract(
+            "epoch",
+            func.least(PlayerPresence.end, last_minute)
+            - func.greatest(PlayerPresence.start, bucket),
+        )
+        / 60
+        + 1
+    )
+    with enter_session() as sess:
+        rows = (
+            sess.query(
+                PlayerPresence.playersteamid_id,
+                PlayerSteamID.steam_id_64,
+                func.bool_or(PlayerPresence.vip).label("vip"),
+                func.sum(minutes).label("minutes"),
             )
-            # import ipdb; ipdb.set_trace();
-            if by_map:
-                for m, items in live_stats.items():
-                    data.setdefault(m, []).extend(items)
-            else:
-                data.extend(live_stats)
-        return data
+            .join(PlayerSteamID, PlayerPresence.playersteamid_id == PlayerSteamID.id)
+            .filter(
+                PlayerPresence.server_number == server_number,
+                PlayerPresence.start <= last_minute,
+                PlayerPresence.end >= bucket,
+            )
+            .group_by(PlayerPresence.playersteamid_id, PlayerSteamID.steam_id_64)
+            .order_by(desc("minutes"), PlayerSteamID.steam_id_64)
+            .all()
+        )
+        names = _get_last_names(sess, [row.playersteamid_id for row in rows])
+
+    return [
+        dict(
+            name=names.get(row.playersteamid_id),
+            steam_id_64=row.steam_id_64,
+            vip=row.vip,
+            minutes=int(row.minutes),
+        )
+        for row in rows
+    ]
 
 
 # @ttl_cache(60 * 10)
@@ -237,12 +548,157 @@ def get_server_stats_for_range(start=None, end=None, by_map=False):
         return _get_server_stats(sess, start, end, by_map)
 
 
+@dataclass
+class SessionSpan:
+    """The part of a player session needed to count the players per minute"""
+
+    start: datetime.datetime
+    end: datetime.datetime | None
+    steam_id_64: str
+    name: str | None = None
+    # Only loaded when the caller wants the models
+    steamid: PlayerSteamID | None = None
+
+
+def iter_covering_per_minute(minutes, intervals):
+    """Yield for each minute the indexes of the (start, end) intervals covering it
+
+    Sweep line over the intervals sorted by start, the ones not ended yet are
+    kept in a heap ordered by their end. `minutes` must be sorted.
+    The indexes are yielded in ascending order.
+    """
+    by_start = sorted(range(len(intervals)), key=lambda idx: intervals[idx][0])
+    next_start = 0
+    ends = []
+    active = set()
+    for minute in minutes:
+        while (
+            next_start < len(by_start) and intervals[by_start[next_start]][0] <= minute
+        ):
+            idx = by_start[next_start]
+            heapq.heappush(ends, (intervals[idx][1], idx))
+            active.add(idx)
+            next_start += 1
+        while ends and ends[0][0] < minute:
+            active.discard(heapq.heappop(ends)[1])
+        yield sorted(active)
+
+
+def build_server_stats(
+    series, maps, sessions: list[SessionSpan], vips, by_map, return_models=False
+):
+    """Compute the map, player count, VIP count and players of every minute"""
+    now = datetime.datetime.now()
+    minutes = [minute.to_pydatetime() for minute in series]
+    covering_maps = iter_covering_per_minute(
+        minutes, [(m.start, m.end or now) for m in maps]
+    )
+    covering_sessions = iter_covering_per_minute(
+        minutes, [(s.start, s.end or now) for s in sessions]
+    )
+    players = []
+    for s in sessions:
+        is_vip = s.steam_id_64 in vips
+        if return_models:
+            players.append((s.steamid, is_vip))
+        else:
+            players.append((s.name, s.steam_id_64, is_vip))
+
+    stats = []
+    if by_map:
+        stats = {}
+    for minute, map_idxs, session_idxs in zip(series, covering_maps, covering_sessions):
+        # The first map in query order wins when several overlap
+        map_ = maps[map_idxs[0]] if map_idxs else None
+        present_players = [players[idx] for idx in session_idxs]
+        map_name = map_.map_name if map_ else None
+        item = {
+            "minute": minute,
+            "map": map_name if not return_models else map_,
+            "count": len(present_players),
+            "vip_count": sum(1 for p in present_players if p[-1]),
+            "players": present_players,
+        }
+        if by_map:
+            stats.setdefault(map_name, []).append(item)
+        else:
+            stats.append(item)
+    return stats
+
+
+def _get_last_names(sess, playersteamid_ids) -> dict[int, str]:
+    """The last name seen of each player, same order as PlayerSteamID.names"""
+    if not playersteamid_ids:
+        return {}
+    return dict(
+        sess.query(PlayerName.playersteamid_id, PlayerName.name)
+        .filter(PlayerName.playersteamid_id.in_(playersteamid_ids))
+        .distinct(PlayerName.playersteamid_id)
+        .order_by(PlayerName.playersteamid_id, nullslast(desc(PlayerName.last_seen)))
+        .all()
+    )
+
+
+def _get_session_spans(sess, start, end, server_number, return_models=False):
+    # Only the columns needed are loaded, not the whole session, steam ID and
+    # names models
+    rows = (
+        sess.query(
+            PlayerSession.start,
+            PlayerSession.end,
+            PlayerSession.playersteamid_id,
+            PlayerSteamID.steam_id_64,
+        )
+        .join(PlayerSteamID, PlayerSession.playersteamid_id == PlayerSteamID.id)
+        .filter(
+            and_(
+                or_(
+                    PlayerSession.start.between(start, end),
+                    PlayerSession.end.between(start, end),
+                    and_(
+                        PlayerSession.start <= start,
+                        end <= coalesce(PlayerSession.end, end),
+                    ).self_group(),
+                ),
+                PlayerSession.server_number == server_number,
+                PlayerSession.start.isnot(None),
+            )
+        )
+        .order_by(PlayerSession.start, PlayerSession.id)
+        .all()
+    )
+    logger.debug("Found %s player sessions", len(rows))
+    ids = {row.playersteamid_id for row in rows}
+    if not ids:
+        return []
+
+    names = {}
+    steamids = {}
+    if return_models:
+        steamids = {
+            steamid.id: steamid
+            for steamid in sess.query(PlayerSteamID).filter(PlayerSteamID.id.in_(ids))
+        }
+    else:
+        names = _get_last_names(sess, ids)
+
+    return [
+        SessionSpan(
+            start=row.start,
+            end=row.end,
+            steam_id_64=row.steam_id_64,
+            name=names.get(row.playersteamid_id),
+            steamid=steamids.get(row.playersteamid_id),
+        )
+        for row in rows
+    ]
+
+
 def _get_server_stats(
     sess, start, end, by_map, return_models=False, server_number=None
 ):
     server_number = server_number or os.getenv("SERVER_NUMBER")
     # Crete a list of minutes for the given time window
-    # Bear in mind that a huge window will impact perf a lot
     try:
         vips = Rcon(SERVER_INFO).get_vip_ids()
         vips = {d["steam_id_64"] for d in vips}
@@ -251,7 +707,6 @@ def _get_server_stats(
         vips = set()
 
     series = pd.date_range(start=start, end=end, freq="T")
-    series = series.to_list()
 
     maps = (
         sess.query(Maps)
@@ -267,87 +722,12 @@ def _get_server_stats(
                 ),
             )
         )
+        .order_by(Maps.start, Maps.id)
         .all()
     )
-    indexed_map_hours = index_range_objs_per_hours(maps)
-
-    # Get all players withing the time window
-    q = (
-        sess.query(PlayerSession)
-        .filter(
-            and_(
-                or_(
-                    PlayerSession.start.between(start, end),
-                    PlayerSession.end.between(start, end),
-                    and_(
-                        PlayerSession.start <= start,
-                        end <= coalesce(PlayerSession.end, end),
-                    ).self_group(),
-                ),
-                PlayerSession.server_number == server_number,
-            )
-        )
-        .options(joinedload(PlayerSession.steamid).joinedload(PlayerSteamID.names))
-    )
-    q = q.all()
-    print("Found players: ", len(q))
-    indexed_sessions = index_range_objs_per_hours(q)
+    sessions = _get_session_spans(sess, start, end, server_number, return_models)
 
-    stats = []
-    if by_map:
-        stats = {}
-    for minute in series:
-        # For every minute of the time window we add:
-        # The map, and all the players that had a session at that minute
-        # This algo is quite crappy but it works decently enough
-        present_players = []
-        vip_count = 0
-        map_ = get_obj_for_minute(minute, indexed_map_hours)
-        # find the map that was running at that minute
-        # for m in indexed_map_hours.get(trunc_datetime_to_hour(minute), []):
-        #     if m.start <= minute <= m.end:
-        #         map_ = m
-        #         break
-
-        # for player_session in sessions:
-        #     if not player_session.start:
-        #         # TODO handle current players
-        #         continue
-        #     session_end = player_session.end or end
-        #     if player_session.start <= minute <= session_end:
-        #         present_players.append(player_session.steamid.names[0].name)
-        for player_session in get_obj_for_minute(
-            minute, indexed_sessions, first_only=False
-        ):
-            if not player_session.steamid:
-                continue
-            if not return_models:
-                present_players.append(
-                    (
-                        player_session.steamid.names[0].name,
-                        player_session.steamid.steam_id_64,
-                        player_session.steamid.steam_id_64 in vips,
-                    )
-                )
-            else:
-                present_players.append(
-                    (player_session.steamid, player_session.steamid.steam_id_64 in vips)
-                )
-            if player_session.steamid.steam_id_64 in vips:
-                vip_count += 1
-        map_name = map_.map_name if map_ else None
-        item = {
-            "minute": minute,
-            "map": map_name if not return_models else (map_ or None),
-            "count": len(present_players),
-            "vip_count": vip_count,
-            "players": present_players,
-        }
-        if by_map:
-            stats.setdefault(map_name, []).append(item)
-        else:
-            stats.append(item)
-    return stats
+    return build_server_stats(series, maps, sessions, vips, by_map, return_models)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+"""Benchmark of the per minute server occupancy on synthetic sessions
+
+Compares the sweep line engine of `build_server_stats` with the previous
+engine, which scanned the maps and sessions indexed by hour for every minute:
+
+    ./manage.py server_stats_benchmark --days 30 --players 3000
+"""
+
+import datetime
+import logging
+import random
+import time
+
+import pandas as pd
+
+from rcon.models import Maps
+from rcon.server_stats import (
+    SessionSpan,
+    build_server_stats,
+    get_obj_for_minute,
+    index_range_objs_per_hours,
+)
+
+logger = logging.getLogger(__name__)
+
+FIRST_STEAM_ID = 76561198000000000
+MAP_NAMES = ["foy_warfare", "stmariedumont_warfare", "hurtgenforest_warfare"]
+
+
+def generate_maps(start, end, seed=0) -> list[Maps]:
+    rnd = random.Random(seed)
+    maps = []
+    map_start = start
+    while map_start < end:
+        map_end = map_start + datetime.timedelta(minutes=rnd.randint(20, 95))
+        maps.append(Maps(start=map_start, end=map_end, map_name=rnd.choice(MAP_NAMES)))
+        # Some maps end and start on the same minute, some leave a gap
+        map_start = map_end + datetime.timedelta(minutes=rnd.randint(0, 2))
+    return maps
+
+
+def generate_sessions(start, end, nb_players, seed=0) -> list[SessionSpan]:
+    rnd = random.Random(seed)
+    sessions = []
+    for idx in range(nb_players):
+        steam_id_64 = str(FIRST_STEAM_ID + idx)
+        session_start = start + datetime.timedelta(minutes=rnd.randint(-120, 60 * 24))
+        while session_start < end:
+            session_end = session_start + datetime.timedelta(
+                minutes=rnd.randint(5, 240), seconds=rnd.randint(0, 59)
+            )
+            sessions.append(
+                SessionSpan(
+                    start=session_start,
+                    end=session_end,
+                    steam_id_64=steam_id_64,
+                    name=f"player_{idx}",
+                )
+            )
+            session_start = session_end + datetime.timedelta(
+                minutes=rnd.randint(60, 60 * 48)
+            )
+    sessions.sort(key=lambda s: s.start)
+    return sessions
+
+
+def reference_server_stats(series, maps, sessions, vips, by_map):
+    """The previous engine, each minute scans the maps and sessions of its hour"""
+    indexed_map_hours = index_range_objs_per_hours(maps)
+    indexed_sessions = index_range_objs_per_hours(sessions)
+
+    stats = []
+    if by_map:
+        stats = {}
+    for minute in series:
+        present_players = []
+        vip_count = 0
+        map_ = get_obj_for_minute(minute, indexed_map_hours)
+        for session in get_obj_for_minute(minute, indexed_sessions, first_only=False):
+            is_vip = session.steam_id_64 in vips
+            present_players.append((session.name, session.steam_id_64, is_vip))
+            if is_vip:
+                vip_count += 1
+        map_name = map_.map_name if map_ else None
+        item = {
+            "minute": minute,
+            "map": map_name,
+            "count": len(present_players),
+            "vip_count": vip_count,
+            "players": present_players,
+        }
+        if by_map:
+            stats.setdefault(map_name, []).append(item)
+        else:
+            stats.append(item)
+    return stats
+
+
+def run_benchmark(days=30, nb_players=3000, with_reference=True, seed=0):
+    end = datetime.datetime(2023, 6, 1)
+    start = end - datetime.timedelta(days=days)
+    series = pd.date_range(start=start, end=end, freq="T")
+    maps = generate_maps(start - datetime.timedelta(hours=2), end, seed)
+    sessions = generate_sessions(start, end, nb_players, seed)
+    vips = {str(FIRST_STEAM_ID + idx) for idx in range(0, nb_players, 10)}
+    results = {"minutes": len(series), "maps": len(maps), "sessions": len(sessions)}
+
+    started = time.perf_counter()
+    stats = build_server_stats(series, maps, sessions, vips, by_map=False)
+    results["sweep_line_secs"] = round(time.perf_counter() - started, 3)
+
+    if with_reference:
+        started = time.perf_counter()
+        expected = reference_server_stats(series, maps, sessions, vips, by_map=False)
+        results["hour_index_secs"] = round(time.perf_counter() - started, 3)
+        results["same_output"] = stats == expected
+
+    return results
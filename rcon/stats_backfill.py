@@ -0,0 +1,144 @@
+"""Rebuild the players stats of the recorded maps over a date range
+
+Maps are processed in parallel by a pool of processes, each of them streams
+the logs of one map from the DB and upserts its players stats in bulk. The
+maps done are kept in redis so an interrupted backfill resumes where it
+stopped when run again with the same arguments.
+"""
+
+import datetime
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable
+
+from rcon.cache_utils import get_redis_client, get_redis_pool
+from rcon.models import Maps, enter_session, get_engine
+from rcon.workers import record_stats_from_map
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_DONE_KEY = "stats_backfill_done"
+# Progress of a backfill nobody resumed within that time is dropped
+BACKFILL_DONE_TTL_SECS = 60 * 60 * 24 * 7
+
+
+def get_maps_to_backfill(
+    sess, start: datetime.datetime, end: datetime.datetime, server_number=None
+) -> list[int]:
+    q = sess.query(Maps.id).filter(Maps.start >= start, Maps.start <= end)
+    if server_number is not None:
+        q = q.filter(Maps.server_number == int(server_number))
+    return [map_id for (map_id,) in q.order_by(Maps.start)]
+
+
+def _done_key(start, end, server_number, force) -> str:
+    # Without end the key is the same from one run to the next, the maps started
+    # since the previous run are the only ones left to do
+    end = "open" if end is None else f"{end:%Y%m%d%H%M%S}"
+    return (
+        f"{BACKFILL_DONE_KEY}:{start:%Y%m%d%H%M%S}:{end}"
+        f":{server_number or 'all'}:{int(force)}"
+    )
+
+
+def _get_done_maps(key) -> set[int]:
+    if not get_redis_pool():
+        return set()
+    return {int(map_id) for map_id in get_redis_client().smembers(key)}
+
+
+def _clear_done_maps(key):
+    if get_redis_pool():
+        get_redis_client().delete(key)
+
+
+def _set_map_done(key, map_id):
+    if not get_redis_pool():
+        return
+    red = get_redis_client()
+    red.sadd(key, map_id)
+    red.expire(key, BACKFILL_DONE_TTL_SECS)
+
+
+def backfill_map(map_id: int, force: bool = False) -> dict:
+    """Record the players stats of one map, run in the worker processes"""
+    with enter_session() as sess:
+        map_ = sess.query(Maps).get(map_id)
+        counts = record_stats_from_map(sess, map_, dict(), force=force)
+        sess.commit()
+    return counts
+
+
+def backfill_player_stats(
+    start: datetime.datetime,
+    end: datetime.datetime | None = None,
+    server_number=None,
+    force=False,
+    workers=4,
+    resume=True,
+    on_progress: Callable[[dict], None] | None = None,
+) -> dict:
+    """Record the players stats of the maps started between `start` and `end`,
+    or now without `end`
+
+    Without `force` the stats already recorded are kept and only the missing
+    ones are added. `on_progress` is called with the totals after each map
+    """
+    key = _done_key(start, end, server_number, force)
+    if not resume:
+        _clear_done_maps(key)
+
+    with enter_session() as sess:
+        map_ids = get_maps_to_backfill(
+            sess, start, end or datetime.datetime.now(), server_number
+        )
+    done = _get_done_maps(key)
+    todo = [map_id for map_id in map_ids if map_id not in done]
+    progress = dict(
+        total=len(map_ids),
+        done=len(map_ids) - len(todo),
+        failed=0,
+        inserted=0,
+        updated=0,
+        maps_per_sec=0,
+        eta_secs=None,
+    )
+    logger.info(
+        "Backfilling stats of %s maps, %s already done", len(todo), progress["done"]
+    )
+    if not todo:
+        return progress
+
+    # The worker processes are forked, they must not inherit open connections
+    get_engine().dispose()
+    started = time.monotonic()
+    nb_processed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(backfill_map, map_id, force): map_id for map_id in todo
+        }
+        for future in as_completed(futures):
+            map_id = futures[future]
+            nb_processed += 1
+            try:
+                counts = future.result()
+            except Exception:
+                logger.exception("Unable to backfill the stats of map %s", map_id)
+                progress["failed"] += 1
+            else:
+                _set_map_done(key, map_id)
+                progress["done"] += 1
+                progress["inserted"] += counts["inserted"]
+                progress["updated"] += counts["updated"]
+
+            elapsed = time.monotonic() - started
+            progress["maps_per_sec"] = round(nb_processed / elapsed, 2)
+            progress["eta_secs"] = round(
+                (len(todo) - nb_processed) * elapsed / nb_processed
+            )
+            if on_progress:
+                on_progress(dict(progress))
+
+    logger.info("Stats backfill finished %s", progress)
+    return progress
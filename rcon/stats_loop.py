@@ -1,5 +1,6 @@
 import time
 from logging import getLogger
+from typing import TypedDict
 
 import redis
 from redistimeseries.client import Client
@@ -10,12 +11,57 @@ from rcon.settings import SERVER_INFO
 
 logger = getLogger(__name__)
 
-LOOP_FREQUENCY_SEC = 0.5
+LOOP_FREQUENCY_SEC = 30
+# Ranges are downsampled to at most that many points
+MAX_RANGE_POINTS = 500
+
+
+class ServerSnapshot(TypedDict):
+    """What a collector tick fetched from the game server"""
+
+    timestamp_ms: int
+    players: int
+    max_players: int
+    num_allied_players: int
+    num_axis_players: int
+    allied_score: int
+    axis_score: int
+    vips: int
+
+
+def take_snapshot(rcon: Rcon) -> ServerSnapshot:
+    """Fetch everything the series record in one round on a single connection"""
+    with rcon.with_connection() as conn:
+        gamestate = rcon._get("gamestate", can_fail=False, conn=conn)
+        slots = rcon._get("slots", can_fail=False, conn=conn)
+        playerids = rcon._get("playerids", True, can_fail=False, conn=conn)
+        vipids = rcon._get("vipids", True, can_fail=False, conn=conn)
+    timestamp_ms = int(time.time() * 1000)
+
+    gamestate = Rcon.parse_gamestate(gamestate.split("\n"))
+    players, max_players = slots.split("/")
+    vips = {item.split(" ", 1)[0] for item in vipids}
+    return {
+        "timestamp_ms": timestamp_ms,
+        "players": int(players),
+        "max_players": int(max_players),
+        "num_allied_players": gamestate["num_allied_players"],
+        "num_axis_players": gamestate["num_axis_players"],
+        "allied_score": gamestate["allied_score"],
+        "axis_score": gamestate["axis_score"],
+        "vips": sum(
+            1
+            for _, steam_id_64 in Rcon.parse_playerids(playerids)
+            if steam_id_64 in vips
+        ),
+    }
 
 
 class Series:
     # CHILDREN MUST DEFINE A CLASS ATTRIBUTE: NAME
     NAME = None
+    # The key of the snapshot recorded, or override value()
+    SNAPSHOT_KEY = None
 
     def __init__(
         self,
@@ -33,8 +79,6 @@ class Series:
         }
         self.retention_msecs = 1000 * 60 * 60 * 24 * retention_days
         self.min_resolution_ms = min_resolution_ms / 1000
-        self.last_run_time = 0
-        self.fails = 0
         self.max_fails = max_fails
 
     def migrate(self):
@@ -76,46 +120,132 @@ class Series:
         # https://oss.redislabs.com/redistimeseries/commands/#filtering
         return self.client.range(self.NAME, *args, **kwargs)
 
-    def run_on_time(self, rcon):
-        now = time.time()
-        if now - self.last_run_time <= self.min_resolution_ms:
-            return
-        logger.debug("Taking snaphost for %s", self.NAME)
-        try:
-            self.snapshot(rcon)
-        except:
-            self.fails += 1
-            if self.fails > self.max_fails:
-                raise
-            return
-        self.last_run_time = now
-        return now
+    def get_downsampled_range(self, start_ms, end_ms, max_points=MAX_RANGE_POINTS):
+        """Average of the samples in at most `max_points` buckets"""
+        bucket_ms = max(
+            int(self.min_resolution_ms * 1000),
+            (end_ms - start_ms) // max(max_points, 1),
+        )
+        return self.get_range(
+            start_ms, end_ms, aggregation_type="avg", bucket_size_msec=bucket_ms
+        )
+
+    def value(self, snapshot: ServerSnapshot) -> float | None:
+        """The sample of the series in the snapshot, None to skip it"""
+        return float(snapshot[self.SNAPSHOT_KEY])
 
 
 class PlayerCount(Series):
     NAME = "player_count"
+    SNAPSHOT_KEY = "players"
+
+
+class AlliedPlayerCount(Series):
+    NAME = "allied_player_count"
+    SNAPSHOT_KEY = "num_allied_players"
+
+
+class AxisPlayerCount(Series):
+    NAME = "axis_player_count"
+    SNAPSHOT_KEY = "num_axis_players"
+
+
+class AlliedScore(Series):
+    NAME = "allied_score"
+    SNAPSHOT_KEY = "allied_score"
+
+
+class AxisScore(Series):
+    NAME = "axis_score"
+    SNAPSHOT_KEY = "axis_score"
+
+
+class VipCount(Series):
+    NAME = "vip_count"
+    SNAPSHOT_KEY = "vips"
+
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+REGISTERED_SERIES: list[type[Series]] = [
+    PlayerCount,
+    AlliedPlayerCount,
+    AxisPlayerCount,
+    AlliedScore,
+    AxisScore,
+    VipCount,
+]
 
-    def snapshot(self, rcon):
-        slots = rcon.get_slots()
-        nb, _ = slots.split("/")
 
-        self.client.add(self.NAME, "*", float(nb))
+class SeriesCollector:
+    """Feeds all the series from one snapshot per tick, written with one TS.MADD"""
+
+    def __init__(self, client, series: list[Series], max_fails=5):
+        self.client = client
+        self.series = series
+        self.max_fails = max_fails
+        self.fails = 0
+
+    def migrate(self):
+        for series in self.series:
+            series.migrate()
+
+    def record(self, snapshot: ServerSnapshot) -> int:
+        samples = []
+        for series in self.series:
+            try:
+                value = series.value(snapshot)
+            except (KeyError, TypeError, ValueError):
+                logger.exception("Unable to get the value of %s", series.NAME)
+                continue
+            if value is not None:
+                samples.append((series.NAME, snapshot["timestamp_ms"], value))
+        if samples:
+            self.client.madd(samples)
+        return len(samples)
+
+    def tick(self, rcon: Rcon):
+        logger.debug("Taking snapshot for %s series", len(self.series))
+        try:
+            self.record(take_snapshot(rcon))
+        except Exception:
+            self.fails += 1
+            if self.fails > self.max_fails:
+                raise
+            logger.exception("Unable to record the series")
+            return
+        self.fails = 0
+
+
+def get_series_ranges(
+    start_ms, end_ms, names=None, max_points=MAX_RANGE_POINTS, client=None
+) -> dict[str, list[tuple[int, float]]]:
+    """Downsampled samples of the registered series, for the dashboard"""
+    client = client or Client(connection_pool=get_redis_pool())
+    ranges = {}
+    for series_class in REGISTERED_SERIES:
+        if names and series_class.NAME not in names:
+            continue
+        try:
+            ranges[series_class.NAME] = series_class(client).get_downsampled_range(
+                start_ms, end_ms, max_points
+            )
+        except redis.exceptions.ResponseError:
+            logger.warning("No time series %s", series_class.NAME)
+            ranges[series_class.NAME] = []
+    return ranges
 
 
 def run():
     rcon = Rcon(SERVER_INFO)
     red = Client(connection_pool=get_redis_pool())
-    registered_series = [PlayerCount(red)]
-    for series in registered_series:
-        series.migrate()
+    collector = SeriesCollector(red, [series(red) for series in REGISTERED_SERIES])
+    collector.migrate()
 
+    next_tick = time.monotonic()
     while True:
-        for series in registered_series:
-            series.run_on_time(rcon)
-        time.sleep(LOOP_FREQUENCY_SEC)
+        collector.tick(rcon)
+        # Skip the ticks missed if the server was slow to answer
+        next_tick = max(next_tick + LOOP_FREQUENCY_SEC, time.monotonic())
+        time.sleep(next_tick - time.monotonic())
 
 
 if __name__ == "__main__":
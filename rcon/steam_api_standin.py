@@ -0,0 +1,147 @@
+"""Local stand-in for the steam web API endpoints CRCON uses
+
+Serves GetPlayerSummaries and GetPlayerBans with generated data so the steam
+client throughput can be benchmarked offline, point STEAM_API_URL at it:
+
+    ./manage.py steam_api_standin --port 8765 --latency-ms 150
+    STEAM_API_URL=http://127.0.0.1:8765 ./manage.py steam_api_benchmark
+"""
+
+import json
+import logging
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from rcon.steam_client import MAX_IDS_PER_REQUEST, SteamClient
+
+logger = logging.getLogger(__name__)
+
+COUNTRIES = ["FR", "DE", "US", "GB", "PL", "RU", "CA", "AU"]
+
+
+def fake_profile(steam_id: str) -> dict:
+    seed = zlib.crc32(steam_id.encode())
+    profile = {
+        "steamid": steam_id,
+        "communityvisibilitystate": 3 if seed % 5 else 1,
+        "profilestate": 1,
+        "personaname": f"player_{steam_id[-6:]}",
+        "profileurl": f"https://steamcommunity.com/profiles/{steam_id}/",
+        "avatar": "",
+        "timecreated": 1300000000 + seed % 300000000,
+    }
+    if seed % 5:
+        profile["loccountrycode"] = COUNTRIES[seed % len(COUNTRIES)]
+    return profile
+
+
+def fake_bans(steam_id: str) -> dict:
+    seed = zlib.crc32(steam_id.encode())
+    has_vac = seed % 20 == 0
+    return {
+        "SteamId": steam_id,
+        "CommunityBanned": False,
+        "VACBanned": has_vac,
+        "NumberOfVACBans": 1 if has_vac else 0,
+        "DaysSinceLastBan": seed % 1000 if has_vac else 0,
+        "NumberOfGameBans": 1 if seed % 33 == 0 else 0,
+        "EconomyBan": "none",
+    }
+
+
+class SteamAPIStandInHandler(BaseHTTPRequestHandler):
+    latency_secs = 0
+    api_key = None
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if self.api_key and params.get("key", [None])[0] != self.api_key:
+            return self._send(403, {})
+
+        steam_ids = [i for i in params.get("steamids", [""])[0].split(",") if i]
+        if len(steam_ids) > MAX_IDS_PER_REQUEST:
+            return self._send(400, {})
+
+        if self.latency_secs:
+            time.sleep(self.latency_secs)
+
+        self.server.requests_count += 1
+        # Unknown accounts are not returned by steam, mimic it for IDs ending in 0
+        steam_ids = [i for i in steam_ids if not i.endswith("0")]
+        if url.path.startswith("/ISteamUser/GetPlayerSummaries/"):
+            return self._send(
+                200, {"response": {"players": [fake_profile(i) for i in steam_ids]}}
+            )
+        if url.path.startswith("/ISteamUser/GetPlayerBans/"):
+            return self._send(200, {"players": [fake_bans(i) for i in steam_ids]})
+
+        self._send(404, {})
+
+
+def make_standin_server(host="127.0.0.1", port=0, latency_ms=0, api_key=None):
+    handler = type(
+        "Handler",
+        (SteamAPIStandInHandler,),
+        {"latency_secs": latency_ms / 1000, "api_key": api_key},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.requests_count = 0
+    return server
+
+
+def start_standin_server(**kwargs) -> ThreadingHTTPServer:
+    """Start a stand-in server in a background thread, call shutdown() to stop it"""
+    server = make_standin_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_benchmark(client: SteamClient, nb_players=1000, nb_single_lookups=200):
+    steam_ids = [str(76561198000000001 + i) for i in range(nb_players)]
+    results = {}
+
+    started = time.perf_counter()
+    profiles = client.get_player_summaries(steam_ids)
+    bans = client.get_player_bans(steam_ids)
+    elapsed = time.perf_counter() - started
+    results["bulk"] = {
+        "ids": nb_players * 2,
+        "found": len(profiles) + len(bans),
+        "seconds": round(elapsed, 3),
+        "ids_per_sec": round(nb_players * 2 / elapsed, 1),
+    }
+
+    # Single lookups done concurrently, like the connect hooks of a seeding server
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=client.get_player_summary, args=(steam_id,))
+        for steam_id in steam_ids[:nb_single_lookups]
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    results["single"] = {
+        "ids": nb_single_lookups,
+        "seconds": round(elapsed, 3),
+        "ids_per_sec": round(nb_single_lookups / elapsed, 1),
+    }
+
+    return results
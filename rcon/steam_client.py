@@ -0,0 +1,257 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rcon.types import SteamBansType
+
+logger = logging.getLogger(__name__)
+
+STEAM_API_URL = "https://api.steampowered.com"
+# The steam web API accepts up to 100 steam IDs per request
+MAX_IDS_PER_REQUEST = 100
+# Valve allows 100k calls a day per key, stay well below that but allow bursts
+DEFAULT_RATE_PER_SEC = 4
+DEFAULT_BURST = 10
+DEFAULT_CONCURRENCY = 4
+DEFAULT_BATCH_WINDOW_SECS = 0.05
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class SteamAPIError(Exception):
+    pass
+
+
+class SteamAPIKeyError(SteamAPIError):
+    pass
+
+
+class TokenBucket:
+    """Thread safe token bucket, acquire() blocks until a token is available"""
+
+    def __init__(self, rate_per_sec: float, capacity: int, clock=time.monotonic):
+        self.rate_per_sec = rate_per_sec
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.last_refill = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.last_refill) * self.rate_per_sec
+        )
+        self.last_refill = now
+
+    def try_acquire(self) -> float:
+        """Take a token and return 0 or return the seconds to wait for the next one"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate_per_sec
+
+    def acquire(self):
+        while wait := self.try_acquire():
+            time.sleep(wait)
+
+
+class _Batcher:
+    """Group single ID lookups made within `window_secs` into one batched call
+
+    `fetch` receives a list of IDs and returns a dict of ID -> result
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[List[str]], dict],
+        window_secs: float = DEFAULT_BATCH_WINDOW_SECS,
+        max_size: int = MAX_IDS_PER_REQUEST,
+    ):
+        self.fetch = fetch
+        self.window_secs = window_secs
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.pending: dict[str, list[Future]] = {}
+        self.timer: threading.Timer | None = None
+
+    def submit(self, id_: str) -> Future:
+        future = Future()
+        with self.lock:
+            self.pending.setdefault(id_, []).append(future)
+            if len(self.pending) >= self.max_size:
+                batch = self._take()
+            else:
+                batch = None
+                if self.timer is None:
+                    self.timer = threading.Timer(self.window_secs, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+
+        if batch:
+            self._run(batch)
+        return future
+
+    def _take(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, {}
+        return batch
+
+    def flush(self):
+        with self.lock:
+            batch = self._take()
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch: dict[str, list[Future]]):
+        try:
+            results = self.fetch(list(batch.keys()))
+        except Exception as e:
+            for futures in batch.values():
+                for f in futures:
+                    f.set_exception(e)
+            return
+
+        for id_, futures in batch.items():
+            for f in futures:
+                f.set_result(results.get(id_))
+
+
+class SteamClient:
+    """Steam web API client used for the player summaries and bans
+
+    Reuses HTTP connections, limits the request rate with a token bucket and the
+    number of requests in flight, splits lookups in chunks of 100 IDs and
+    retries transient errors with an exponential backoff.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = STEAM_API_URL,
+        rate_per_sec: float = DEFAULT_RATE_PER_SEC,
+        burst: int = DEFAULT_BURST,
+        max_concurrency: int = DEFAULT_CONCURRENCY,
+        batch_window_secs: float = DEFAULT_BATCH_WINDOW_SECS,
+        max_retries: int = 3,
+        backoff_secs: float = 1,
+        timeout: float = 10,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_secs = backoff_secs
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(rate_per_sec, burst)
+        self.concurrency = threading.BoundedSemaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_concurrency, max_retries=0
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._summaries_batcher = _Batcher(
+            self.get_player_summaries, window_secs=batch_window_secs
+        )
+        self._bans_batcher = _Batcher(
+            self.get_player_bans, window_secs=batch_window_secs
+        )
+
+    def _get(self, path: str, params: dict) -> dict:
+        url = f"{self.base_url}{path}"
+        params = {"key": self.api_key, **params}
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                with self.concurrency:
+                    res = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                error = SteamAPIError(f"Steam API request to {path} failed: {e!r}")
+            else:
+                if res.status_code == 403:
+                    raise SteamAPIKeyError("STEAM_API_KEY is invalid")
+                if res.ok:
+                    return res.json()
+                error = SteamAPIError(
+                    f"Steam API request to {path} returned {res.status_code}"
+                )
+                if res.status_code not in RETRYABLE_STATUS_CODES:
+                    raise error
+
+            if attempt < self.max_retries:
+                wait = self.backoff_secs * 2**attempt * (1 + random.random() / 2)
+                logger.warning("%s, retrying in %.2fs", error, wait)
+                time.sleep(wait)
+
+        raise error
+
+    def _fetch_chunked(self, fetch_chunk, steam_ids: List[str]) -> dict:
+        steam_ids = list(dict.fromkeys(steam_ids))
+        chunks = [
+            steam_ids[idx : idx + MAX_IDS_PER_REQUEST]
+            for idx in range(0, len(steam_ids), MAX_IDS_PER_REQUEST)
+        ]
+        if len(chunks) <= 1:
+            return fetch_chunk(steam_ids) if steam_ids else {}
+
+        results = {}
+        for chunk_results in self.executor.map(fetch_chunk, chunks):
+            results.update(chunk_results)
+        return results
+
+    def _fetch_summaries(self, steam_ids: List[str]) -> dict[str, dict]:
+        res = self._get(
+            "/ISteamUser/GetPlayerSummaries/v0002/",
+            {"steamids": ",".join(steam_ids)},
+        )
+        return {p["steamid"]: p for p in res["response"]["players"]}
+
+    def _fetch_bans(self, steam_ids: List[str]) -> dict[str, SteamBansType]:
+        res = self._get(
+            "/ISteamUser/GetPlayerBans/v1/", {"steamids": ",".join(steam_ids)}
+        )
+        return {b["SteamId"]: b for b in res["players"]}
+
+    def get_player_summaries(self, steam_ids: List[str]) -> dict[str, dict]:
+        return self._fetch_chunked(self._fetch_summaries, steam_ids)
+
+    def get_player_bans(self, steam_ids: List[str]) -> dict[str, SteamBansType]:
+        return self._fetch_chunked(self._fetch_bans, steam_ids)
+
+    def get_player_summary(self, steam_id: str) -> dict | None:
+        """Single profile lookup, batched with the other calls made at the same time"""
+        return self._summaries_batcher.submit(steam_id).result()
+
+    def get_player_ban(self, steam_id: str) -> SteamBansType | None:
+        """Single bans lookup, batched with the other calls made at the same time"""
+        return self._bans_batcher.submit(steam_id).result()
+
+
+_CLIENT: SteamClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_steam_client(api_key: str) -> SteamClient:
+    """Return the process wide client, re-created if the API key changed"""
+    global _CLIENT
+
+    with _CLIENT_LOCK:
+        if _CLIENT is None or _CLIENT.api_key != api_key:
+            _CLIENT = SteamClient(
+                api_key, base_url=os.getenv("STEAM_API_URL", STEAM_API_URL)
+            )
+        return _CLIENT
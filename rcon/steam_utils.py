@@ -1,15 +1,21 @@
 import datetime
 import logging
-import math
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Mapping
 
-import steam.exceptions
-from steam.webapi import WebAPI
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert
 
-from rcon.cache_utils import ttl_cache
+from rcon.cache_utils import batch_ttl_cache, get_redis_client, get_redis_pool
 from rcon.config import get_config
-from rcon.models import PlayerSteamID, SteamInfo
+from rcon.models import PlayerSteamID, SteamInfo, enter_session
+from rcon.steam_client import (
+    MAX_IDS_PER_REQUEST,
+    SteamAPIError,
+    SteamAPIKeyError,
+    get_steam_client,
+)
 from rcon.types import SteamBanResultType, SteamBansType
 
 logger = logging.getLogger(__name__)
@@ -23,146 +29,149 @@ def get_steam_api_key() -> str | None:
     return steam_key
 
 
-@ttl_cache(60 * 60 * 24, cache_falsy=False, is_method=False)
-def get_steam_profile(steamd_id):
-    profiles = get_steam_profiles([steamd_id])
-    if not profiles or len(profiles) == 0:
+def _fetch_steam_profiles(steam_ids: List[str]) -> dict[str, dict] | None:
+    steam_key = get_steam_api_key()
+
+    if not steam_key:
+        return None
+
+    client = get_steam_client(steam_key)
+    try:
+        if len(steam_ids) == 1:
+            profile = client.get_player_summary(steam_ids[0])
+            return {steam_ids[0]: profile} if profile else {}
+        return client.get_player_summaries(steam_ids)
+    except SteamAPIKeyError:
+        logger.error("STEAM_API_KEY is invalid, can't fetch steam profile")
+        return None
+    except SteamAPIError as e:
+        logger.exception(e)
+        return None
+    except:
+        logging.exception("Unexpected error while fetching steam profile")
         return None
-    return profiles[0]
 
 
-@ttl_cache(60 * 60 * 24, cache_falsy=False, is_method=False)
-def get_steam_profiles(steam_ids):
+def _fetch_steam_bans(steam_ids: List[str]) -> dict[str, SteamBansType] | None:
     steam_key = get_steam_api_key()
 
     if not steam_key:
         return None
 
+    client = get_steam_client(steam_key)
     try:
-        api = WebAPI(key=steam_key)
-        return api.ISteamUser.GetPlayerSummaries(steamids=",".join(steam_ids))[
-            "response"
-        ]["players"]
-    except steam.exceptions.SteamError as e:
-        logger.exception(e)
+        if len(steam_ids) == 1:
+            bans = client.get_player_ban(steam_ids[0])
+            return {steam_ids[0]: bans} if bans else {}
+        return client.get_player_bans(steam_ids)
+    except SteamAPIKeyError:
+        logger.error("STEAM_API_KEY is invalid, can't fetch steam bans")
         return None
-    except AttributeError:
-        logger.error("STEAM_API_KEY is invalid, can't fetch steam profile")
+    except SteamAPIError as e:
+        logger.exception(e)
         return None
-    except IndexError:
-        logger.exception("Steam: no player found")
     except:
-        logging.exception("Unexpected error while fetching steam profile")
+        logging.exception("Unexpected error while fetching steam bans")
+        return None
+
+
+# Steam IDs unknown to the API are remembered for a shorter time
+# so that they don't trigger a request on every get_players refresh
+@batch_ttl_cache(60 * 60 * 24, batch_size=MAX_IDS_PER_REQUEST, falsy_ttl=60 * 60)
+def get_steam_profiles_by_id(steam_ids: List[str]) -> dict[str, dict] | None:
+    return _fetch_steam_profiles(steam_ids)
+
+
+@batch_ttl_cache(60 * 60, batch_size=MAX_IDS_PER_REQUEST, falsy_ttl=60 * 60)
+def get_steam_bans_by_id(steam_ids: List[str]) -> dict[str, SteamBansType] | None:
+    return _fetch_steam_bans(steam_ids)
+
+
+def get_steam_profile(steamd_id):
+    return get_steam_profiles_by_id([steamd_id]).get(steamd_id)
+
+
+def get_steam_profiles(steam_ids):
+    if not get_steam_api_key():
         return None
 
+    profiles = get_steam_profiles_by_id(steam_ids)
+    return [p for p in profiles.values() if p]
+
+
+def _profile_country(profile):
+    is_private = profile.get("communityvisibilitystate", 1) != 3
+    return profile.get("loccountrycode", "private" if is_private else "")
+
 
-@ttl_cache(60 * 60 * 24 * 7, cache_falsy=True, is_method=False)
 def get_player_country_code(steamd_id):
     profile = get_steam_profile(steamd_id)
 
     if not profile:
         return None
 
-    is_private = profile.get("communityvisibilitystate", 1) != 3
-    return profile.get("loccountrycode", "private" if is_private else "")
+    return _profile_country(profile)
 
 
-@ttl_cache(60 * 60, cache_falsy=True, is_method=False)
 def get_players_country_code(steamd_ids: List[str]) -> Mapping:
-    profiles = get_steam_profiles(steamd_ids)
+    profiles = get_steam_profiles_by_id(steamd_ids)
 
     result = dict.fromkeys(steamd_ids, {"country": None})
-    if not profiles:
-        return result
-
-    for profile in profiles:
-        is_private = profile.get("communityvisibilitystate", 1) != 3
-        country = profile.get("loccountrycode", "private" if is_private else "")
-        result[profile["steamid"]] = {"country": country}
+    for steam_id, profile in profiles.items():
+        if profile:
+            result[steam_id] = {"country": _profile_country(profile)}
 
     return result
 
 
-@ttl_cache(60 * 60 * 12, cache_falsy=False, is_method=False)
 def get_player_bans(steamd_id) -> SteamBansType | None:
-    steam_key = get_steam_api_key()
-
-    if not steam_key:
+    bans = get_steam_bans_by_id([steamd_id])
+    if steamd_id not in bans:
         return None
 
-    try:
-        api = WebAPI(key=steam_key)
-        bans = api.ISteamUser.GetPlayerBans(steamids=steamd_id)["players"][0]
-    except steam.exceptions.SteamError as e:
-        logger.exception(e)
-        return None
-    except AttributeError:
-        logger.error("STEAM_API_KEY is invalid, can't fetch steam profile")
-        return None
-    except IndexError:
-        logger.exception("Steam no player found")
-        return None
-    except:
-        logging.exception("Unexpected error while fetching steam bans")
-        return None
-
-    if not bans:
-        bans = {}
-    return bans
+    return bans[steamd_id] or {}
 
 
-@ttl_cache(60 * 60, cache_falsy=False, is_method=False)
 def get_players_ban(steamd_ids: List):
-    steam_key = get_steam_api_key()
-
-    if not steam_key:
+    bans = get_steam_bans_by_id(steamd_ids)
+    if not bans:
         return None
 
-    try:
-        api = WebAPI(key=steam_key)
-        bans = api.ISteamUser.GetPlayerBans(steamids=",".join(steamd_ids))["players"]
-    except steam.exceptions.SteamError as e:
-        logger.exception(e)
-        return None
-    except AttributeError:
-        logger.error("STEAM_API_KEY is invalid, can't fetch steam profile")
-        return None
-    except IndexError:
-        logger.exception("Steam no player found")
-        return None
-    except:
-        logging.exception("Unexpected error while fetching steam bans")
-        return None
+    return [b for b in bans.values() if b]
 
+
+def _with_has_bans(bans):
+    bans = dict(bans)
+    bans["has_bans"] = any(
+        bans.get(k)
+        for k in [
+            "VACBanned",
+            "NumberOfVACBans",
+            "DaysSinceLastBan",
+            "NumberOfGameBans",
+        ]
+    )
     return bans
 
 
-@ttl_cache(60 * 60 * 12, cache_falsy=False, is_method=False)
 def get_players_have_bans(steamd_ids: List) -> Mapping[str, SteamBanResultType]:
-    player_bans = get_players_ban(steamd_ids)
+    player_bans = get_steam_bans_by_id(steamd_ids)
 
     result = dict.fromkeys(steamd_ids, {"steam_bans": None})
-    if player_bans is None:
+    if not player_bans:
         logger.warning("Unable to read bans for %s" % steamd_ids)
         return result
 
-    for bans in player_bans:
-        bans["has_bans"] = any(
-            bans.get(k)
-            for k in [
-                "VACBanned",
-                "NumberOfVACBans",
-                "DaysSinceLastBan",
-                "NumberOfGameBans",
-            ]
-        )
-        result[bans["SteamId"]] = {"steam_bans": bans}
+    for steam_id, bans in player_bans.items():
+        if not bans:
+            continue
+        bans = _with_has_bans(bans)
         del bans["SteamId"]
+        result[steam_id] = {"steam_bans": bans}
 
     return result
 
 
-@ttl_cache(60 * 60 * 12, cache_falsy=False, is_method=False)
 def get_player_has_bans(steamd_id):
     bans = get_player_bans(steamd_id)
 
@@ -170,16 +179,7 @@ def get_player_has_bans(steamd_id):
         logger.warning("Unable to read bans for %s" % steamd_id)
         bans = {}
 
-    bans["has_bans"] = any(
-        bans.get(k)
-        for k in [
-            "VACBanned",
-            "NumberOfVACBans",
-            "DaysSinceLastBan",
-            "NumberOfGameBans",
-        ]
-    )
-    return bans
+    return _with_has_bans(bans)
 
 
 def update_db_player_info(player: PlayerSteamID, steam_profile):
@@ -189,43 +189,148 @@ def update_db_player_info(player: PlayerSteamID, steam_profile):
     player.steaminfo.country = steam_profile.get("loccountrycode")
 
 
-def enrich_db_users(chunk_size=100, update_from_days_old=30):
-    from sqlalchemy import or_
+ENRICH_CHECKPOINT_KEY = "enrich_db_users_checkpoint"
+# A checkpoint older than that belongs to a run nobody is going to resume
+ENRICH_CHECKPOINT_TTL_SECS = 60 * 60 * 24 * 2
 
-    from rcon.models import PlayerSteamID, SteamInfo, enter_session
 
-    max_age = datetime.datetime.utcnow() - datetime.timedelta(days=update_from_days_old)
-    with enter_session() as sess:
-        query = (
-            sess.query(PlayerSteamID)
+def _get_enrich_checkpoint() -> int:
+    if not get_redis_pool():
+        return 0
+    last_id = get_redis_client().get(ENRICH_CHECKPOINT_KEY)
+    return int(last_id) if last_id else 0
+
+
+def _set_enrich_checkpoint(last_id: int | None):
+    if not get_redis_pool():
+        return
+    red = get_redis_client()
+    if last_id is None:
+        red.delete(ENRICH_CHECKPOINT_KEY)
+    else:
+        red.setex(ENRICH_CHECKPOINT_KEY, ENRICH_CHECKPOINT_TTL_SECS, last_id)
+
+
+def _iter_players_to_enrich(sess, max_age, after_id=0, chunk_size=100):
+    """Yield {steam_id_64: player id} pages ordered by player id
+
+    Keyset pagination: each page starts after the last ID of the previous one so
+    players the steam API doesn't know about are not fetched over and over.
+    """
+    while True:
+        rows = (
+            sess.query(PlayerSteamID.id, PlayerSteamID.steam_id_64)
             .outerjoin(SteamInfo)
-            .filter(or_(PlayerSteamID.steaminfo == None, SteamInfo.updated <= max_age))
+            .filter(PlayerSteamID.id > after_id)
+            .filter(
+                or_(
+                    SteamInfo.id == None,
+                    func.coalesce(SteamInfo.updated, SteamInfo.created) <= max_age,
+                )
+            )
+            .order_by(PlayerSteamID.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+        yield {steam_id_64: id_ for id_, steam_id_64 in rows}
+        after_id = rows[-1][0]
+
+
+def upsert_steam_profiles(
+    sess, by_ids: Mapping[str, int], profiles: Mapping[str, dict]
+):
+    now = datetime.datetime.utcnow()
+    values = [
+        dict(
+            playersteamid_id=by_ids[steam_id],
+            profile=profile,
+            country=profile.get("loccountrycode"),
+            created=now,
+            updated=now,
         )
+        for steam_id, profile in profiles.items()
+        if steam_id in by_ids
+    ]
+    if not values:
+        return 0
+
+    stmt = insert(SteamInfo.__table__).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SteamInfo.__table__.c.playersteamid_id],
+        set_=dict(
+            profile=stmt.excluded.profile,
+            country=stmt.excluded.country,
+            updated=stmt.excluded.updated,
+        ),
+    )
+    sess.execute(stmt)
+    return len(values)
 
-        pages = math.ceil(query.count() / chunk_size)
-        for page in range(pages):
-            by_ids = {p.steam_id_64: p for p in query.limit(chunk_size).all()}
-            profiles = get_steam_profiles(list(by_ids.keys()))
-            logger.info(
-                "Updating steam profiles page %s of %s - result count (query) %s - result count (steam) %s",
-                page + 1,
-                pages,
-                len(by_ids),
-                len(profiles),
+
+def enrich_db_users(
+    chunk_size=MAX_IDS_PER_REQUEST, update_from_days_old=30, resume=True
+):
+    """Refresh the steam profiles older than `update_from_days_old` days
+
+    The steam lookup of the next page runs while the current one is written and
+    the last saved player ID is checkpointed in redis so an interrupted run
+    picks up where it stopped.
+    """
+    if not get_steam_api_key():
+        logger.warning("Can't enrich DB users without a STEAM_API_KEY")
+        return
+
+    max_age = datetime.datetime.utcnow() - datetime.timedelta(days=update_from_days_old)
+    after_id = _get_enrich_checkpoint() if resume else 0
+    if after_id:
+        logger.info("Resuming steam profiles update after player id %s", after_id)
+
+    started = time.monotonic()
+    nb_players = nb_saved = 0
+    with enter_session() as sess, ThreadPoolExecutor(max_workers=1) as executor:
+        pages = _iter_players_to_enrich(sess, max_age, after_id, chunk_size)
+        page = next(pages, None)
+        profiles_future = page and executor.submit(_fetch_steam_profiles, list(page))
+
+        while page:
+            next_page = next(pages, None)
+            next_future = next_page and executor.submit(
+                _fetch_steam_profiles, list(next_page)
             )
-            if not by_ids:
-                logger.warning("Empty query results")
-                continue
-            for p in profiles:
-                player = by_ids.get(p["steamid"])
-                if not player:
-                    logger.warning("Unable to find player %s", p["steamid"])
-                    continue
-                # logger.debug("Saving info for %s: %s", player.steam_id_64, p)
-                update_db_player_info(player=player, steam_profile=p)
 
+            profiles = profiles_future.result()
+            if profiles is None:
+                # The lookup failed, leave the checkpoint as is so the next run retries it
+                logger.error("Unable to fetch steam profiles, stopping")
+                if next_future:
+                    next_future.cancel()
+                break
+
+            nb_saved += upsert_steam_profiles(sess, page, profiles)
             sess.commit()
-            time.sleep(5)
+            _set_enrich_checkpoint(max(page.values()))
+
+            nb_players += len(page)
+            elapsed = time.monotonic() - started
+            logger.info(
+                "Updated steam profiles: %s players processed, %s profiles saved, %.1f players/s",
+                nb_players,
+                nb_saved,
+                nb_players / elapsed if elapsed else 0,
+            )
+            page, profiles_future = next_page, next_future
+        else:
+            _set_enrich_checkpoint(None)
+
+    logger.info(
+        "Steam profiles update done in %.1fs: %s players processed, %s profiles saved",
+        time.monotonic() - started,
+        nb_players,
+        nb_saved,
+    )
+    return dict(players=nb_players, saved=nb_saved)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,246 @@
+"""Incremental team view
+
+The service keeps the players of the last tick and publishes, every tick, the
+full team view and the diff with the previous tick:
+
+- the snapshot is stored in `team_view:snapshot` with the id of the last diff
+- the diffs are appended to the `team_view:diffs` redis stream
+
+A consumer reads the snapshot then follows the stream from its id. The DB
+profiles are only fetched for the players not seen on the previous tick.
+"""
+
+import pickle
+import time
+from logging import getLogger
+from typing import TypedDict
+
+from rcon.cache_utils import get_redis_client
+from rcon.commands import ServerCtl
+from rcon.player_history import get_profiles
+from rcon.rcon import STEAMID, Rcon
+from rcon.settings import SERVER_INFO
+
+logger = getLogger(__name__)
+
+LOOP_FREQUENCY_SEC = 2
+# Approximate number of diffs kept in the stream
+MAX_DIFFS = 1000
+SNAPSHOT_KEY = "team_view:snapshot"
+DIFFS_KEY = "team_view:diffs"
+
+# Where the player is in the teams and squads
+POSITION_FIELDS = ("name", "team", "unit_id", "unit_name", "role", "loadout")
+OTHER_FIELDS = ("level", "is_vip")
+SCORE_FIELDS = ("kills", "deaths", "combat", "offense", "defense", "support")
+
+
+class TeamViewDiff(TypedDict):
+    # True when the previous state is unknown, consumers reload the snapshot
+    reset: bool
+    joined: list[dict]
+    left: list[str]
+    # The new value of the position and other fields that changed
+    changed: dict[str, dict]
+    # The difference of the scores that changed
+    score_deltas: dict[str, dict[str, int]]
+    fail_count: int
+
+
+def diff_team_view_players(
+    previous: dict[str, dict], current: dict[str, dict], fail_count=0, reset=False
+) -> TeamViewDiff:
+    """The changes from the players by steam id of a tick to the next one"""
+    diff: TeamViewDiff = {
+        "reset": reset,
+        "joined": [],
+        "left": [steam_id_64 for steam_id_64 in previous if steam_id_64 not in current],
+        "changed": {},
+        "score_deltas": {},
+        "fail_count": fail_count,
+    }
+    for steam_id_64, player in current.items():
+        before = previous.get(steam_id_64)
+        if before is None:
+            diff["joined"].append(player)
+            continue
+
+        changed = {
+            field: player.get(field)
+            for field in POSITION_FIELDS + OTHER_FIELDS
+            if player.get(field) != before.get(field)
+        }
+        if changed:
+            diff["changed"][steam_id_64] = changed
+
+        deltas = {
+            field: (player.get(field) or 0) - (before.get(field) or 0)
+            for field in SCORE_FIELDS
+            if player.get(field) != before.get(field)
+        }
+        if deltas:
+            diff["score_deltas"][steam_id_64] = deltas
+    return diff
+
+
+def is_empty_diff(diff: TeamViewDiff) -> bool:
+    return not (
+        diff["reset"]
+        or diff["joined"]
+        or diff["left"]
+        or diff["changed"]
+        or diff["score_deltas"]
+    )
+
+
+def apply_team_view_diff(players: dict[str, dict], diff: TeamViewDiff) -> dict:
+    """The players by steam id after the diff, `players` is left untouched"""
+    players = {} if diff["reset"] else {k: dict(v) for k, v in players.items()}
+    for steam_id_64 in diff["left"]:
+        players.pop(steam_id_64, None)
+    for player in diff["joined"]:
+        players[player[STEAMID]] = dict(player)
+    for steam_id_64, changed in diff["changed"].items():
+        players[steam_id_64].update(changed)
+    for steam_id_64, deltas in diff["score_deltas"].items():
+        player = players[steam_id_64]
+        for field, delta in deltas.items():
+            player[field] = (player.get(field) or 0) + delta
+    return players
+
+
+class TeamViewService:
+    def __init__(self, rcon: Rcon, red=None, max_diffs=MAX_DIFFS):
+        self.rcon = rcon
+        self.red = red or get_redis_client(decode_responses=False)
+        self.max_diffs = max_diffs
+        self.players: dict[str, dict] = {}
+        self.profiles: dict[str, dict] = {}
+        self.vips: set[str] = set()
+        self.last_id = None
+
+    def _get_profiles(self, steam_ids) -> dict[str, dict]:
+        new_ids = [s for s in steam_ids if s not in self.profiles]
+        if new_ids:
+            logger.debug("Getting DB profiles of %s new players", len(new_ids))
+            # Players without a profile yet are looked up again next tick
+            for profile in get_profiles(new_ids):
+                self.profiles[profile[STEAMID]] = profile
+        self.profiles = {s: self.profiles[s] for s in steam_ids if s in self.profiles}
+        return self.profiles
+
+    def _get_vips(self) -> set[str]:
+        try:
+            # The uncached list, Rcon.get_vip_ids is cached for an hour
+            self.vips = {v[STEAMID] for v in ServerCtl.get_vip_ids(self.rcon)}
+        except Exception:
+            logger.exception("Failed to get VIPs, keeping the previous list")
+        return self.vips
+
+    def tick(self) -> TeamViewDiff:
+        detailed_players = self.rcon.get_detailed_players()
+        players_by_id = detailed_players["players"]
+        profiles = self._get_profiles(list(players_by_id))
+        vips = self._get_vips()
+        team_view = self.rcon.build_team_view(
+            players_by_id, detailed_players["fail_count"], profiles, vips
+        )
+
+        diff = diff_team_view_players(
+            self.players,
+            players_by_id,
+            detailed_players["fail_count"],
+            reset=self.last_id is None,
+        )
+        self.players = players_by_id
+        self.publish(team_view, diff)
+        return diff
+
+    def publish(self, team_view, diff: TeamViewDiff):
+        timestamp_ms = int(time.time() * 1000)
+        if not is_empty_diff(diff):
+            # The diff is added first, a consumer reading the previous snapshot
+            # gets it from the stream
+            self.last_id = self.red.xadd(
+                DIFFS_KEY,
+                {"timestamp_ms": timestamp_ms, "diff": pickle.dumps(diff)},
+                maxlen=self.max_diffs,
+                approximate=True,
+            )
+        self.red.set(
+            SNAPSHOT_KEY,
+            pickle.dumps(
+                {
+                    "id": _decode_id(self.last_id),
+                    "timestamp_ms": timestamp_ms,
+                    "team_view": team_view,
+                }
+            ),
+        )
+
+
+def _decode_id(stream_id):
+    return stream_id.decode() if isinstance(stream_id, bytes) else stream_id
+
+
+def get_team_view_snapshot(max_age_secs=None, red=None) -> dict | None:
+    """The last published team view, None if missing or older than max_age_secs"""
+    red = red or get_redis_client(decode_responses=False)
+    snapshot = red.get(SNAPSHOT_KEY)
+    if not snapshot:
+        return None
+    snapshot = pickle.loads(snapshot)
+    if (
+        max_age_secs is not None
+        and time.time() * 1000 - snapshot["timestamp_ms"] > max_age_secs * 1000
+    ):
+        return None
+    return snapshot
+
+
+def get_team_view_diffs(
+    after_id="0", count=100, block_ms=None, red=None
+) -> list[tuple[str, int, TeamViewDiff]]:
+    """(id, timestamp_ms, diff) of the diffs published after `after_id`"""
+    red = red or get_redis_client(decode_responses=False)
+    streams = red.xread({DIFFS_KEY: after_id}, count=count, block=block_ms)
+    diffs = []
+    for _, entries in streams or []:
+        for stream_id, fields in entries:
+            diffs.append(
+                (
+                    _decode_id(stream_id),
+                    int(fields[b"timestamp_ms"]),
+                    pickle.loads(fields[b"diff"]),
+                )
+            )
+    return diffs
+
+
+def get_fresh_team_view(rcon: Rcon, max_age_secs=5):
+    """The published team view if the service is running, else computes it"""
+    try:
+        snapshot = get_team_view_snapshot(max_age_secs)
+    except Exception:
+        logger.exception("Unable to read the team view snapshot")
+        snapshot = None
+    if snapshot:
+        return snapshot["team_view"]
+    return rcon.get_team_view()
+
+
+def run():
+    service = TeamViewService(Rcon(SERVER_INFO))
+
+    next_tick = time.monotonic()
+    while True:
+        try:
+            service.tick()
+        except Exception:
+            logger.exception("Unable to update the team view")
+        next_tick = max(next_tick + LOOP_FREQUENCY_SEC, time.monotonic())
+        time.sleep(next_tick - time.monotonic())
+
+
+if __name__ == "__main__":
+    run()
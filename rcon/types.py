@@ -1,5 +1,5 @@
 import datetime
-from typing import List, Optional, TypedDict
+from typing import List, NotRequired, Optional, TypedDict
 
 
 class SteamBansType(TypedDict):
@@ -116,7 +116,8 @@ class MapInfo(TypedDict):
     start: None | float
     end: None | float
     guessed: bool
-    player_stats: dict[str, PlayerStat]
+    # Only in the entries saved before the stats moved to MapPlayerStats
+    player_stats: NotRequired[dict[str, PlayerStat]]
 
 
 class MapsType(TypedDict):
@@ -143,6 +144,13 @@ class PlayerAtCountType(TypedDict):
     vip: Optional[bool]
 
 
+class PlayerPresenceType(TypedDict):
+    steam_id_64: str
+    start: datetime.datetime
+    end: datetime.datetime
+    vip: Optional[bool]
+
+
 class ServerCountType(TypedDict):
     server_number: Optional[int]
     minute: datetime.datetime
@@ -192,6 +200,15 @@ class WatchListType(TypedDict):
     count: int
 
 
+class PlayerConnectStateType(TypedDict):
+    player_id: int
+    steam_id_64: str
+    blacklist: Optional[BlackListType]
+    watchlist: Optional[WatchListType]
+    flags: List[PlayerFlagType]
+    vip_expiration: Optional[datetime.datetime]
+
+
 class UserConfigType(TypedDict):
     key: str
     value: str
@@ -1,7 +1,10 @@
+import asyncio
+import itertools
 import json
 import logging
 import os
 import secrets
+import threading
 from datetime import datetime
 from typing import Generic, TypeVar
 from urllib.parse import urlparse
@@ -9,7 +12,7 @@ from urllib.parse import urlparse
 import redis
 
 from rcon.cache_utils import get_redis_pool
-from rcon.types import MapInfo
+from rcon.types import MapInfo, PlayerStat
 
 logger = logging.getLogger("rcon")
 
@@ -421,6 +424,17 @@ class FixedLenList(Generic[T]):
         for o in self.red.lrange(self.key, 0, -1):
             yield self.deserializer(o)
 
+    def iter_chunked(self, chunk_size=500):
+        """Iterate from the head of the list reading `chunk_size` items per call
+
+        Items pushed while iterating shift the indexes so an item can be seen twice
+        """
+        start = 0
+        while chunk := self.red.lrange(self.key, start, start + chunk_size - 1):
+            for o in chunk:
+                yield self.deserializer(o)
+            start += chunk_size
+
     def __len__(self):
         return self.red.llen(self.key)
 
@@ -432,9 +446,7 @@ class MapsHistory(FixedLenList[MapInfo]):
     def save_map_end(self, old_map=None, end_timestamp: int = None):
         ts = end_timestamp or datetime.now().timestamp()
         logger.info("Saving end of map %s at time %s", old_map, ts)
-        prev = self.lpop() or MapInfo(
-            name=old_map, start=None, end=None, guessed=True, player_stats=dict()
-        )
+        prev = self.lpop() or MapInfo(name=old_map, start=None, end=None, guessed=True)
         prev["end"] = ts
         self.lpush(prev)
         return prev
@@ -442,13 +454,94 @@ class MapsHistory(FixedLenList[MapInfo]):
     def save_new_map(self, new_map, guessed=True, start_timestamp: int = None):
         ts = start_timestamp or datetime.now().timestamp()
         logger.info("Saving start of new map %s at time %s", new_map, ts)
-        new = MapInfo(
-            name=new_map, start=ts, end=None, guessed=guessed, player_stats=dict()
-        )
+        new = MapInfo(name=new_map, start=ts, end=None, guessed=guessed)
         self.add(new)
         return new
 
 
+PLAYER_STAT_KEYS = ("combat", "offense", "defense", "support")
+
+# Keeps the max of each score of the players, ARGV is the TTL of the hash then
+# pairs of steam ID and JSON stats
+_MERGE_PLAYER_STATS_LUA = """
+local changed = 0
+for i = 2, #ARGV, 2 do
+    local new = cjson.decode(ARGV[i + 1])
+    local raw = redis.call('HGET', KEYS[1], ARGV[i])
+    local updated = true
+    if raw then
+        local current = cjson.decode(raw)
+        updated = false
+        for _, stat in ipairs({'combat', 'offense', 'defense', 'support'}) do
+            if (new[stat] or 0) > (current[stat] or 0) then
+                current[stat] = new[stat]
+                updated = true
+            end
+        end
+        new = current
+    end
+    if updated then
+        redis.call('HSET', KEYS[1], ARGV[i], cjson.encode(new))
+        changed = changed + 1
+    end
+end
+if tonumber(ARGV[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return changed
+"""
+
+
+def max_merge_player_stats(*stats: dict[str, PlayerStat]) -> dict[str, PlayerStat]:
+    merged = {}
+    for stats_by_steam_id in stats:
+        for steam_id, stat in stats_by_steam_id.items():
+            current = merged.setdefault(steam_id, PlayerStat(**stat))
+            for key in PLAYER_STAT_KEYS:
+                current[key] = max(current.get(key) or 0, stat.get(key) or 0)
+    return merged
+
+
+class MapPlayerStats:
+    """Score stats of the players of a map of the MapsHistory
+
+    Kept in a hash keyed by steam ID next to the map entry so they can be
+    updated without rewriting the whole map history entry
+    """
+
+    key_prefix = "map_player_stats"
+    ttl_secs = 60 * 60 * 24 * 7
+
+    def __init__(self, map_info: MapInfo):
+        self.red = redis.StrictRedis(connection_pool=get_redis_pool())
+        self.map_info = map_info
+        self.key = self.key_for(map_info)
+
+    @classmethod
+    def key_for(cls, map_info: MapInfo) -> str:
+        return f"{cls.key_prefix}:{map_info['start']}:{map_info['name']}"
+
+    def merge(self, stats: dict[str, PlayerStat]) -> int:
+        """Raise the scores of the players to the ones given, return the number of
+        players changed"""
+        if not stats:
+            return 0
+        args = [self.ttl_secs]
+        for steam_id, stat in stats.items():
+            args += [steam_id, json.dumps(stat)]
+        return self.red.register_script(_MERGE_PLAYER_STATS_LUA)(
+            keys=[self.key], args=args
+        )
+
+    def get_all(self) -> dict[str, PlayerStat]:
+        stats = {
+            steam_id.decode(): json.loads(stat)
+            for steam_id, stat in self.red.hgetall(self.key).items()
+        }
+        # Entries saved before the hash existed have the stats inline
+        return max_merge_player_stats(self.map_info.get("player_stats") or {}, stats)
+
+
 class ApiKey:
     def __init__(self):
         num = os.getenv("SERVER_NUMBER")
@@ -506,3 +599,32 @@ def exception_in_chain(e: BaseException, c) -> bool:
             return True
 
     return False
+
+
+async def iterate_in_threads(iterable, chunk_size=100):
+    """Async iterator of a blocking iterable, `chunk_size` items are read at a
+    time on the default executor so the event loop is never blocked
+
+    For the streamed responses of the ASGI server, it would read a sync iterator
+    to the end before sending anything.
+    """
+    iterator = iter(iterable)
+    # A chunk may still be read when the client goes away
+    lock = threading.Lock()
+
+    def next_chunk():
+        with lock:
+            return list(itertools.islice(iterator, chunk_size))
+
+    def close():
+        with lock:
+            # Releases what the iterator holds, like a DB session
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    try:
+        while chunk := await asyncio.to_thread(next_chunk):
+            for item in chunk:
+                yield item
+    finally:
+        await asyncio.to_thread(close)
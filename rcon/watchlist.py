@@ -3,46 +3,72 @@ from datetime import datetime
 from discord_webhook import DiscordEmbed
 
 from rcon.discord import get_prepared_discord_hooks
-from rcon.game_logs import on_connected
-from rcon.hooks import inject_player_ids
-from rcon.models import WatchList, enter_session
-from rcon.player_history import _get_set_player, get_player
+from rcon.hooks import inject_player_ids, on_player_connected
+from rcon.models import PlayerName, PlayerSteamID, WatchList, enter_session
+from rcon.player_history import (
+    _get_set_player,
+    get_player,
+    get_player_connect_state,
+)
 from rcon.rcon import CommandFailedError, Rcon
-from rcon.types import PlayerProfileType
+from rcon.types import PlayerConnectStateType, PlayerProfileType
 
 
-@on_connected
 @inject_player_ids
 def watchdog(rcon: Rcon, log, name: str, steam_id_64: str):
-    watcher = PlayerWatch(steam_id_64)
-    if watcher.is_watched():
-        watcher.increment_watch()
-        if hooks := get_prepared_discord_hooks("watchlist"):
-            watched_player = watcher.get_watch()
-            player_name = log["player"]
-
-            if watched_player and watched_player["watchlist"]:
-                timestamp = int(watched_player["watchlist"]["modified"].timestamp())
-                steam_id_64 = watched_player["steam_id_64"]
-                watched_by = watched_player["watchlist"]["by"]
-                session_count = watched_player["watchlist"]["count"]
-                reason = watched_player["watchlist"]["reason"]
-                names = ", ".join(n["name"] for n in watched_player["names"])
-
-                embed = DiscordEmbed(
-                    title=f"{player_name}  - {steam_id_64}",
-                    description=f"""AKA: {names}
-                    
-                    Watched on: <t:{timestamp}:f> (<t:{timestamp}:R>)
-                    By: {watched_by}
-                    Sessions Since Watch: {session_count}
-                    Reason: __{reason}__
-                    """,
-                    color=242424,
-                )
-                for h in hooks:
-                    h.add_embed(embed)
-                    h.execute()
+    """Check a player on its own, on connect watch_on_connect is given the state
+    handle_on_connect already loaded"""
+    with enter_session() as sess:
+        player = get_player(sess, steam_id_64)
+        state = get_player_connect_state(sess, player.id) if player else None
+    if state:
+        watch_on_connect(rcon, log, name, steam_id_64, state)
+
+
+@on_player_connected
+def watch_on_connect(
+    rcon: Rcon, log, name: str, steam_id_64: str, state: PlayerConnectStateType
+):
+    watchlist = state["watchlist"]
+    if not watchlist or not watchlist["is_watched"]:
+        return
+
+    increment_watch_count(state["player_id"])
+    if hooks := get_prepared_discord_hooks("watchlist"):
+        timestamp = int(watchlist["modified"].timestamp())
+        names = ", ".join(get_player_names(state["player_id"]))
+
+        embed = DiscordEmbed(
+            title=f"{log['player']}  - {steam_id_64}",
+            description=f"""AKA: {names}
+            
+            Watched on: <t:{timestamp}:f> (<t:{timestamp}:R>)
+            By: {watchlist["by"]}
+            Sessions Since Watch: {watchlist["count"] + 1}
+            Reason: __{watchlist["reason"]}__
+            """,
+            color=242424,
+        )
+        for h in hooks:
+            h.add_embed(embed)
+            h.execute()
+
+
+def increment_watch_count(player_id: int) -> None:
+    with enter_session() as sess:
+        sess.query(WatchList).filter(WatchList.playersteamid_id == player_id).update(
+            {WatchList.count: WatchList.count + 1}, synchronize_session=False
+        )
+
+
+def get_player_names(player_id: int) -> list[str]:
+    with enter_session() as sess:
+        return [
+            name
+            for name, in sess.query(PlayerName.name).filter(
+                PlayerName.playersteamid_id == player_id
+            )
+        ]
 
 
 class PlayerWatch:
@@ -66,8 +92,13 @@ class PlayerWatch:
             return player.to_dict()
 
     def is_watched(self) -> bool:
-        watch = self.get_watch()
-        return watch and watch["watchlist"] and watch["watchlist"]["is_watched"]
+        with enter_session() as sess:
+            return bool(
+                sess.query(WatchList.is_watched)
+                .join(PlayerSteamID)
+                .filter(PlayerSteamID.steam_id_64 == self.steam_id_64)
+                .scalar()
+            )
 
     def unwatch(self):
         with enter_session() as sess:
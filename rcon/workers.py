@@ -3,21 +3,21 @@ import logging
 import os
 from concurrent.futures import as_completed
 from datetime import timedelta
-from typing import Set
 
 from dateutil import relativedelta
 from rq import Queue
 from rq.job import Job
-from sqlalchemy import and_
+from sqlalchemy import and_, literal_column
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from rcon.cache_utils import get_redis_client
-from rcon.models import Maps, PlayerStats, enter_session
-from rcon.player_history import get_player
+from rcon.columnar_stats import ColumnarTimeWindowStats
+from rcon.models import Maps, PlayerStats, PlayerSteamID, enter_session
 from rcon.rcon import Rcon
-from rcon.scoreboard import TimeWindowStats
 from rcon.settings import SERVER_INFO
 from rcon.types import MapInfo, PlayerStat
+from rcon.utils import MapPlayerStats
 
 logger = logging.getLogger("rcon")
 
@@ -129,120 +129,144 @@ def _record_stats(map_info: MapInfo):
             server_number=os.getenv("SERVER_NUMBER"),
             map_name=map_info["name"],
         )
-        record_stats_from_map(sess, map_, map_info.get("player_stats", dict()))
+        record_stats_from_map(sess, map_, MapPlayerStats(map_info).get_all())
         sess.commit()
 
 
+# Columns left untouched when re-processing the stats of a player
+_PLAYER_STATS_KEY_COLUMNS = ("id", "playersteamid_id", "map_id", "name")
+
+
+def _player_stat_row(player_id, map_id, stats, map_stats: PlayerStat) -> dict:
+    return dict(
+        playersteamid_id=player_id,
+        map_id=map_id,
+        name=stats.get("player"),
+        kills=stats.get("kills"),
+        kills_streak=stats.get("kills_streak"),
+        deaths=stats.get("deaths"),
+        deaths_without_kill_streak=stats.get("deaths_without_kill_streak"),
+        teamkills=stats.get("teamkills"),
+        teamkills_streak=stats.get("teamkills_streak"),
+        deaths_by_tk=stats.get("deaths_by_tk"),
+        deaths_by_tk_streak=stats.get("deaths_by_tk_streak"),
+        nb_vote_started=stats.get("nb_vote_started"),
+        nb_voted_yes=stats.get("nb_voted_yes"),
+        nb_voted_no=stats.get("nb_voted_no"),
+        time_seconds=stats.get("time_seconds"),
+        kills_per_minute=stats.get("kills_per_minute"),
+        deaths_per_minute=stats.get("deaths_per_minute"),
+        kill_death_ratio=stats.get("kill_death_ratio"),
+        longest_life_secs=stats.get("longest_life_secs"),
+        shortest_life_secs=stats.get("shortest_life_secs"),
+        weapons=stats.get("weapons"),
+        most_killed=stats.get("most_killed"),
+        death_by=stats.get("death_by"),
+        death_by_weapons=stats.get("death_by_weapons"),
+        combat=map_stats.get("combat"),
+        offense=map_stats.get("offense"),
+        defense=map_stats.get("defense"),
+        support=map_stats.get("support"),
+    )
+
+
+def upsert_player_stats(sess: Session, rows: list[dict], force: bool = False):
+    """Insert the rows in one statement, existing ones are updated with `force`
+
+    Returns the number of (inserted, updated) rows
+    """
+    if not rows:
+        return 0, 0
+
+    stmt = insert(PlayerStats.__table__).values(rows)
+    if force:
+        stmt = stmt.on_conflict_do_update(
+            constraint="unique_map_player",
+            set_={
+                c.name: stmt.excluded[c.name]
+                for c in PlayerStats.__table__.columns
+                if c.name not in _PLAYER_STATS_KEY_COLUMNS
+            },
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(constraint="unique_map_player")
+    # xmax is only set on the rows that were updated
+    results = sess.execute(stmt.returning(literal_column("xmax = 0"))).fetchall()
+    inserted = sum(1 for (is_insert,) in results if is_insert)
+    return inserted, len(results) - inserted
+
+
 def record_stats_from_map(
     sess: Session, map_, ps: dict[str, PlayerStat] = (), force: bool = False
 ):
-    stats = TimeWindowStats()
+    stats = ColumnarTimeWindowStats()
     player_stats = stats.get_players_stats_at_time(
         from_=map_.start, until=map_.end, server_number=str(map_.server_number)
     )
 
-    seen_players: Set[str] = set()
-    for player, stats in player_stats.items():
-        if steam_id_64 := stats.get("steam_id_64"):
-            # If a player has changed their name and had stats recorded under two or more
-            # names in the same match it will otherwise try to insert duplicate records
-            # This will only record stats for the first instance of the player it sees, the other(s)
-            # will be lost of course
-            if steam_id_64 in seen_players:
-                logger.info(f"Failed to record duplicate stats for {steam_id_64}")
-                continue
-            seen_players.add(steam_id_64)
-
-            player_record = get_player(sess, steam_id_64=steam_id_64)
-            if not player_record:
-                logger.error("Can't find DB record for %s", steam_id_64)
-                continue
-
-            existing: PlayerStats | None = (
-                sess.query(PlayerStats)
-                .filter(
-                    PlayerStats.map_id == map_.id,
-                    PlayerStats.playersteamid_id == player_record.id,
-                )
-                .one_or_none()
+    # If a player has changed their name and had stats recorded under two or more
+    # names in the same match it will otherwise try to insert duplicate records
+    # This will only record stats for the first instance of the player it sees, the other(s)
+    # will be lost of course
+    by_steam_id = {}
+    for stats in player_stats.values():
+        steam_id_64 = stats.get("steam_id_64")
+        if not steam_id_64:
+            logger.error("Stat object does not contain a steam id: %s", stats)
+        elif steam_id_64 in by_steam_id:
+            logger.info(f"Failed to record duplicate stats for {steam_id_64}")
+        else:
+            by_steam_id[steam_id_64] = stats
+
+    player_ids = dict(
+        sess.query(PlayerSteamID.steam_id_64, PlayerSteamID.id).filter(
+            PlayerSteamID.steam_id_64.in_(list(by_steam_id))
+        )
+    )
+    existing = {
+        row.playersteamid_id: row
+        for row in sess.query(
+            PlayerStats.playersteamid_id,
+            PlayerStats.combat,
+            PlayerStats.offense,
+            PlayerStats.defense,
+            PlayerStats.support,
+        ).filter(PlayerStats.map_id == map_.id)
+    }
+
+    rows = []
+    for steam_id_64, stats in by_steam_id.items():
+        player_id = player_ids.get(steam_id_64)
+        if player_id is None:
+            logger.error("Can't find DB record for %s", steam_id_64)
+            continue
+
+        current = existing.get(player_id)
+        if current is not None and not force:
+            continue
+        default_stat = PlayerStat(combat=0, offense=0, defense=0, support=0)
+        if current is not None:
+            default_stat = PlayerStat(
+                combat=current.combat,
+                offense=current.offense,
+                defense=current.defense,
+                support=current.support,
             )
-            default_stat = PlayerStat(combat=0, offense=0, defense=0, support=0)
-            if existing is not None:
-                default_stat = PlayerStat(
-                    combat=existing.combat,
-                    offense=existing.offense,
-                    defense=existing.defense,
-                    support=existing.support,
-                )
-            map_stats = ps.get(steam_id_64, default_stat)
-            player_stat = dict(
-                playersteamid_id=player_record.id,
-                map_id=map_.id,
-                name=stats.get("player"),
-                kills=stats.get("kills"),
-                kills_streak=stats.get("kills_streak"),
-                deaths=stats.get("deaths"),
-                deaths_without_kill_streak=stats.get("deaths_without_kill_streak"),
-                teamkills=stats.get("teamkills"),
-                teamkills_streak=stats.get("teamkills_streak"),
-                deaths_by_tk=stats.get("deaths_by_tk"),
-                deaths_by_tk_streak=stats.get("deaths_by_tk_streak"),
-                nb_vote_started=stats.get("nb_vote_started"),
-                nb_voted_yes=stats.get("nb_voted_yes"),
-                nb_voted_no=stats.get("nb_voted_no"),
-                time_seconds=stats.get("time_seconds"),
-                kills_per_minute=stats.get("kills_per_minute"),
-                deaths_per_minute=stats.get("deaths_per_minute"),
-                kill_death_ratio=stats.get("kill_death_ratio"),
-                longest_life_secs=stats.get("longest_life_secs"),
-                shortest_life_secs=stats.get("shortest_life_secs"),
-                weapons=stats.get("weapons"),
-                most_killed=stats.get("most_killed"),
-                death_by=stats.get("death_by"),
-                death_by_weapons=stats.get("death_by_weapons"),
-                combat=map_stats.get("combat"),
-                offense=map_stats.get("offense"),
-                defense=map_stats.get("defense"),
-                support=map_stats.get("support"),
+        rows.append(
+            _player_stat_row(
+                player_id, map_.id, stats, ps.get(steam_id_64, default_stat)
             )
-            if existing is not None and force != True:
-                continue
-            elif existing is not None and force == True:
-                logger.debug(f"Updating stats %s", player_stat)
-                existing.kills = player_stat.get("kills")
-                existing.kills_streak = player_stat.get("kills_streak")
-                existing.deaths = player_stat.get("deaths")
-                existing.deaths_without_kill_streak = player_stat.get(
-                    "deaths_without_kill_streak"
-                )
-                existing.teamkills = player_stat.get("teamkills")
-                existing.teamkills_streak = player_stat.get("teamkills_streak")
-                existing.deaths_by_tk = player_stat.get("deaths_by_tk")
-                existing.deaths_by_tk_streak = player_stat.get("deaths_by_tk_streak")
-                existing.nb_vote_started = player_stat.get("nb_vote_started")
-                existing.nb_voted_yes = player_stat.get("nb_voted_yes")
-                existing.nb_voted_no = player_stat.get("nb_voted_no")
-                existing.time_seconds = player_stat.get("time_seconds")
-                existing.kills = player_stat.get("kills")
-                existing.kills_per_minute = player_stat.get("kills_per_minute")
-                existing.deaths_per_minute = player_stat.get("deaths_per_minute")
-                existing.kill_death_ratio = player_stat.get("kill_death_ratio")
-                existing.longest_life_secs = player_stat.get("longest_life_secs")
-                existing.shortest_life_secs = player_stat.get("shortest_life_secs")
-                existing.weapons = player_stat.get("weapons")
-                existing.most_killed = player_stat.get("most_killed")
-                existing.death_by = player_stat.get("death_by")
-                existing.death_by_weapons = player_stat.get("death_by_weapons")
-                existing.combat = player_stat.get("combat")
-                existing.offense = player_stat.get("offense")
-                existing.defense = player_stat.get("defense")
-                existing.support = player_stat.get("support")
-            else:
-                logger.debug(f"Saving stats %s", player_stat)
-                player_stat_record = PlayerStats(**player_stat)
-                sess.add(player_stat_record)
-        else:
-            logger.error("Stat object does not contain a steam id: %s", stats)
+        )
+
+    inserted, updated = upsert_player_stats(sess, rows, force=force)
+    logger.info(
+        "Recorded stats of map %s: %s inserted, %s updated, %s skipped",
+        map_.id,
+        inserted,
+        updated,
+        len(by_steam_id) - inserted - updated,
+    )
+    return {"inserted": inserted, "updated": updated}
 
 
 def get_job_results(job_key):
@@ -20,6 +20,41 @@ def _to_list(value):
     return value
 
 
+def save_audit(username, command, arguments, result):
+    with enter_session() as sess:
+        sess.add(
+            AuditLog(
+                username=username,
+                command=command,
+                command_arguments=json.dumps(arguments),
+                command_result=result,
+            )
+        )
+
+
+def save_audits(username, audits):
+    """Save the (command, arguments, result) audits in a single insert"""
+    if not audits:
+        return
+    with enter_session() as sess:
+        sess.bulk_insert_mappings(
+            AuditLog,
+            [
+                dict(
+                    username=username,
+                    command=command,
+                    command_arguments=json.dumps(arguments),
+                    command_result=result,
+                )
+                for command, arguments, result in audits
+            ],
+        )
+
+
+def is_audited(name):
+    return name.startswith("do_") or name.startswith("set_")
+
+
 def record_audit(func):
     @wraps(func)
     def wrapper(request, **kwargs):
@@ -34,15 +69,7 @@ def record_audit(func):
             result = repr(e)
             raise
         finally:
-            with enter_session() as sess:
-                sess.add(
-                    AuditLog(
-                        username=user,
-                        command=name,
-                        command_arguments=json.dumps(data),
-                        command_result=result,
-                    )
-                )
+            save_audit(user, name, data, result)
 
         return raw
 
@@ -51,7 +78,7 @@ def record_audit(func):
 
 def auto_record_audit(name):
     def wrapper(func):
-        if name.startswith("do_") or name.startswith("set_"):
+        if is_audited(name):
             return record_audit(func)
         else:
             return func
@@ -10,14 +10,16 @@ from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
 from django.db.models.signals import post_delete, post_save
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from rcon.audit import heartbeat, ingame_mods, online_mods, set_registered_mods
 from rcon.cache_utils import ttl_cache
 from rcon.config import get_config
+from rcon.utils import iterate_in_threads
 
 from .models import SteamPlayer
+from .utils import ASYNC_VIEWS
 
 logger = logging.getLogger("rconweb")
 
@@ -62,6 +64,40 @@ def api_csv_response(content, name, header):
     return response
 
 
+class _Echo:
+    """File-like object giving back what's written to it, for the csv writer"""
+
+    def write(self, value):
+        return value
+
+
+def _streaming_content(chunks):
+    # The ASGI handler reads a sync iterator to the end before sending it
+    return iterate_in_threads(chunks) if ASYNC_VIEWS else chunks
+
+
+def api_csv_streaming_response(rows, name, header):
+    """Stream `rows` as CSV, they are consumed as the response is sent"""
+    writer = csv.DictWriter(
+        _Echo(), fieldnames=header, dialect="excel", extrasaction="ignore"
+    )
+    response = StreamingHttpResponse(
+        _streaming_content(writer.writerow(row) for row in rows),
+        content_type="text/csv",
+    )
+    response["Content-Disposition"] = 'attachment; filename="%s"' % name
+    return response
+
+
+def api_ndjson_streaming_response(rows, name):
+    response = StreamingHttpResponse(
+        _streaming_content(json.dumps(row, default=str) + "\n" for row in rows),
+        content_type="application/x-ndjson",
+    )
+    response["Content-Disposition"] = 'attachment; filename="%s"' % name
+    return response
+
+
 @csrf_exempt
 def do_login(request):
     try:
@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from rcon.live_updates import (
+    TOPICS,
+    StreamSlots,
+    aiter_updates,
+    decode_cursors,
+    encode_cursors,
+    get_last_ids,
+    get_stale_topics,
+    iter_updates,
+)
+from rcon.scoreboard import LiveStats, get_cached_live_game_stats
+from rcon.team_view import get_team_view_snapshot
+
+from .auth import api_response, login_required
+from .utils import ASYNC_VIEWS, _get_data
+
+logger = logging.getLogger("rconweb")
+
+# The permission of the endpoint each topic replaces polling
+TOPIC_PERMISSIONS = {
+    "logs": "api.can_view_recent_logs",
+    "team_view": "api.can_view_team_view",
+    "live_stats": None,
+    "live_game_stats": None,
+}
+# How long the browser waits before reconnecting
+RETRY_MS = 1000
+# Under the sync workers each open stream holds one of the NB_API_THREADS threads
+# of the worker for as long as it's open, so only some of them can be streams.
+# The others are refused and the clients poll the endpoints instead.
+MAX_SYNC_STREAMS = int(
+    os.getenv("LIVE_UPDATES_MAX_SYNC_STREAMS")
+    or max(1, int(os.getenv("NB_API_THREADS") or 8) // 4)
+)
+_sync_stream_slots = StreamSlots(MAX_SYNC_STREAMS)
+
+
+def _sse_event(event, data, event_id=None):
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, cls=DjangoJSONEncoder)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _get_snapshots(topics, cursors):
+    """The current state of the topics, the updates are read from `cursors`"""
+    snapshots = {}
+    if "team_view" in topics:
+        snapshot = get_team_view_snapshot()
+        if snapshot:
+            # The diffs after the snapshot, they are not idempotent
+            cursors["team_view"] = snapshot["id"] or cursors["team_view"]
+            snapshots["team_view"] = snapshot["team_view"]
+    if "live_stats" in topics:
+        snapshots["live_stats"] = LiveStats().get_cached_stats()
+    if "live_game_stats" in topics:
+        snapshots["live_game_stats"] = get_cached_live_game_stats()
+    return snapshots
+
+
+def _first_events(cursors, snapshots, stale):
+    yield f"retry: {RETRY_MS}\n\n"
+    for topic in stale:
+        # Updates were missed, the client reloads the topic with its endpoint
+        yield _sse_event("reset", {"topic": topic}, encode_cursors(cursors))
+    for topic, snapshot in snapshots.items():
+        yield _sse_event(
+            "snapshot", {"topic": topic, "data": snapshot}, encode_cursors(cursors)
+        )
+
+
+def _update_event(update):
+    if update is None:
+        return ": keepalive\n\n"
+    topic, payload, cursors = update
+    return _sse_event(topic, payload, encode_cursors(cursors))
+
+
+def _stream_updates(topics, cursors, snapshots, stale):
+    yield from _first_events(cursors, snapshots, stale)
+    try:
+        for update in iter_updates(cursors):
+            yield _update_event(update)
+    except Exception:
+        logger.exception("Live updates stream stopped for %s", topics)
+
+
+async def _astream_updates(topics, cursors, snapshots, stale):
+    """The events as an async iterator, the ASGI handler would read a sync one
+    to the end before sending anything"""
+    for event in _first_events(cursors, snapshots, stale):
+        yield event
+    try:
+        async for update in aiter_updates(cursors):
+            yield _update_event(update)
+    except Exception:
+        logger.exception("Live updates stream stopped for %s", topics)
+
+
+@csrf_exempt
+@login_required()
+def live_updates(request):
+    """Server-Sent Events of the new log lines, team view diffs and stats updates
+
+    The event id holds the position in each topic, the browser sends it back as
+    the Last-Event-ID header when it reconnects and the stream resumes from it.
+    The stream is closed after about a minute and the browser reconnects.
+
+    Under the sync workers a stream holds a thread of the worker, past
+    MAX_SYNC_STREAMS streams the request fails with a 503 and the client polls
+    the endpoints instead. The ASGI workers have no such limit.
+    """
+    data = _get_data(request)
+    topics = [t for t in data.get("topics", ",".join(TOPICS)).split(",") if t]
+
+    unknown = [t for t in topics if t not in TOPICS]
+    if unknown:
+        return api_response(
+            command="live_updates",
+            error=f"Unknown topics {unknown}, valid ones are {list(TOPICS)}",
+            failed=True,
+            status_code=400,
+        )
+    denied = [
+        t
+        for t in topics
+        if TOPIC_PERMISSIONS[t] and not request.user.has_perm(TOPIC_PERMISSIONS[t])
+    ]
+    if denied:
+        return api_response(
+            command="live_updates",
+            error=f"You do not have the required permissions to use {denied}",
+            failed=True,
+            status_code=403,
+        )
+
+    if not ASYNC_VIEWS and not _sync_stream_slots.acquire():
+        return api_response(
+            command="live_updates",
+            error=(
+                f"This worker already serves {MAX_SYNC_STREAMS} live updates streams,"
+                " poll the endpoints instead or serve the API with RCONWEB_ASGI"
+            ),
+            failed=True,
+            status_code=503,
+        )
+
+    try:
+        last_event_id = request.headers.get("Last-Event-ID") or data.get(
+            "last_event_id"
+        )
+        resumed = {
+            t: cursor
+            for t, cursor in decode_cursors(last_event_id).items()
+            if t in topics
+        }
+        # The topics not resumed start with their current state
+        cursors = get_last_ids(t for t in topics if t not in resumed)
+        snapshots = _get_snapshots(list(cursors), cursors)
+        stale = get_stale_topics(resumed)
+        cursors.update(resumed)
+    except:
+        if not ASYNC_VIEWS:
+            _sync_stream_slots.release()
+        raise
+
+    if ASYNC_VIEWS:
+        stream = _astream_updates(topics, cursors, snapshots, stale)
+    else:
+        stream = _sync_stream_slots.hold(
+            _stream_updates(topics, cursors, snapshots, stale)
+        )
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Don't let nginx buffer the events
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -4,9 +4,26 @@ from django.views.decorators.csrf import csrf_exempt
 
 from rcon import game_logs
 
-from .auth import api_csv_response, api_response, login_required
+from .auth import (
+    api_csv_streaming_response,
+    api_ndjson_streaming_response,
+    api_response,
+    login_required,
+)
 from .utils import _get_data
 
+CSV_HEADER = [
+    "event_time",
+    "type",
+    "player_name",
+    "player1_id",
+    "player2_name",
+    "player2_id",
+    "content",
+    "server",
+    "weapon",
+]
+
 
 @csrf_exempt
 @login_required()
@@ -30,7 +47,7 @@ def get_historical_logs(request):
     if from_:
         from_ = parser.parse(from_)
 
-    lines = game_logs.get_historical_logs(
+    filters = dict(
         player_name=player_name,
         action=action,
         steam_id_64=steam_id_64,
@@ -41,29 +58,85 @@ def get_historical_logs(request):
         exact_player_match=exact_player_match,
         exact_action=exact_action,
         server_filter=server_filter,
-        output=output,
     )
-    if output != "CSV" and output != "csv":
+
+    if output in ("CSV", "csv"):
+        return api_csv_streaming_response(
+            game_logs.iter_historical_logs(output=output, **filters),
+            "log.csv",
+            CSV_HEADER,
+        )
+    if output in ("NDJSON", "ndjson"):
+        return api_ndjson_streaming_response(
+            game_logs.iter_historical_logs(**filters), "log.ndjson"
+        )
+
+    arguments = dict(limit=limit, player_name=player_name, action=action)
+    if "cursor" in data:
+        # Keyset pagination, the result holds the cursor of the next page
+        cursor = data.get("cursor")
+        try:
+            page = game_logs.get_historical_logs_page(cursor=cursor, **filters)
+        except ValueError as e:
+            return api_response(
+                command="get_historical_logs",
+                arguments=dict(cursor=cursor, **arguments),
+                error=str(e),
+                status_code=400,
+            )
         return api_response(
-            lines,
+            page,
             command="get_historical_logs",
-            arguments=dict(limit=limit, player_name=player_name, action=action),
+            arguments=dict(cursor=cursor, **arguments),
             failed=False,
         )
-    return api_csv_response(
-        lines,
-        "log.csv",
-        [
-            "event_time",
-            "type",
-            "player_name",
-            "player1_id",
-            "player2_name",
-            "player2_id",
-            "content",
-            "server",
-            "weapon",
-        ],
+
+    return api_response(
+        game_logs.get_historical_logs(**filters),
+        command="get_historical_logs",
+        arguments=arguments,
+        failed=False,
+    )
+
+
+@csrf_exempt
+@login_required()
+@permission_required("api.can_view_historical_logs", raise_exception=True)
+def search_chat(request):
+    data = _get_data(request)
+    search = data.get("search")
+    limit = min(int(data.get("limit", 100)), 1000)
+    sort = data.get("sort", "time")
+    cursor = data.get("cursor")
+    from_ = data.get("from")
+    till = data.get("till")
+    arguments = dict(search=search, limit=limit, sort=sort, cursor=cursor)
+
+    if not search:
+        return api_response(
+            command="search_chat",
+            arguments=arguments,
+            error="search is required",
+            status_code=400,
+        )
+    try:
+        result = game_logs.get_chat_search_page(
+            search,
+            cursor=cursor,
+            limit=limit,
+            sort=sort,
+            server_filter=data.get("server_filter"),
+            from_=parser.parse(from_) if from_ else None,
+            till=parser.parse(till) if till else None,
+            player_name=data.get("player_name"),
+        )
+    except ValueError as e:
+        return api_response(
+            command="search_chat", arguments=arguments, error=str(e), status_code=400
+        )
+
+    return api_response(
+        result, command="search_chat", arguments=arguments, failed=False
     )
 
 
@@ -2,13 +2,20 @@ import json
 import logging
 from copy import deepcopy
 
-import requests
 from django.contrib.auth.decorators import permission_required
 from django.views.decorators.csrf import csrf_exempt
+from rq.exceptions import NoSuchJobError
 
-from rcon.utils import ApiKey
+from rcon.forwarding import (
+    enqueue_forward_to_servers,
+    fan_out,
+    forward_to_servers,
+    get_other_hosts,
+)
+from rcon.workers import get_job_results
 
 from .auth import api_response, login_required
+from .utils import _get_data
 
 logger = logging.getLogger("rcon")
 
@@ -17,76 +24,47 @@ logger = logging.getLogger("rcon")
 @permission_required("api.can_view_other_crcon_servers", raise_exception=True)
 @csrf_exempt
 def get_server_list(request):
-    api_key = ApiKey()
-    keys = api_key.get_all_keys()
-    my_key = api_key.get_key()
-
-    logger.debug(keys)
-    names = []
-    for host, key in keys.items():
-        if key == my_key:
-            continue
-        try:
-            res = requests.get(
-                f"http://{host}/api/get_connection_info",
-                timeout=5,
-                cookies=dict(sessionid=request.COOKIES.get("sessionid")),
-            )
-            if res.ok:
-                names.append(res.json()["result"])
-        except requests.exceptions.RequestException:
-            logger.warning(f"Unable to connect with {host}")
+    results = fan_out(
+        get_other_hosts(),
+        "/api/get_connection_info",
+        cookies=dict(sessionid=request.COOKIES.get("sessionid")),
+    )
+    # A server may answer with something else than the API, like an error page
+    names = [
+        r["response"]["result"]
+        for r in results
+        if r["ok"] and isinstance(r["response"], dict)
+    ]
 
     return api_response(names, failed=False, command="server_list")
 
 
-def forward_request(request):
-    api_key = ApiKey()
-    keys = api_key.get_all_keys()
-    my_key = api_key.get_key()
-
-    results = []
-    for host, key in keys.items():
-        if key == my_key:
-            continue
-        try:
-            url = f"http://{host}{request.path}"
-
-            params = dict(request.GET)
-            params.pop("forward", None)
-            try:
-                data = json.loads(request.body)
-                data.pop("forward", None)
-            except json.JSONDecodeError:
-                data = None
-            logger.info("Forwarding request: %s %s %s", url, params, data)
-            res = requests.get(
-                url,
-                params=params,
-                json=data,
-                timeout=5,
-                cookies=dict(sessionid=request.COOKIES.get("sessionid")),
-            )
-            if res.ok:
-                r = {"host": host, "response": res.json()}
-                results.append(r)
-                logger.info(r)
-            else:
-                # todo add failure to results
-                logger.warning(f"Forwarding to {host} failed %s", res.text)
-        except requests.exceptions.RequestException:
-            logger.warning(f"Unable to connect with {host}")
-
-    return results
+def forward_request(request, async_job=False):
+    """Send the request to the other servers, or only the id of the job
+    forwarding it with `async_job`"""
+    params = dict(request.GET)
+    params.pop("forward", None)
+    params.pop("forward_async", None)
+    try:
+        data = json.loads(request.body)
+        data.pop("forward", None)
+        data.pop("forward_async", None)
+    except json.JSONDecodeError:
+        data = None
+    logger.info("Forwarding request: %s %s %s", request.path, params, data)
+
+    forward = enqueue_forward_to_servers if async_job else forward_to_servers
+    return forward(
+        request.path,
+        params=params,
+        json=data,
+        sessionid=request.COOKIES.get("sessionid"),
+    )
 
 
 def forward_command(path, params=None, json=None, sessionid=None):
-    api_key = ApiKey()
-    keys = api_key.get_all_keys()
-    my_key = api_key.get_key()
     params = deepcopy(params) or {}
     data = deepcopy(json) or {}
-    results = []
 
     if "forwarded" in params or "forwarded" in data:
         logger.debug("The request was already forwarded")
@@ -98,28 +76,31 @@ def forward_command(path, params=None, json=None, sessionid=None):
         data.pop("forward", None)
         data["forwarded"] = "yes"
 
-    for host, key in keys.items():
-        if key == my_key:
-            continue
-        try:
-            url = f"http://{host}{path}"
-
-            logger.info("Forwarding request: %s %s %s", url, params, data)
-            res = requests.get(
-                url,
-                params=params,
-                json=data,
-                timeout=5,
-                cookies=dict(sessionid=sessionid),
-            )
-            if res.ok:
-                r = {"host": host, "response": res.json()}
-                results.append(r)
-                logger.info(r)
-            else:
-                # todo add failure to results
-                logger.warning(f"Forwarding to {host} failed %s", res.text)
-        except requests.exceptions.RequestException:
-            logger.warning(f"Unable to connect with {host}")
-
-    return results
+    return forward_to_servers(path, params=params, json=data, sessionid=sessionid)
+
+
+@csrf_exempt
+@login_required()
+def get_forward_results(request):
+    """The results of a request forwarded with `forward_async`"""
+    data = _get_data(request)
+    job_id = data.get("job_id", "")
+    if not job_id.startswith("forward_"):
+        return api_response(
+            error="Invalid job_id",
+            failed=True,
+            command="get_forward_results",
+            status_code=400,
+        )
+
+    try:
+        results = get_job_results(job_id)
+    except NoSuchJobError:
+        return api_response(
+            error="Job not found or expired",
+            failed=True,
+            command="get_forward_results",
+            status_code=404,
+        )
+
+    return api_response(result=results, failed=False, command="get_forward_results")
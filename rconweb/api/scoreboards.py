@@ -5,9 +5,10 @@ from datetime import datetime, timedelta
 from django.contrib.auth.decorators import permission_required
 from django.views.decorators.csrf import csrf_exempt
 
+from rcon.columnar_stats import ColumnarTimeWindowStats
 from rcon.config import get_config
 from rcon.models import Maps, enter_session
-from rcon.scoreboard import LiveStats, TimeWindowStats, get_cached_live_game_stats
+from rcon.scoreboard import LiveStats, get_cached_live_game_stats
 from rcon.utils import LONG_HUMAN_MAP_NAMES, map_name
 
 from .auth import api_response, login_required, stats_login_required
@@ -139,7 +140,7 @@ def date_scoreboard(request):
     except (ValueError, KeyError, TypeError) as e:
         end = datetime.now()
 
-    stats = TimeWindowStats()
+    stats = ColumnarTimeWindowStats()
 
     try:
         result = stats.get_players_stats_at_time(start, end)
@@ -4,7 +4,13 @@ from dateutil import parser
 from django.contrib.auth.decorators import permission_required
 from django.views.decorators.csrf import csrf_exempt
 
-from rcon.server_stats import get_db_server_stats_for_range
+from rcon.db_pool import get_db_pool_metrics as _get_db_pool_metrics
+from rcon.server_stats import (
+    get_db_server_stats_bucket_players,
+    get_db_server_stats_buckets,
+    get_db_server_stats_for_range,
+)
+from rcon.stats_loop import get_series_ranges
 
 from .auth import api_response, login_required
 from .views import _get_data
@@ -32,11 +38,105 @@ def get_server_stats(request):
     else:
         end = datetime.datetime.now()
 
+    # Aggregated by Postgres when a resolution is asked, the player lists of a
+    # bucket are then fetched with get_server_stats_players
+    resolution = data.get("resolution")
+    try:
+        if resolution:
+            result = get_db_server_stats_buckets(
+                start=start,
+                end=end,
+                resolution=resolution,
+                by_map=str(data.get("by_map", "true")).lower() == "true",
+            )
+        else:
+            result = get_db_server_stats_for_range(
+                start=start, end=end, by_map=True, with_player_list=with_players
+            )
+    except ValueError as e:
+        return api_response(error=str(e), command="get_server_stats", status_code=400)
+
     return api_response(
-        result=get_db_server_stats_for_range(
-            start=start, end=end, by_map=True, with_player_list=with_players
-        ),
+        result=result,
         error=None,
         failed=False,
         command="get_server_stats",
     )
+
+
+@csrf_exempt
+@login_required()
+@permission_required("api.can_view_server_stats", raise_exception=True)
+def get_server_stats_players(request):
+    data = _get_data(request)
+    bucket = data.get("bucket")
+    if not bucket:
+        return api_response(
+            error="bucket is required",
+            command="get_server_stats_players",
+            status_code=400,
+        )
+
+    try:
+        result = get_db_server_stats_bucket_players(
+            parser.parse(bucket), resolution=data.get("resolution", "hour")
+        )
+    except ValueError as e:
+        return api_response(
+            error=str(e), command="get_server_stats_players", status_code=400
+        )
+
+    return api_response(
+        result=result,
+        error=None,
+        failed=False,
+        command="get_server_stats_players",
+    )
+
+
+@csrf_exempt
+@login_required()
+@permission_required("api.can_view_server_stats", raise_exception=True)
+def get_db_pool_metrics(request):
+    return api_response(
+        result=_get_db_pool_metrics(),
+        error=None,
+        failed=False,
+        command="get_db_pool_metrics",
+    )
+
+
+@csrf_exempt
+@login_required()
+@permission_required("api.can_view_server_stats", raise_exception=True)
+def get_server_metrics(request):
+    data = _get_data(request)
+    end = parser.parse(data["end"]) if data.get("end") else datetime.datetime.now()
+    if data.get("start"):
+        start = parser.parse(data["start"])
+    else:
+        start = end - datetime.timedelta(hours=24)
+    names = data.get("names")
+    if isinstance(names, str):
+        names = names.split(",")
+
+    try:
+        max_points = int(data.get("max_points", 500))
+    except ValueError:
+        return api_response(
+            error="max_points must be an integer",
+            command="get_server_metrics",
+            status_code=400,
+        )
+
+    return api_response(
+        result=get_series_ranges(
+            int(start.timestamp() * 1000),
+            int(end.timestamp() * 1000),
+            names=names,
+            max_points=max_points,
+        ),
+        error=None,
+        failed=False,
+        command="get_server_metrics",
+    )
@@ -10,6 +10,7 @@ from . import (
     auth,
     auto_settings,
     history,
+    live_updates,
     logs,
     multi_servers,
     scoreboards,
@@ -73,8 +74,10 @@ endpoints: list[tuple[str, Callable]] = [
     ("get_services", services.get_services),
     ("do_service", services.do_service),
     ("server_list", multi_servers.get_server_list),
+    ("get_forward_results", multi_servers.get_forward_results),
     ("get_recent_logs", logs.get_recent_logs),
     ("get_historical_logs", logs.get_historical_logs),
+    ("search_chat", logs.search_chat),
     ("upload_vips", vips.upload_vips),
     ("async_upload_vips", vips.async_upload_vips),
     ("async_upload_vips_result", vips.async_upload_vips_result),
@@ -84,6 +87,7 @@ endpoints: list[tuple[str, Callable]] = [
     ("get_scoreboard_maps", scoreboards.get_scoreboard_maps),
     ("get_map_scoreboard", scoreboards.get_map_scoreboard),
     ("get_live_game_stats", scoreboards.get_live_game_stats),
+    ("live_updates", live_updates.live_updates),
     ("players_history", history.players_history),
     ("flag_player", history.flag_player),
     ("unflag_player", history.unflag_player),
@@ -108,6 +112,9 @@ endpoints: list[tuple[str, Callable]] = [
     ("get_auto_settings", auto_settings.get_auto_settings),
     ("set_auto_settings", auto_settings.set_auto_settings),
     ("get_server_stats", server_stats.get_server_stats),
+    ("get_server_stats_players", server_stats.get_server_stats_players),
+    ("get_server_metrics", server_stats.get_server_metrics),
+    ("get_db_pool_metrics", server_stats.get_db_pool_metrics),
     ("get_audit_logs", audit_log.get_audit_logs),
     ("get_audit_logs_autocomplete", audit_log.get_audit_logs_autocomplete),
 ] + [(name, func) for name, func in views.commands]
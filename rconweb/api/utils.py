@@ -1,6 +1,11 @@
 import json
+import os
 from functools import wraps
 
+# Set when the API is served by an ASGI server, the RCON endpoints are then async
+# and the streamed responses are async iterators
+ASYNC_VIEWS = bool(os.getenv("RCONWEB_ASGI"))
+
 
 def _get_data(request):
     try:
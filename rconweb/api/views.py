@@ -1,4 +1,5 @@
 import inspect
+import json
 import logging
 import os
 import traceback
@@ -6,12 +7,18 @@ from functools import wraps
 from subprocess import PIPE, run
 from typing import Callable, List
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import permission_required
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from rcon.broadcast import get_votes_status
 from rcon.cache_utils import RedisCached, get_redis_pool
+from rcon.command_executor import (
+    CommandBusyError,
+    CommandTimeoutError,
+    get_command_executor,
+)
 from rcon.commands import CommandFailedError
 from rcon.config import get_config
 from rcon.discord import send_to_discord_audit
@@ -31,13 +38,23 @@ from rcon.utils import LONG_HUMAN_MAP_NAMES, MapsHistory, map_name
 from rcon.watchlist import PlayerWatch
 from rcon.workers import temporary_broadcast, temporary_welcome
 
-from .audit_log import auto_record_audit, record_audit
+from .audit_log import (
+    auto_record_audit,
+    is_audited,
+    record_audit,
+    save_audit,
+    save_audits,
+)
 from .auth import api_response, login_required
 from .multi_servers import forward_command, forward_request
-from .utils import _get_data
+from .utils import ASYNC_VIEWS, _get_data
 
 logger = logging.getLogger("rconweb")
 ctl = Rcon(SERVER_INFO)
+MAX_BATCH_COMMANDS = 100
+MAX_DISCORD_AUDIT_LENGTH = 1900
+# The commands of a batch left past it fail with a timeout
+MAX_BATCH_SECS = 30
 
 
 def set_temp_msg(request, func, name):
@@ -608,71 +625,366 @@ def audit(func_name, request, arguments):
         logger.exception("Can't send audit log")
 
 
+def _audit_when_applied(request, func, command_name, arguments, future):
+    """Audit the timed out command if the game server applies it afterwards"""
+    username = request.user.username
+
+    def audit_late(future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        audit(func.__name__, request, arguments)
+        try:
+            save_audit(
+                username,
+                command_name,
+                arguments,
+                json.dumps(
+                    dict(result=future.result(), applied_after_timeout=True),
+                    default=str,
+                ),
+            )
+        except:
+            logger.exception("Unable to audit %s applied late", command_name)
+
+    future.add_done_callback(audit_late)
+
+
+def _timeout_error(request, func, command_name, arguments, e: CommandTimeoutError):
+    if e.future is None or not is_audited(command_name):
+        return e.args[0]
+    _audit_when_applied(request, func, command_name, arguments, e.future)
+    return f"{e.args[0]}, the game server may still apply it"
+
+
+def _get_command_arguments(func, request):
+    """The arguments of the command from the request data"""
+    data = _get_data(request)
+    return _command_arguments(func, data, request.user.username), data
+
+
+def _command_arguments(func, data, username):
+    parameters = inspect.signature(func).parameters
+    arguments = {}
+
+    for pname, param in parameters.items():
+        if pname == "by":
+            arguments[pname] = username
+        elif param.default != inspect._empty:
+            arguments[pname] = data.get(pname, param.default)
+        else:
+            try:
+                arguments[pname] = data[pname]
+            except KeyError:
+                # TODO raise 400
+                raise
+
+    return arguments
+
+
+def _command_response(
+    func, data, res, failure, error, status_code=200, forward_results=None
+):
+    return JsonResponse(
+        dict(
+            result=res,
+            command=func.__name__,
+            arguments=data,
+            failed=failure,
+            error=error,
+            forward_results=forward_results,
+        ),
+        status=status_code,
+    )
+
+
+def _forward_command(request, command_name, data):
+    """The results of each server, or the id of the job forwarding the request
+    with `forward_async`, get them with get_forward_results"""
+    if command_name == "do_temp_ban" and not get_config().get("MULTI_SERVERS", {}).get(
+        "broadcast_temp_bans", True
+    ):
+        logger.debug("Not broadcasting temp ban due to settings")
+        return None
+    try:
+        if data.get("forward_async"):
+            return {"job_id": forward_request(request, async_job=True)}
+        return forward_request(request)
+    except:
+        logger.exception("Unexpected error while forwarding request")
+        return None
+
+
 # This is were all the RCON commands are turned into HTTP endpoints
 def expose_api_endpoint(func, command_name, permissions: list[str] | set[str] | str):
+    if ASYNC_VIEWS:
+        return expose_async_api_endpoint(func, command_name, permissions)
+
     @csrf_exempt
     @login_required()
     @auto_record_audit(command_name)
     @permission_required(permissions, raise_exception=True)
     @wraps(func)
     def wrapper(request):
-        logger = logging.getLogger("rconweb")
-        parameters = inspect.signature(func).parameters
-        command_name = func.__name__
-        arguments = {}
-        data = {}
+        arguments, data = _get_command_arguments(func, request)
         failure = False
-        others = None
         error = ""
-        data = _get_data(request)
-
-        for pname, param in parameters.items():
-            if pname == "by":
-                arguments[pname] = request.user.username
-            elif param.default != inspect._empty:
-                arguments[pname] = data.get(pname, param.default)
-            else:
-                try:
-                    arguments[pname] = data[pname]
-                except KeyError:
-                    # TODO raise 400
-                    raise
+        status_code = 200
 
         try:
             logger.debug("%s %s", func.__name__, arguments)
-            res = func(**arguments)
+            res = get_command_executor().run(command_name, func, arguments)
             audit(func.__name__, request, arguments)
+        except CommandTimeoutError as e:
+            failure = True
+            error = _timeout_error(request, func, command_name, arguments, e)
+            res = None
+            status_code = 504
+        except CommandBusyError as e:
+            failure = True
+            error = e.args[0]
+            res = None
+            status_code = 503
         except CommandFailedError as e:
             failure = True
             error = e.args[0] if e.args else None
             res = None
 
-        response = JsonResponse(
-            dict(
-                result=res,
-                command=func.__name__,
-                arguments=data,
-                failed=failure,
-                error=error,
-                forward_results=others,
+        others = None
+        if data.get("forward"):
+            others = _forward_command(request, command_name, data)
+        return _command_response(func, data, res, failure, error, status_code, others)
+
+    return wrapper
+
+
+def expose_async_api_endpoint(
+    func, command_name, permissions: list[str] | set[str] | str
+):
+    """The endpoint of the command as an async view, for the ASGI deployment
+
+    Only the login, permissions and audit run on a thread, the command is awaited
+    so a slow game server doesn't hold a thread per request.
+    """
+
+    @login_required()
+    @permission_required(permissions, raise_exception=True)
+    def prepare(request):
+        return _get_command_arguments(func, request)
+
+    def finish(request, arguments, data, response, failure):
+        if not failure:
+            audit(func.__name__, request, arguments)
+        if is_audited(command_name):
+            save_audit(
+                request.user.username, command_name, data, response.content.decode()
             )
-        )
+
+    @wraps(func)
+    async def wrapper(request):
+        prepared = await sync_to_async(prepare)(request)
+        if isinstance(prepared, HttpResponse):
+            # Not logged in, not allowed or invalid arguments
+            if prepared.status_code == 403 and is_audited(command_name):
+                await sync_to_async(save_audit)(
+                    request.user.username,
+                    command_name,
+                    _get_data(request),
+                    prepared.content.decode(),
+                )
+            return prepared
+
+        arguments, data = prepared
+        failure = False
+        error = ""
+        status_code = 200
+        try:
+            logger.debug("%s %s", func.__name__, arguments)
+            res = await get_command_executor().arun(command_name, func, arguments)
+        except CommandTimeoutError as e:
+            failure = True
+            error = _timeout_error(request, func, command_name, arguments, e)
+            res = None
+            status_code = 504
+        except CommandBusyError as e:
+            failure = True
+            error = e.args[0]
+            res = None
+            status_code = 503
+        except CommandFailedError as e:
+            failure = True
+            error = e.args[0] if e.args else None
+            res = None
+
+        others = None
         if data.get("forward"):
-            if command_name == "do_temp_ban" and not get_config().get(
-                "MULTI_SERVERS", {}
-            ).get("broadcast_temp_bans", True):
-                logger.debug("Not broadcasting temp ban due to settings")
-                return response
-            try:
-                others = forward_request(request)
-            except:
-                logger.exception("Unexpected error while forwarding request")
-        # logger.debug("%s %s -> %s", func.__name__, arguments, res)
+            others = await sync_to_async(_forward_command)(request, command_name, data)
+        response = _command_response(
+            func, data, res, failure, error, status_code, others
+        )
+        await sync_to_async(finish)(request, arguments, data, response, failure)
         return response
 
+    # csrf_exempt of Django 4.2 turns async views into sync ones
+    wrapper.csrf_exempt = True
     return wrapper
 
 
+def _has_permissions(user, permissions: list[str] | set[str] | str):
+    # The same check as permission_required
+    if isinstance(permissions, str):
+        permissions = (permissions,)
+    return user.has_perms(permissions)
+
+
+def _split_audit_messages(name: str, entries: list[str], max_length: int):
+    """The `name` audit of the entries, in as many messages as needed to fit
+    each of them within `max_length`"""
+    # Room for the "`name` (i/n): " header
+    room = max_length - len(name) - 20
+    chunks: list[list[str]] = [[]]
+    length = 0
+    for entry in entries:
+        if len(entry) > room:
+            entry = entry[: room - 3] + "..."
+        if chunks[-1] and length + len(" | ") + len(entry) > room:
+            chunks.append([])
+            length = 0
+        length += len(entry) + (len(" | ") if chunks[-1] else 0)
+        chunks[-1].append(entry)
+
+    if len(chunks) == 1:
+        return [f"`{name}` x{len(entries)}: {' | '.join(chunks[0])}"]
+    return [
+        f"`{name}` ({i}/{len(chunks)}): {' | '.join(chunk)}"
+        for i, chunk in enumerate(chunks, start=1)
+    ]
+
+
+def _audit_batch(request, succeeded: list[tuple[str, dict]]):
+    """One Discord audit per command of the batch rather than one per item"""
+    by_command: dict[str, list[str]] = {}
+    for name, arguments in succeeded:
+        if name.startswith("get_"):
+            continue
+        by_command.setdefault(name, []).append(
+            " ".join(f"{k}: `{v}`" for k, v in arguments.items() if k != "by")
+        )
+
+    for name, entries in by_command.items():
+        for message in _split_audit_messages(name, entries, MAX_DISCORD_AUDIT_LENGTH):
+            try:
+                send_to_discord_audit(message, request.user.username)
+            except:
+                logger.exception("Can't send audit log")
+
+
+@csrf_exempt
+@login_required()
+def run_commands(request):
+    """Run a batch of RCON commands, like messaging or punishing a whole squad
+
+    Takes `commands`, a list of `{"command": ..., "arguments": {...}}`, the user
+    needs the permissions of all of them. The commands run concurrently and
+    each one gets its result, in the order of the list. The commands still
+    running after `MAX_BATCH_SECS` fail with a timeout.
+    """
+    data = _get_data(request)
+    items = data.get("commands")
+    if not isinstance(items, list) or not items:
+        return api_response(
+            error="commands must be a non empty list",
+            failed=True,
+            command="run_commands",
+            status_code=400,
+        )
+    if len(items) > MAX_BATCH_COMMANDS:
+        return api_response(
+            error=f"At most {MAX_BATCH_COMMANDS} commands per batch",
+            failed=True,
+            command="run_commands",
+            status_code=400,
+        )
+
+    names = [item.get("command") if isinstance(item, dict) else None for item in items]
+    if unknown := sorted(
+        {str(n) for n in names if not isinstance(n, str) or n not in BATCH_COMMANDS}
+    ):
+        return api_response(
+            error=f"Unknown commands: {', '.join(unknown)}",
+            failed=True,
+            command="run_commands",
+            status_code=400,
+        )
+
+    username = request.user.username
+    if forbidden := sorted(
+        name
+        for name in set(names)
+        if not _has_permissions(request.user, BATCH_COMMANDS[name][1])
+    ):
+        error = f"Missing permissions for: {', '.join(forbidden)}"
+        save_audits(
+            username,
+            [
+                (name, item.get("arguments") or {}, error)
+                for name, item in zip(names, items)
+                if is_audited(name)
+            ],
+        )
+        return api_response(
+            error=error, failed=True, command="run_commands", status_code=403
+        )
+
+    results = [
+        {"command": name, "arguments": item.get("arguments") or {}}
+        for name, item in zip(names, items)
+    ]
+    calls = []
+    for result in results:
+        func = BATCH_COMMANDS[result["command"]][0]
+        if not isinstance(result["arguments"], dict):
+            result.update(result=None, failed=True, error="arguments must be a dict")
+            continue
+        try:
+            arguments = _command_arguments(func, result["arguments"], username)
+        except KeyError as e:
+            result.update(result=None, failed=True, error=f"Missing argument {e}")
+            continue
+        calls.append((result, (result["command"], func, arguments)))
+
+    executor = get_command_executor()
+    outcomes = executor.run_many(
+        [call for _, call in calls],
+        max_concurrent=executor.max_per_command,
+        max_duration_secs=MAX_BATCH_SECS,
+    )
+    succeeded = []
+    for (result, (name, func, arguments)), (res, exception) in zip(calls, outcomes):
+        if exception is None:
+            result.update(result=res, failed=False, error=None)
+            succeeded.append((name, arguments))
+        elif isinstance(exception, CommandTimeoutError):
+            error = _timeout_error(request, func, name, arguments, exception)
+            result.update(result=None, failed=True, error=error)
+        elif isinstance(exception, CommandFailedError):
+            error = exception.args[0] if exception.args else None
+            result.update(result=None, failed=True, error=error)
+        else:
+            logger.error("%s failed in batch", name, exc_info=exception)
+            result.update(result=None, failed=True, error=repr(exception))
+
+    _audit_batch(request, succeeded)
+    save_audits(
+        username,
+        [
+            (result["command"], result["arguments"], json.dumps(result, default=str))
+            for result in results
+            if is_audited(result["command"])
+        ],
+    )
+    return api_response(result=results, failed=False, command="run_commands")
+
+
 @login_required()
 @permission_required("api.can_view_connection_info", raise_exception=True)
 @csrf_exempt
@@ -833,6 +1145,8 @@ ENDPOINT_PERMISSIONS: dict[Callable, list[str] | set[str] | str] = {
 }
 
 PREFIXES_TO_EXPOSE = ["get_", "set_", "do_"]
+# The commands that can be sent to run_commands, with their permissions
+BATCH_COMMANDS: dict[str, tuple[Callable, list[str] | set[str] | str]] = {}
 
 commands = [
     ("blacklist_player", blacklist_player),
@@ -856,6 +1170,7 @@ commands = [
     ("get_votekick_autotoggle_config", get_votekick_autotoggle_config),
     ("set_name", set_name),
     ("run_raw_command", run_raw_command),
+    ("run_commands", run_commands),
 ]
 
 logger.info("Initializing endpoint")
@@ -869,6 +1184,7 @@ try:
         commands.append(
             (name, expose_api_endpoint(func, name, ENDPOINT_PERMISSIONS[func])),
         )
+        BATCH_COMMANDS[name] = (func, ENDPOINT_PERMISSIONS[func])
     logger.info("Done Initializing endpoint")
 except:
     logger.exception("Failed to initialized endpoints - Most likely bad configuration")
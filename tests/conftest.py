@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+RCONWEB_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "rconweb")
+
+
+@pytest.fixture(scope="session")
+def django_settings():
+    """Minimal Django settings to call the API views, the tests don't touch
+    its database"""
+    django = pytest.importorskip("django")
+    from django.conf import settings
+
+    if not settings.configured:
+        if RCONWEB_DIR not in sys.path:
+            sys.path.append(RCONWEB_DIR)
+        settings.configure(
+            ALLOWED_HOSTS=["*"],
+            INSTALLED_APPS=[
+                "django.contrib.contenttypes",
+                "django.contrib.auth",
+                "api",
+            ],
+            DATABASES={
+                "default": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": ":memory:",
+                }
+            },
+            MIDDLEWARE=[],
+            SECRET_KEY="x",
+        )
+        django.setup()
+    return settings
@@ -0,0 +1,57 @@
+"""Random structured log lines shared by the stats engines tests"""
+
+import datetime
+import random
+
+START = datetime.datetime(2023, 5, 1, 20, 0, 0)
+END = START + datetime.timedelta(minutes=90)
+WEAPONS = ["M1 GARAND", "MP40", "KARABINER 98K", None]
+
+
+def log_line(time, action, player=None, player2=None, weapon=None, raw=""):
+    players = {f"player{idx}": str(76561198000000000 + idx) for idx in range(30)}
+    return {
+        "timestamp_ms": int(time.timestamp() * 1000),
+        "event_time": time,
+        "action": action,
+        "player": player,
+        "steam_id_64_1": players.get(player),
+        "player2": player2,
+        "steam_id_64_2": players.get(player2),
+        "weapon": weapon,
+        "raw": raw or f"{action} {player} {player2}",
+    }
+
+
+def generate_logs(seed, nb_lines=3000):
+    rnd = random.Random(seed)
+    names = [f"player{idx}" for idx in range(30)]
+    # A player without steam ID only appears as victim of the others
+    names.append("bot")
+    connected = set(rnd.sample(names[:30], 20))
+    logs = []
+    time = START
+    for _ in range(nb_lines):
+        time += datetime.timedelta(milliseconds=rnd.randint(0, 4000))
+        roll = rnd.random()
+        player = rnd.choice(names[:30])
+        other = rnd.choice(names)
+        if roll < 0.05:
+            action = "DISCONNECTED" if player in connected else "CONNECTED"
+            connected ^= {player}
+            logs.append(log_line(time, action, player))
+        elif roll < 0.75:
+            logs.append(log_line(time, "KILL", player, other, rnd.choice(WEAPONS)))
+        elif roll < 0.8:
+            # Suicides
+            logs.append(log_line(time, "KILL", player, player, rnd.choice(WEAPONS)))
+        elif roll < 0.88:
+            logs.append(log_line(time, "TEAM KILL", player, other, rnd.choice(WEAPONS)))
+        elif roll < 0.9:
+            logs.append(log_line(time, "VOTE STARTED", player, other))
+        elif roll < 0.95:
+            vote = rnd.choice(["PV_Favour", "PV_Against"])
+            logs.append(log_line(time, "VOTE", player, raw=f"VOTE {player} {vote}"))
+        else:
+            logs.append(log_line(time, "CHAT[Allies]", player))
+    return logs
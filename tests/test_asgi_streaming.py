@@ -0,0 +1,127 @@
+import asyncio
+import pickle
+import time
+from unittest import mock
+
+import pytest
+
+from rcon.live_updates import TOPICS, aiter_updates
+from rcon.utils import iterate_in_threads
+
+django = pytest.importorskip("django")
+
+from django.http import StreamingHttpResponse  # noqa: E402
+from django.urls import path  # noqa: E402
+
+CHUNK_DELAY_SECS = 0.3
+_closed = []
+
+
+def _slow_rows():
+    try:
+        for row in ("a\n", "b\n", "c\n"):
+            yield row
+            time.sleep(CHUNK_DELAY_SECS)
+    finally:
+        _closed.append(True)
+
+
+def _stream_view(request):
+    return StreamingHttpResponse(iterate_in_threads(_slow_rows(), chunk_size=1))
+
+
+urlpatterns = [path("stream", _stream_view)]
+
+
+@pytest.fixture(scope="module")
+def asgi_application(django_settings):
+    from django.core.handlers.asgi import ASGIHandler
+    from django.test import override_settings
+
+    with override_settings(ROOT_URLCONF=__name__):
+        yield ASGIHandler()
+
+
+def _scope():
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/stream",
+        "raw_path": b"/stream",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+
+
+def test_rows_are_sent_as_they_are_read(asgi_application):
+    received = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            received.append((time.perf_counter(), message["body"]))
+
+    started = time.perf_counter()
+    asyncio.run(asgi_application(_scope(), receive, send))
+
+    assert [body for _, body in received] == [b"a\n", b"b\n", b"c\n"]
+    # A sync iterator would have been read to the end before the first chunk
+    assert received[0][0] - started < CHUNK_DELAY_SECS
+    assert received[-1][0] - started >= 2 * CHUNK_DELAY_SECS
+    assert _closed
+
+
+def test_iterate_in_threads_closes_the_iterator():
+    closed = []
+
+    def rows():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+
+    async def first():
+        stream = iterate_in_threads(rows(), chunk_size=3)
+        value = await stream.__anext__()
+        await stream.aclose()
+        return value
+
+    assert asyncio.run(first()) == 0
+    assert closed == [True]
+
+
+def test_aiter_updates_polls_without_blocking():
+    red = mock.MagicMock()
+    red.xread.side_effect = [
+        [],
+        [[TOPICS["logs"].encode(), [(b"5-0", {b"data": pickle.dumps(1)})]]],
+        [],
+        [],
+    ]
+    now = iter([0, 0, 0, 1, 1, 1, 1, 20, 20, 20, 20, 99])
+
+    async def collect():
+        return [
+            update
+            async for update in aiter_updates(
+                {"logs": "4-0"},
+                max_duration_secs=30,
+                poll_secs=0,
+                keepalive_secs=15,
+                red=red,
+                clock=lambda: next(now),
+            )
+        ]
+
+    updates = asyncio.run(collect())
+
+    assert updates == [("logs", 1, {"logs": "5-0"}), None]
+    # Never a blocking XREAD
+    assert all(call.kwargs["block"] is None for call in red.xread.call_args_list)
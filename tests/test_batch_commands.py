@@ -0,0 +1,205 @@
+import json
+import threading
+from unittest import mock
+
+import pytest
+
+from rcon.command_executor import CommandExecutor, CommandTimeoutError
+
+pytest.importorskip("django")
+
+
+@pytest.fixture
+def views(django_settings):
+    from api import views
+
+    return views
+
+
+def do_kick(player, reason, by):
+    return "SUCCESS"
+
+
+def do_message_player(player, message, by):
+    return "SUCCESS"
+
+
+def get_map():
+    return "foy_warfare"
+
+
+class _User:
+    is_authenticated = True
+    username = "admin"
+
+    def __init__(self, permissions):
+        self.permissions = set(permissions)
+
+    def has_perms(self, permissions):
+        return set(permissions) <= self.permissions
+
+
+@pytest.fixture
+def run_batch(views):
+    from django.test import RequestFactory
+
+    commands = {
+        "do_kick": (do_kick, "api.can_kick_players"),
+        "do_message_player": (do_message_player, "api.can_message_players"),
+        "get_map": (get_map, "api.can_view_current_map"),
+    }
+    executor = CommandExecutor(max_workers=4, max_per_command=2, timeout_secs=5)
+
+    def run(items, permissions=("api.can_kick_players", "api.can_view_current_map")):
+        request = RequestFactory().post(
+            "/api/run_commands",
+            data=json.dumps({"commands": items}),
+            content_type="application/json",
+        )
+        request.user = _User(permissions)
+        with (
+            mock.patch.object(views, "BATCH_COMMANDS", commands),
+            mock.patch.object(views, "get_command_executor", return_value=executor),
+            mock.patch.object(views, "save_audits") as save_audits,
+            mock.patch.object(views, "send_to_discord_audit") as send_to_discord_audit,
+        ):
+            response = views.run_commands(request)
+        return response, save_audits, send_to_discord_audit
+
+    yield run
+    executor.pool.shutdown()
+
+
+def test_missing_permission_refuses_the_whole_batch(run_batch):
+    items = [
+        {"command": "do_kick", "arguments": {"player": "a", "reason": "r"}},
+        {"command": "do_message_player", "arguments": {"player": "a"}},
+        {"command": "get_map"},
+    ]
+    response, save_audits, send_to_discord_audit = run_batch(items)
+
+    assert response.status_code == 403
+    error = "Missing permissions for: do_message_player"
+    assert json.loads(response.content)["error"] == error
+    # The refused commands are audited, not the read ones
+    save_audits.assert_called_once_with(
+        "admin",
+        [
+            ("do_kick", {"player": "a", "reason": "r"}, error),
+            ("do_message_player", {"player": "a"}, error),
+        ],
+    )
+    send_to_discord_audit.assert_not_called()
+
+
+def test_argument_errors_are_per_item(run_batch):
+    items = [
+        {"command": "do_kick", "arguments": {"player": "a", "reason": "r"}},
+        {"command": "do_kick", "arguments": {"player": "b"}},
+        {"command": "do_kick", "arguments": ["c"]},
+        {"command": "get_map"},
+    ]
+    response, save_audits, _ = run_batch(items)
+
+    assert response.status_code == 200
+    results = json.loads(response.content)["result"]
+    assert [(r["failed"], r["error"]) for r in results] == [
+        (False, None),
+        (True, "Missing argument 'reason'"),
+        (True, "arguments must be a dict"),
+        (False, None),
+    ]
+    assert results[3]["result"] == "foy_warfare"
+    # A single insert for all the audited items, failed ones included
+    save_audits.assert_called_once()
+    username, audits = save_audits.call_args.args
+    assert username == "admin"
+    assert [(name, arguments) for name, arguments, _ in audits] == [
+        ("do_kick", {"player": "a", "reason": "r"}),
+        ("do_kick", {"player": "b"}),
+        ("do_kick", ["c"]),
+    ]
+    assert json.loads(audits[0][2])["result"] == "SUCCESS"
+
+
+def test_batch_timeouts_are_per_item(run_batch, views):
+    items = [{"command": "get_map"}, {"command": "get_map"}]
+    with mock.patch.object(
+        CommandExecutor,
+        "run_many",
+        return_value=[("foy_warfare", None), (None, CommandTimeoutError("Too slow"))],
+    ) as run_many:
+        response, _, _ = run_batch(items)
+
+    assert run_many.call_args.kwargs["max_duration_secs"] == views.MAX_BATCH_SECS
+    results = json.loads(response.content)["result"]
+    assert [(r["failed"], r["error"]) for r in results] == [
+        (False, None),
+        (True, "Too slow"),
+    ]
+
+
+def test_discord_audit_is_split_rather_than_truncated(run_batch, views):
+    items = [
+        {"command": "do_kick", "arguments": {"player": f"player{i}", "reason": "r"}}
+        for i in range(100)
+    ]
+    with mock.patch.object(views, "MAX_DISCORD_AUDIT_LENGTH", 300):
+        response, _, send_to_discord_audit = run_batch(items)
+
+    assert response.status_code == 200
+    messages = [c.args[0] for c in send_to_discord_audit.call_args_list]
+    assert len(messages) > 1
+    assert all(len(m) <= 300 for m in messages)
+    assert messages[0].startswith(f"`do_kick` (1/{len(messages)}): ")
+    for i in range(100):
+        assert sum(f"player: `player{i}` " in m for m in messages) == 1
+
+
+def test_command_applied_after_its_timeout_is_audited(views):
+    from api import audit_log
+    from django.test import RequestFactory
+
+    release = threading.Event()
+    applied = threading.Event()
+
+    def do_perma_ban(player, reason, by):
+        release.wait(5)
+        return "SUCCESS"
+
+    executor = CommandExecutor(max_workers=2, max_per_command=2, timeout_secs=0.05)
+    endpoint = views.expose_api_endpoint(
+        do_perma_ban, "do_perma_ban", "api.can_perma_ban_players"
+    )
+    request = RequestFactory().post(
+        "/api/do_perma_ban",
+        data=json.dumps({"player": "a", "reason": "r"}),
+        content_type="application/json",
+    )
+    request.user = _User(["api.can_perma_ban_players"])
+    with mock.patch.object(
+        views, "get_command_executor", return_value=executor
+    ), mock.patch.object(
+        views, "save_audit", side_effect=lambda *args: applied.set()
+    ) as save_audit, mock.patch.object(
+        audit_log, "save_audit"
+    ), mock.patch.object(
+        views, "send_to_discord_audit"
+    ) as send_to_discord_audit:
+        response = endpoint(request)
+        assert response.status_code == 504
+        assert json.loads(response.content)["error"] == (
+            "do_perma_ban took more than 0.05s, the game server may still apply it"
+        )
+        send_to_discord_audit.assert_not_called()
+
+        release.set()
+        assert applied.wait(5)
+    executor.pool.shutdown()
+
+    send_to_discord_audit.assert_called_once_with(
+        "`do_perma_ban`: player: `a` reason: `r`", "admin"
+    )
+    username, command, arguments, result = save_audit.call_args.args
+    assert (username, command) == ("admin", "do_perma_ban")
+    assert json.loads(result) == {"result": "SUCCESS", "applied_after_timeout": True}
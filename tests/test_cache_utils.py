@@ -0,0 +1,64 @@
+from rcon.cache_utils import MemoryBatchCached
+
+
+def test_batch_cache_only_fetches_missing_items():
+    calls = []
+
+    def fetch(ids):
+        calls.append(list(ids))
+        return {i: f"profile_{i}" for i in ids if i != "unknown"}
+
+    cached = MemoryBatchCached(60, fetch, batch_size=2)
+
+    assert cached(["1", "2", "3"]) == {
+        "1": "profile_1",
+        "2": "profile_2",
+        "3": "profile_3",
+    }
+    assert calls == [["1", "2"], ["3"]]
+
+    assert cached(["2", "3", "4", "unknown"]) == {
+        "2": "profile_2",
+        "3": "profile_3",
+        "4": "profile_4",
+        "unknown": None,
+    }
+    assert calls[-1] == ["4", "unknown"]
+
+    cached(["4", "unknown"])
+    assert len(calls) == 3
+
+
+def test_batch_cache_does_not_cache_failed_lookups():
+    calls = []
+
+    def fetch(ids):
+        calls.append(list(ids))
+        return None
+
+    cached = MemoryBatchCached(60, fetch)
+
+    assert cached(["1"]) == {}
+    assert cached(["1"]) == {}
+    assert len(calls) == 2
+
+
+def test_batch_cache_falsy_values_expire_first():
+    calls = []
+    now = [0]
+
+    def fetch(ids):
+        calls.append(list(ids))
+        return {i: f"profile_{i}" for i in ids if i != "unknown"}
+
+    cached = MemoryBatchCached(
+        60, fetch, cache_falsy=False, falsy_ttl_seconds=5, timer=lambda: now[0]
+    )
+
+    cached(["1", "unknown"])
+    cached(["1", "unknown"])
+    assert len(calls) == 1
+
+    now[0] = 10
+    assert cached(["1", "unknown"]) == {"1": "profile_1", "unknown": None}
+    assert calls[-1] == ["unknown"]
@@ -0,0 +1,96 @@
+import datetime
+import time
+from unittest import mock
+
+import pytest
+
+from log_generator import END, START, generate_logs, log_line
+from rcon.columnar_stats import (
+    ColumnarTimeWindowStats,
+    diff_players_stats,
+    logs_frame_from_dicts,
+)
+from rcon.scoreboard import TimeWindowStats
+
+
+@pytest.fixture
+def engines():
+    with mock.patch("rcon.scoreboard.Rcon"), mock.patch(
+        "rcon.scoreboard.get_redis_client"
+    ), mock.patch("rcon.scoreboard.enter_session"), mock.patch(
+        "rcon.scoreboard.get_player_profile_by_steam_ids", return_value=[]
+    ), mock.patch(
+        "rcon.columnar_stats.enter_session"
+    ), mock.patch(
+        "rcon.columnar_stats.get_player_profile_by_steam_ids", return_value=[]
+    ):
+        yield TimeWindowStats(), ColumnarTimeWindowStats()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_same_stats_as_line_by_line_engine(engines, seed):
+    reference, columnar = engines
+    logs = generate_logs(seed)
+
+    expected = reference._get_players_stats_for_logs(logs, START, END)
+    actual = columnar._get_players_stats_for_logs(logs, START, END)
+
+    assert len(expected) == 30
+    assert diff_players_stats(expected, actual) == []
+    for name, stats in expected.items():
+        assert list(actual[name]) == list(stats)
+
+
+def test_no_logs(engines):
+    _, columnar = engines
+
+    assert columnar._get_players_stats_for_logs([], START, END) == {}
+
+
+def test_event_time_fallback_is_local_time(monkeypatch):
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        log = log_line(START + datetime.timedelta(milliseconds=1500), "CONNECTED", "a")
+        recorded = dict(log, event_time=START + datetime.timedelta(seconds=1))
+        del log["event_time"]
+
+        df = logs_frame_from_dicts([log, recorded])
+    finally:
+        monkeypatch.delenv("TZ")
+        time.tzset()
+
+    # The same clock as the lines read from the DB and as log_time
+    assert df["event_time"][0] == df["event_time"][1]
+    assert df["event_time"][0] == df["log_time"][0].floor("s")
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_same_stats_without_event_time_outside_utc(engines, monkeypatch, seed):
+    reference, columnar = engines
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        # As read from redis, the engines fall back on timestamp_ms
+        logs = [
+            {k: v for k, v in log.items() if k != "event_time"}
+            for log in generate_logs(seed)
+        ]
+        from_ = datetime.datetime.fromtimestamp(START.timestamp())
+        until = datetime.datetime.fromtimestamp(END.timestamp())
+
+        expected = reference._get_players_stats_for_logs(logs, from_, until)
+        actual = columnar._get_players_stats_for_logs(logs, from_, until)
+        # LogLine.event_time has no milliseconds
+        recorded = [
+            dict(log, event_time=log["event_time"].replace(microsecond=0))
+            for log in generate_logs(seed)
+        ]
+        recorded = reference._get_players_stats_for_logs(recorded, from_, until)
+    finally:
+        monkeypatch.delenv("TZ")
+        time.tzset()
+
+    assert diff_players_stats(expected, actual) == []
+    # Same sessions as with the event_time of the DB lines
+    assert diff_players_stats(recorded, expected) == []
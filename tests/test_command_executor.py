@@ -0,0 +1,214 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rcon.command_executor import (
+    CommandBusyError,
+    CommandExecutor,
+    CommandTimeoutError,
+)
+from rcon.commands import CommandFailedError
+from rcon.game_server_standin import run_api_load_test, run_load_test
+
+
+@pytest.fixture
+def executor():
+    executor = CommandExecutor(
+        max_workers=4, max_per_command=2, timeout_secs=1, max_waiting_per_command=2
+    )
+    yield executor
+    executor.pool.shutdown(wait=False)
+
+
+def test_slow_command_does_not_starve_the_others(executor):
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append("slow")
+        release.wait(5)
+        return "slow"
+
+    futures = [executor.submit("slow", slow, {}) for _ in range(4)]
+    assert executor.running("slow") == 2
+    assert executor.waiting("slow") == 2
+    with pytest.raises(CommandBusyError):
+        executor.submit("slow", slow, {})
+
+    assert executor.run("fast", lambda value: value, {"value": 1}) == 1
+
+    release.set()
+    assert [f.result(timeout=5) for f in futures] == ["slow"] * 4
+    assert calls == ["slow"] * 4
+    assert executor.running("slow") == 0
+
+
+def test_timed_out_calls_waiting_for_a_slot_are_dropped(executor):
+    release = threading.Event()
+    calls = []
+
+    def slow(idx):
+        calls.append(idx)
+        release.wait(5)
+
+    executor.timeouts = {"slow": 0.05}
+    running = [executor.submit("slow", slow, {"idx": idx}) for idx in range(2)]
+    with pytest.raises(CommandTimeoutError) as waiting:
+        executor.run("slow", slow, {"idx": 2})
+    # Never sent to the game server
+    assert waiting.value.future is None
+
+    release.set()
+    for future in running:
+        future.result(timeout=5)
+    assert calls == [0, 1]
+    assert executor.running("slow") == 0
+    assert executor.waiting("slow") == 0
+
+
+def test_arun(executor):
+    release = threading.Event()
+
+    async def run():
+        assert await executor.arun("get", lambda: "ok", {}) == "ok"
+        executor.timeouts = {"stalled": 0.05}
+        with pytest.raises(CommandTimeoutError):
+            await executor.arun("stalled", release.wait, {"timeout": 5})
+
+    asyncio.run(run())
+    release.set()
+
+
+def test_command_errors_are_raised(executor):
+    def failing():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        executor.run("failing", failing, {})
+    assert executor.running("failing") == 0
+
+
+def test_load_test_on_stand_in_server():
+    results = run_load_test(
+        nb_slow=4, nb_fast=10, slow_ms=500, nb_threads=2, timeout_secs=0.2
+    )
+
+    threads, executor = results["thread_workers"], results["command_executor"]
+    assert threads["fast"]["outcomes"] == {"ok": 10}
+    assert executor["fast"]["outcomes"] == {"ok": 10}
+    assert executor["slow"]["outcomes"] == {"timeout": 4}
+    # The fast commands waited for the slow ones on the threads only
+    assert executor["fast"]["max_ms"] < threads["fast"]["p50_ms"]
+
+
+def test_run_many_caps_the_batch(executor):
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def message(player):
+        with lock:
+            running.append(player)
+            max_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(player)
+        if player == "p3":
+            raise CommandFailedError("Player not found")
+        return f"sent to {player}"
+
+    results = executor.run_many(
+        [("do_message_player", message, {"player": f"p{idx}"}) for idx in range(6)]
+        + [("get_map", lambda: "foy", {})],
+        max_concurrent=3,
+    )
+
+    assert max(max_running) <= 2
+    assert [r for r, _ in results] == [
+        "sent to p0",
+        "sent to p1",
+        "sent to p2",
+        None,
+        "sent to p4",
+        "sent to p5",
+        "foy",
+    ]
+    assert isinstance(results[3][1], CommandFailedError)
+    assert executor.running("do_message_player") == 0
+
+
+def test_run_many_times_out_stalled_commands(executor):
+    release = threading.Event()
+    executor.timeouts = {"stalled": 0.1}
+
+    results = executor.run_many(
+        [("stalled", release.wait, {"timeout": 5}) for _ in range(3)]
+        + [("get_map", lambda: "foy", {})],
+        max_concurrent=2,
+    )
+    release.set()
+
+    assert [type(e) for _, e in results[:3]] == [CommandTimeoutError] * 3
+    assert results[3] == ("foy", None)
+
+
+def test_api_load_test_goes_through_http():
+    class Api(BaseHTTPRequestHandler):
+        def do_GET(self):
+            slow = self.path.endswith("get_playerids")
+            if slow:
+                time.sleep(0.2)
+            status = 504 if slow else 200
+            body = json.dumps({"failed": slow, "result": "foy"}).encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Api)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        results = run_api_load_test(
+            f"http://127.0.0.1:{server.server_address[1]}", "abc", nb_slow=3, nb_fast=5
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert results["slow"]["outcomes"] == {"timeout": 3}
+    assert results["fast"]["outcomes"] == {"ok": 5}
+
+
+def test_run_many_stops_at_the_batch_deadline(executor):
+    release = threading.Event()
+    executor.timeouts = {"stalled": 5}
+
+    started = time.monotonic()
+    results = executor.run_many(
+        [("stalled", release.wait, {"timeout": 5}) for _ in range(4)],
+        max_concurrent=2,
+        max_duration_secs=0.2,
+    )
+    release.set()
+
+    assert time.monotonic() - started < 1
+    assert [str(e) for _, e in results] == ["The batch took more than 0.2s"] * 4
+
+
+def test_timed_out_command_keeps_its_future(executor):
+    release = threading.Event()
+    executor.timeouts = {"do_perma_ban": 0.05}
+
+    with pytest.raises(CommandTimeoutError) as timed_out:
+        executor.run("do_perma_ban", lambda: release.wait(5) and "SUCCESS", {})
+
+    # Still running on the game server, its result comes afterwards
+    release.set()
+    assert timed_out.value.future.result(timeout=5) == "SUCCESS"
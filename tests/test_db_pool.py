@@ -0,0 +1,37 @@
+from unittest import mock
+
+from rcon.db_pool import PoolMetrics
+from rcon.models import get_pool_settings
+
+
+def test_pool_settings_env_overrides_config(monkeypatch):
+    config = {"ADVANCED_CRCON_SETTINGS": {"thread_pool_size": 20, "db_pool_size": 8}}
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "3")
+    monkeypatch.setenv("DB_PGBOUNCER_MODE", "true")
+    with mock.patch("rcon.config.get_config", return_value=config):
+        settings = get_pool_settings()
+
+    assert settings.db_pool_size == 8
+    assert settings.db_max_overflow == 3
+    assert settings.db_pgbouncer_mode is True
+    assert settings.db_pool_pre_ping is True
+
+
+def test_pool_metrics_window():
+    metrics = PoolMetrics(clock=lambda: 0)
+    metrics.checked_out()
+    metrics.checked_out()
+    metrics.record_wait(0.010)
+    metrics.record_wait(0.030)
+    metrics.checked_in()
+
+    snapshot = metrics.snapshot(reset_window=True)
+    assert snapshot["in_use"] == 1
+    assert snapshot["peak_in_use"] == 2
+    assert snapshot["wait_avg_ms"] == 20
+    assert snapshot["wait_max_ms"] == 30
+
+    snapshot = metrics.snapshot()
+    assert snapshot["checkouts"] == 2
+    assert snapshot["wait_max_ms"] == 0
+    assert snapshot["peak_in_use"] == 1
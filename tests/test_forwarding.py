@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+
+from rcon.forwarding import enqueue_forward_to_servers, fan_out, forward_to_servers
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency_secs)
+        body = json.dumps(
+            {"result": self.path, "cookie": self.headers.get("Cookie")}
+        ).encode()
+        self.send_response(self.server.status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(latency_secs=0.0, status_code=200):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        server.daemon_threads = True
+        server.latency_secs = latency_secs
+        server.status_code = status_code
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_fan_out_is_concurrent(start_server):
+    hosts = [start_server(latency_secs=0.3) for _ in range(4)]
+
+    started = time.monotonic()
+    results = fan_out(hosts, "/api/get_map", cookies={"sessionid": "abc"})
+
+    assert time.monotonic() - started < 1
+    assert [r["host"] for r in results] == hosts
+    assert all(r["ok"] for r in results)
+    assert results[0]["response"] == {
+        "result": "/api/get_map",
+        "cookie": "sessionid=abc",
+    }
+
+
+def test_fan_out_reports_each_failure(start_server):
+    ok_host = start_server()
+    error_host = start_server(status_code=500)
+    slow_host = start_server(latency_secs=2)
+
+    started = time.monotonic()
+    results = fan_out(
+        [ok_host, error_host, slow_host, "127.0.0.1:1"], "/api/get_map", deadline=0.5
+    )
+
+    assert time.monotonic() - started < 1.5
+    ok, error, slow, unreachable = results
+    assert ok["ok"] and ok["error"] is None
+    assert not error["ok"] and error["status_code"] == 500
+    assert error["error"] == "HTTP 500"
+    assert not slow["ok"] and slow["error"] == "No answer within 0.5s"
+    assert not unreachable["ok"] and unreachable["status_code"] is None
+
+
+def test_forward_to_servers_skips_this_server(start_server):
+    host = start_server()
+    with mock.patch("rcon.forwarding.get_other_hosts", return_value=[host]):
+        results = forward_to_servers("/api/do_kick", sessionid="abc")
+
+    assert [r["host"] for r in results] == [host]
+    assert results[0]["response"]["cookie"] == "sessionid=abc"
+
+
+def test_enqueue_forward_to_servers():
+    with mock.patch("rcon.workers.get_queue") as get_queue:
+        job_id = enqueue_forward_to_servers("/api/do_kick", json={"player": "a"})
+
+    assert job_id.startswith("forward_")
+    args, kwargs = get_queue.return_value.enqueue.call_args
+    assert args == (forward_to_servers, "/api/do_kick")
+    assert kwargs["job_id"] == job_id
+    assert kwargs["json"] == {"player": "a"}
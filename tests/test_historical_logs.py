@@ -0,0 +1,95 @@
+from datetime import datetime
+from unittest import mock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+
+from rcon.game_logs import (
+    decode_chat_cursor,
+    decode_log_cursor,
+    encode_chat_cursor,
+    encode_log_cursor,
+    get_historical_logs_query,
+    search_chat,
+)
+from rcon.models import LogLine
+
+
+def test_log_cursor_round_trip():
+    line = LogLine(id=42, event_time=datetime(2023, 5, 1, 12, 30, 5))
+
+    assert decode_log_cursor(encode_log_cursor(line)) == (line.event_time, 42)
+    with pytest.raises(ValueError):
+        decode_log_cursor("not a cursor")
+
+
+@pytest.mark.parametrize("time_sort, operator", [("desc", "<"), ("asc", ">")])
+def test_keyset_filter(time_sort, operator):
+    sess = mock.MagicMock()
+    sess.query.side_effect = lambda *entities: Query(entities)
+
+    query = get_historical_logs_query(
+        sess, time_sort=time_sort, after=(datetime(2023, 5, 1), 42)
+    )
+    sql = str(query.statement.compile(dialect=postgresql.dialect()))
+
+    assert f"(log_lines.event_time, log_lines.id) {operator} (" in sql
+    assert f"log_lines.event_time {time_sort.upper()}, log_lines.id" in sql
+
+
+def test_chat_cursor_round_trip():
+    line = LogLine(id=7, event_time=datetime(2023, 5, 1, 12, 30, 5))
+
+    assert decode_chat_cursor(encode_chat_cursor(line, 0.1, "time"), "time") == (
+        line.event_time,
+        7,
+    )
+    assert decode_chat_cursor(encode_chat_cursor(line, 0.1, "rank"), "rank") == (
+        0.1,
+        line.event_time,
+        7,
+    )
+
+
+def test_chat_rank_keyset_is_double_precision():
+    sess = mock.MagicMock()
+    sess.query.side_effect = lambda *entities: Query(entities)
+    rank = 0.10000000149011612
+    line = LogLine(id=7, event_time=datetime(2023, 5, 1, 12, 30, 5))
+
+    query = search_chat(
+        sess,
+        "hello",
+        sort="rank",
+        after=decode_chat_cursor(encode_chat_cursor(line, rank, "rank"), "rank"),
+    )
+    compiled = query.statement.compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+
+    rank_sql = "CAST(ts_rank_cd(to_tsvector('simple'::regconfig, log_lines.content)"
+    assert sql.count(rank_sql) == 3
+    assert "AS FLOAT(53)) AS rank" in sql
+    assert "AS FLOAT(53)), log_lines.event_time, log_lines.id) < (" in sql
+    assert "AS FLOAT(53)) DESC, log_lines.event_time DESC" in sql
+    assert rank in compiled.params.values()
+
+
+def test_player_name_filter_matches_the_trigram_indexes():
+    sess = mock.MagicMock()
+    sess.query.side_effect = lambda *entities: Query(entities)
+
+    query = get_historical_logs_query(sess, player_name="toto")
+    sql = str(query.statement.compile(dialect=postgresql.dialect()))
+
+    trigram_columns = [
+        column.name
+        for index in LogLine.__table__.indexes
+        if index.dialect_options["postgresql"]["ops"]
+        for column in index.columns
+        if index.dialect_options["postgresql"]["ops"][column.name] == "gin_trgm_ops"
+    ]
+    assert sorted(trigram_columns) == ["player1_name", "player2_name"]
+    # The filters are on the bare indexed columns, lower() would skip the index
+    for column in trigram_columns:
+        assert f"log_lines.{column} ILIKE %(" in sql
@@ -0,0 +1,98 @@
+import datetime
+from unittest import mock
+
+import pytest
+
+from log_generator import END, START, generate_logs, log_line
+from rcon.columnar_stats import diff_players_stats
+from rcon.game_logs import LogTail
+from rcon.scoreboard import IncrementalGameStats, TimeWindowStats
+
+
+class FakeLogHistory:
+    """The log history in redis, newest line first"""
+
+    def __init__(self):
+        self.logs = []
+
+    def push(self, logs):
+        for log in logs:
+            log.setdefault("line_without_time", log["raw"])
+            self.logs.insert(0, log)
+
+    def iter_chunked(self, chunk_size=500):
+        yield from list(self.logs)
+
+
+@pytest.fixture
+def history():
+    history = FakeLogHistory()
+    with mock.patch(
+        "rcon.game_logs.LogLoop.get_log_history_list", return_value=history
+    ):
+        yield history
+
+
+@pytest.fixture
+def engines(history):
+    with mock.patch("rcon.scoreboard.Rcon"), mock.patch(
+        "rcon.scoreboard.get_redis_client"
+    ), mock.patch("rcon.scoreboard.enter_session"), mock.patch(
+        "rcon.scoreboard.get_player_profile_by_steam_ids", return_value=[]
+    ):
+        yield TimeWindowStats(), IncrementalGameStats()
+
+
+def test_log_tail_only_returns_new_lines(history):
+    tail = LogTail()
+    logs = generate_logs(0, nb_lines=10)
+    history.push(logs[:4])
+    assert tail.read() == logs[:4]
+    assert tail.read() == []
+
+    history.push(logs[4:])
+    assert tail.read() == logs[4:]
+
+
+def test_log_tail_stops_at_min_timestamp(history):
+    tail = LogTail()
+    logs = generate_logs(0, nb_lines=10)
+    history.push(logs)
+
+    assert tail.read(min_timestamp_ms=logs[5]["timestamp_ms"]) == [
+        log for log in logs if log["timestamp_ms"] >= logs[5]["timestamp_ms"]
+    ]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_same_stats_as_full_recomputation(engines, history, seed):
+    reference, incremental = engines
+    logs = generate_logs(seed)
+    map_start = START.timestamp() - 1
+    from_ = datetime.datetime.fromtimestamp(map_start)
+
+    for idx in range(0, len(logs), 250):
+        history.push(logs[idx : idx + 250])
+        incremental.update(map_start)
+    expected = reference._get_players_stats_for_logs(
+        logs, from_, END, offset_cooldown_time_seconds=0
+    )
+    actual = incremental.get_stats(until=END)
+
+    assert len(expected) == 30
+    assert diff_players_stats(expected, actual) == []
+
+
+def test_reset_on_new_map(engines, history):
+    _, incremental = engines
+    history.push([log_line(START, "KILL", "player1", "player2", "MP40")])
+    incremental.update(START.timestamp() - 1)
+    assert incremental.get_stats(until=END)["player1"]["kills"] == 1
+
+    new_map = START + datetime.timedelta(minutes=1)
+    history.push([log_line(new_map, "KILL", "player2", "player1", "MP40")])
+    incremental.update(new_map.timestamp() - 1)
+    stats = incremental.get_stats(until=END)
+
+    assert stats["player1"]["kills"] == 0
+    assert stats["player1"]["deaths"] == 1
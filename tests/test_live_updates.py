@@ -0,0 +1,131 @@
+import pickle
+from unittest import mock
+
+from rcon.live_updates import (
+    TOPICS,
+    StatsUpdatesPublisher,
+    StreamSlots,
+    decode_cursors,
+    encode_cursors,
+    get_stale_topics,
+    iter_updates,
+    read_updates,
+)
+
+
+def _entry(stream_id, payload, field=b"data"):
+    return (stream_id, {field: pickle.dumps(payload)})
+
+
+def test_cursors_round_trip():
+    cursors = {"team_view": "1686000000000-3", "logs": "1686000000001-0"}
+    event_id = encode_cursors(cursors)
+
+    assert event_id == "logs:1686000000001-0,team_view:1686000000000-3"
+    assert decode_cursors(event_id) == cursors
+
+
+def test_decode_cursors_ignores_invalid_items():
+    assert decode_cursors(None) == {}
+    assert decode_cursors("logs:abc,unknown:1-0,team_view:12-1,:") == {
+        "team_view": "12-1"
+    }
+
+
+def test_read_updates():
+    red = mock.MagicMock()
+    red.xread.return_value = [
+        [TOPICS["logs"].encode(), [_entry(b"1-0", {"raw": "a"})]],
+        [
+            TOPICS["team_view"].encode(),
+            [_entry(b"2-0", {"joined": []}, field=b"diff")],
+        ],
+    ]
+
+    updates = read_updates({"logs": "0-0", "team_view": "1-5"}, red=red)
+
+    assert red.xread.call_args.args[0] == {
+        TOPICS["logs"]: "0-0",
+        TOPICS["team_view"]: "1-5",
+    }
+    assert updates == [
+        ("logs", "1-0", {"raw": "a"}),
+        ("team_view", "2-0", {"joined": []}),
+    ]
+
+
+def test_iter_updates_moves_cursors_and_stops():
+    red = mock.MagicMock()
+    red.xread.side_effect = [
+        [[TOPICS["logs"].encode(), [_entry(b"5-0", 1), _entry(b"6-0", 2)]]],
+        [],
+    ]
+    now = iter([0, 0, 0, 10, 10, 99])
+
+    updates = list(
+        iter_updates(
+            {"logs": "4-0"}, max_duration_secs=30, red=red, clock=lambda: next(now)
+        )
+    )
+
+    assert [u[:2] if u else u for u in updates] == [("logs", 1), ("logs", 2), None]
+    assert updates[-2][2] == {"logs": "6-0"}
+
+
+def test_stale_topics():
+    red = mock.MagicMock()
+    red.pipeline.return_value.execute.return_value = [
+        [(b"10-0", {})],
+        [],
+        [(b"3-0", {})],
+    ]
+
+    stale = get_stale_topics(
+        {"logs": "9-5", "team_view": "1-0", "live_stats": "3-0"}, red=red
+    )
+
+    assert stale == ["logs"]
+
+
+def test_stats_updates_publisher():
+    publisher = StatsUpdatesPublisher("live_stats")
+    first = [{"steam_id_64": "1", "kills": 1}, {"steam_id_64": "2", "kills": 0}]
+    second = [{"steam_id_64": "1", "kills": 2}, {"steam_id_64": "3", "kills": 0}]
+
+    with mock.patch("rcon.live_updates.publish_updates") as publish:
+        assert publisher.publish(first, 1.0)["reset"]
+        update = publisher.publish(second, 2.0)
+        assert publisher.publish(second, 3.0) is None
+
+    assert update == {
+        "changed": second,
+        "left": ["2"],
+        "reset": False,
+        "snapshot_timestamp": 2.0,
+    }
+    assert publish.call_count == 2
+
+
+def test_stream_slots():
+    slots = StreamSlots(max_streams=2)
+    closed = []
+
+    def stream():
+        try:
+            yield from ["a", "b"]
+        finally:
+            closed.append(True)
+
+    assert slots.acquire() and slots.acquire()
+    assert not slots.acquire()
+
+    first = slots.hold(stream())
+    assert list(first) == ["a", "b"]
+    assert slots.open == 1
+
+    second = slots.hold(stream())
+    assert next(second) == "a"
+    second.close()
+    second.close()
+    assert slots.open == 0
+    assert closed == [True, True]
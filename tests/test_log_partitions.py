@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+from datetime import datetime
+from unittest import mock
+
+from rcon import log_partitions
+from rcon.log_partitions import (
+    add_months,
+    create_partition,
+    detach_old_log_partitions,
+    get_log_partitions,
+    month_start,
+    partition_name,
+)
+
+
+def test_partition_bounds():
+    start = month_start(datetime(2023, 11, 17, 13, 45))
+
+    assert start == datetime(2023, 11, 1)
+    assert add_months(start, 1) == datetime(2023, 12, 1)
+    assert add_months(start, 2) == datetime(2024, 1, 1)
+    assert add_months(start, -11) == datetime(2022, 12, 1)
+    assert partition_name(add_months(start, 2)) == "log_lines_y2024m01"
+
+
+class _RecordingSession:
+    """Keeps the SQL executed, answers the queries with `results`"""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.statements = []
+        self.commit = mock.Mock()
+
+    def execute(self, statement, params=None):
+        self.statements.append((" ".join(str(statement).split()), params))
+        result = self.results.pop(0) if self.results else mock.MagicMock()
+        return result
+
+
+def _partitions_result(*bounds):
+    return [("log_lines_default", "DEFAULT")] + [
+        (
+            partition_name(start),
+            f"FOR VALUES FROM ('{start.isoformat(' ')}') TO "
+            f"('{add_months(start, 1).isoformat(' ')}')",
+        )
+        for start in bounds
+    ]
+
+
+def test_get_log_partitions_parses_the_bounds():
+    sess = _RecordingSession(
+        [_partitions_result(datetime(2023, 6, 1), datetime(2023, 5, 1))]
+    )
+
+    assert get_log_partitions(sess) == [
+        ("log_lines_y2023m05", datetime(2023, 5, 1), datetime(2023, 6, 1)),
+        ("log_lines_y2023m06", datetime(2023, 6, 1), datetime(2023, 7, 1)),
+    ]
+
+
+def test_create_partition():
+    sess = _RecordingSession([mock.Mock(scalar=mock.Mock(return_value=False))])
+
+    create_partition(sess, datetime(2023, 12, 1))
+
+    assert [sql for sql, _ in sess.statements[1:]] == [
+        "CREATE TABLE log_lines_y2023m12 PARTITION OF log_lines "
+        "FOR VALUES FROM ('2023-12-01T00:00:00') TO ('2024-01-01T00:00:00')"
+    ]
+
+
+def test_create_partition_moves_the_lines_of_the_default_partition():
+    sess = _RecordingSession(
+        [
+            mock.Mock(scalar=mock.Mock(return_value=True)),
+            mock.Mock(),
+            mock.Mock(),
+            mock.Mock(rowcount=42),
+        ]
+    )
+
+    create_partition(sess, datetime(2023, 12, 1))
+
+    bounds = {"start": datetime(2023, 12, 1), "end": datetime(2024, 1, 1)}
+    assert sess.statements[0][1] == bounds
+    assert sess.statements[1:] == [
+        ("ALTER TABLE log_lines DETACH PARTITION log_lines_default", None),
+        (
+            "CREATE TABLE log_lines_y2023m12 PARTITION OF log_lines "
+            "FOR VALUES FROM ('2023-12-01T00:00:00') TO ('2024-01-01T00:00:00')",
+            None,
+        ),
+        (
+            "INSERT INTO log_lines SELECT * FROM log_lines_default "
+            "WHERE event_time >= :start AND event_time < :end",
+            bounds,
+        ),
+        (
+            "DELETE FROM log_lines_default "
+            "WHERE event_time >= :start AND event_time < :end",
+            bounds,
+        ),
+        ("ALTER TABLE log_lines ATTACH PARTITION log_lines_default DEFAULT", None),
+    ]
+
+
+def test_detach_old_log_partitions():
+    months = [datetime(2023, month, 1) for month in range(1, 6)]
+    sess = _RecordingSession([_partitions_result(*months)])
+
+    @contextmanager
+    def enter_session():
+        yield sess
+
+    with mock.patch.object(log_partitions, "enter_session", enter_session):
+        detached = detach_old_log_partitions(
+            2, drop=True, now=datetime(2023, 5, 17, 10)
+        )
+
+    # The cutoff is 2023-03-01, only the partitions ending before are dropped
+    assert detached == ["log_lines_y2023m01", "log_lines_y2023m02"]
+    assert [sql for sql, _ in sess.statements[1:]] == [
+        "ALTER TABLE log_lines DETACH PARTITION log_lines_y2023m01",
+        "DROP TABLE log_lines_y2023m01",
+        "ALTER TABLE log_lines DETACH PARTITION log_lines_y2023m02",
+        "DROP TABLE log_lines_y2023m02",
+    ]
+    assert sess.commit.call_count == 2
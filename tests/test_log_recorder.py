@@ -0,0 +1,122 @@
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+from rcon.game_logs import LogRecorder
+
+
+def make_log(timestamp_ms, line):
+    return {"timestamp_ms": timestamp_ms, "line_without_time": line, "raw": line}
+
+
+@mock.patch("rcon.game_logs.LogLoop.get_log_history_list")
+def test_new_logs_stop_at_watermark(get_log_history_list, monkeypatch):
+    monkeypatch.setenv("SERVER_NUMBER", "1")
+    recorder = LogRecorder()
+    # Newest first, several lines in the same millisecond
+    history = [
+        make_log(3000, "d"),
+        make_log(2000, "c"),
+        make_log(2000, "b"),
+        make_log(2000, "a"),
+        make_log(1000, "z"),
+    ]
+    get_log_history_list.return_value.iter_chunked.return_value = iter(history)
+    watermark = {"timestamp_ms": 2000, "hash": LogRecorder._log_hash(history[2])}
+
+    with mock.patch.object(recorder, "_get_watermark", return_value=watermark):
+        assert recorder._get_new_logs(mock.MagicMock()) == history[:2]
+
+
+@mock.patch("rcon.game_logs.LogLoop.get_log_history_list")
+def test_new_logs_without_watermark(get_log_history_list, monkeypatch):
+    monkeypatch.setenv("SERVER_NUMBER", "1")
+    recorder = LogRecorder()
+    history = [make_log(3000, "b"), make_log(2000, "b"), make_log(1000, "a")]
+    get_log_history_list.return_value.iter_chunked.return_value = iter(
+        history + [history[0]]
+    )
+
+    with mock.patch.object(recorder, "_get_watermark", return_value=None):
+        sess = mock.MagicMock()
+        sess.query.return_value.filter.return_value.order_by.return_value.limit.return_value.one_or_none.return_value = (
+            None
+        )
+        assert recorder._get_new_logs(sess) == history
+
+
+def make_structured_log(timestamp_ms, steam_id_64_1=None, player="toto"):
+    return {
+        "version": 1,
+        "timestamp_ms": timestamp_ms,
+        "action": "CHAT",
+        "player": player,
+        "player2": None,
+        "steam_id_64_1": steam_id_64_1,
+        "steam_id_64_2": None,
+        "raw": f"{timestamp_ms} {player}",
+        "message": "hello",
+        "weapon": None,
+    }
+
+
+def make_session(known_steam_ids):
+    sess = mock.MagicMock()
+    sess.query.return_value.filter.return_value.all.return_value = list(
+        known_steam_ids.items()
+    )
+    return sess
+
+
+def test_save_logs_in_bulk(monkeypatch):
+    monkeypatch.setenv("SERVER_NUMBER", "1")
+    recorder = LogRecorder(insert_batch_size=2)
+    logs = [
+        make_structured_log(1000, "76561198000000001"),
+        make_structured_log(2000, "76561198000000001"),
+        make_structured_log(3000, "76561198000000002"),
+    ]
+    sess = make_session({"76561198000000001": 10})
+    sess.execute.side_effect = [mock.Mock(rowcount=2), mock.Mock(rowcount=0)]
+
+    assert recorder._save_logs(sess, logs) == 2
+
+    # A single query resolves the player IDs
+    assert sess.query.call_count == 1
+    statements = [call.args[0] for call in sess.execute.call_args_list]
+    assert len(statements) == 2
+    sql = [str(s.compile(dialect=postgresql.dialect())) for s in statements]
+    assert all("ON CONFLICT DO NOTHING" in s for s in sql)
+    rows = [s.compile(dialect=postgresql.dialect()).params for s in statements]
+    assert rows[0]["player1_steamid_m0"] == 10
+    assert rows[1]["player1_steamid_m0"] is None
+    assert rows[0]["server_m0"] == "1"
+    sess.commit.assert_called_once()
+    sess.rollback.assert_not_called()
+
+
+def test_save_logs_falls_back_to_one_by_one(monkeypatch):
+    monkeypatch.setenv("SERVER_NUMBER", "1")
+    recorder = LogRecorder()
+    logs = [make_structured_log(t) for t in (1000, 2000, 3000)]
+    sess = make_session({})
+    error = IntegrityError("INSERT", {}, Exception("duplicate"))
+    sess.execute.side_effect = [
+        error,
+        mock.Mock(rowcount=1),
+        error,
+        mock.Mock(rowcount=1),
+    ]
+
+    assert recorder._save_logs(sess, logs) == 2
+
+    # The batch, then each line in its own transaction
+    assert sess.execute.call_count == 4
+    params = [
+        c.args[0].compile(dialect=postgresql.dialect()).params
+        for c in sess.execute.call_args_list[1:]
+    ]
+    assert [p["raw_m0"] for p in params] == ["1000 toto", "2000 toto", "3000 toto"]
+    assert sess.rollback.call_count == 2
+    assert sess.commit.call_count == 2
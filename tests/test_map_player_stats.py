@@ -0,0 +1,76 @@
+import datetime
+import json
+from unittest import mock
+
+import pytest
+
+from rcon.game_logs import LogLoop
+from rcon.utils import MapPlayerStats, max_merge_player_stats
+
+MAP = {"name": "foy_warfare", "start": 1685000000.0, "end": None, "guessed": False}
+
+
+def _stat(combat=0, offense=0, defense=0, support=0):
+    return dict(combat=combat, offense=offense, defense=defense, support=support)
+
+
+@pytest.fixture
+def red():
+    with (
+        mock.patch("rcon.utils.redis.StrictRedis") as strict_redis,
+        mock.patch("rcon.utils.get_redis_pool"),
+    ):
+        yield strict_redis.return_value
+
+
+def test_max_merge_player_stats():
+    assert max_merge_player_stats(
+        {"1": _stat(10, 5), "2": _stat(1)},
+        {"1": _stat(3, 8, 2)},
+    ) == {"1": _stat(10, 8, 2), "2": _stat(1)}
+
+
+def test_get_all_merges_inline_stats(red):
+    red.hgetall.return_value = {b"1": json.dumps(_stat(20, 1)).encode()}
+    map_info = dict(MAP, player_stats={"1": _stat(10, 5), "2": _stat(7)})
+
+    assert MapPlayerStats(map_info).get_all() == {
+        "1": _stat(20, 5),
+        "2": _stat(7),
+    }
+    red.hgetall.assert_called_once_with(MapPlayerStats.key_for(MAP))
+
+
+def test_merge_sends_the_players_to_the_script(red):
+    stats = MapPlayerStats(MAP)
+
+    stats.merge({"1": _stat(3)})
+
+    script = red.register_script.return_value
+    script.assert_called_once_with(
+        keys=[stats.key],
+        args=[MapPlayerStats.ttl_secs, "1", json.dumps(_stat(3))],
+    )
+
+
+def test_record_player_stats_only_sends_changed_players(red):
+    loop = LogLoop.__new__(LogLoop)
+    loop.player_stats_key = None
+    loop.sent_player_stats = {}
+    started = dict(
+        MAP, start=(datetime.datetime.now() - datetime.timedelta(hours=1)).timestamp()
+    )
+
+    with (
+        mock.patch("rcon.game_logs.MapsHistory") as maps_history,
+        mock.patch("rcon.game_logs.MapPlayerStats.merge") as merge,
+    ):
+        maps_history.return_value.__len__.return_value = 1
+        maps_history.return_value.__getitem__.return_value = started
+        loop.record_player_stats({"1": _stat(1), "2": _stat(2)})
+        loop.record_player_stats({"1": _stat(1), "2": _stat(5)})
+
+    assert [c.args[0] for c in merge.call_args_list] == [
+        {"1": _stat(1), "2": _stat(2)},
+        {"2": _stat(5)},
+    ]
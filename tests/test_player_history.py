@@ -0,0 +1,190 @@
+from contextlib import contextmanager
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+
+from rcon import hooks, player_history
+from rcon.models import PlayerName, PlayerSteamID
+from rcon.player_history import (
+    cache_player_id,
+    get_player_connect_state,
+    get_players_by_appearance,
+    record_player_connection,
+    upsert_player_id,
+)
+
+
+def test_player_id_is_cached():
+    sess = mock.MagicMock()
+    cache_player_id("76561198000000001", 5)
+
+    assert upsert_player_id(sess, "76561198000000001") == 5
+    sess.execute.assert_not_called()
+    sess.query.assert_not_called()
+
+
+def test_record_new_player_connection():
+    sess = mock.MagicMock()
+    sess.execute.return_value.scalar.return_value = 42
+
+    assert record_player_connection(sess, "76561198000000002", "toto", 1600000000) == 42
+
+    statements = [
+        str(call.args[0].compile(dialect=postgresql.dialect()))
+        for call in sess.execute.call_args_list
+    ]
+    assert len(statements) == 3
+    assert all("ON CONFLICT" in s for s in statements)
+    # Only committed players are cached
+    upsert_player_id(sess, "76561198000000002")
+    assert sess.execute.call_count == 4
+
+
+def test_connect_state_is_detached():
+    flag = mock.Mock()
+    flag.to_dict.return_value = {"flag": "🤡"}
+    player = mock.Mock(id=3, steam_id_64="76561198000000003", flags=[flag])
+    player.blacklist.to_dict.return_value = {"is_blacklisted": False}
+    player.watchlist = None
+    sess = mock.MagicMock()
+    sess.query.return_value.outerjoin.return_value.options.return_value.filter.return_value.first.return_value = (
+        player,
+        None,
+    )
+
+    state = get_player_connect_state(sess, 3, server_number=1)
+
+    assert sess.query.call_count == 1
+    assert state == {
+        "player_id": 3,
+        "steam_id_64": "76561198000000003",
+        "blacklist": {"is_blacklisted": False},
+        "watchlist": None,
+        "flags": [{"flag": "🤡"}],
+        "vip_expiration": None,
+    }
+
+
+def test_connect_checks_run_once_the_session_is_closed():
+    calls = []
+    state = {
+        "player_id": 3,
+        "steam_id_64": "76561198000000003",
+        "blacklist": None,
+        "watchlist": None,
+        "flags": [{"flag": "🤡"}],
+        "vip_expiration": None,
+    }
+
+    @contextmanager
+    def session():
+        calls.append("open")
+        yield mock.MagicMock()
+        calls.append("close")
+
+    def connect_hook(rcon, log, name, steam_id_64, player_state):
+        calls.append(("hook", player_state["player_id"]))
+
+    log = {"player": "toto", "steam_id_64_1": "76561198000000003", "timestamp_ms": 0}
+    with (
+        mock.patch.object(hooks, "enter_session", session),
+        mock.patch.object(hooks, "record_player_connection", return_value=3),
+        mock.patch.object(hooks, "get_player_connect_state", return_value=state),
+        mock.patch.object(
+            hooks,
+            "_ban_if_has_vac_bans",
+            side_effect=lambda *args: calls.append(("vac", args[3])),
+        ),
+        mock.patch.object(hooks, "CONNECT_STATE_HOOKS", [connect_hook]),
+    ):
+        hooks.handle_on_connect(mock.MagicMock(), log)
+
+    assert calls == ["open", "close", ("hook", 3), ("vac", ["🤡"])]
+
+
+def test_failed_vac_check_does_not_skip_the_connect_hooks():
+    calls = []
+    state = {
+        "player_id": 3,
+        "steam_id_64": "76561198000000003",
+        "blacklist": None,
+        "watchlist": None,
+        "flags": [],
+        "vip_expiration": None,
+    }
+
+    @contextmanager
+    def session():
+        yield mock.MagicMock()
+
+    def connect_hook(rcon, log, name, steam_id_64, player_state):
+        calls.append(name)
+
+    rcon = mock.MagicMock()
+    rcon.do_perma_ban.side_effect = Exception("Game server unreachable")
+    log = {"player": "toto", "steam_id_64_1": "76561198000000003", "timestamp_ms": 0}
+    with (
+        mock.patch.object(hooks, "enter_session", session),
+        mock.patch.object(hooks, "record_player_connection", return_value=3),
+        mock.patch.object(hooks, "get_player_connect_state", return_value=state),
+        mock.patch.object(
+            hooks,
+            "get_config",
+            return_value={
+                "VAC_GAME_BANS": {
+                    "ban_on_vac_history_days": 100,
+                    "ban_on_vac_history_reason": "VAC ban {DAYS_SINCE_LAST_BAN} days ago",
+                }
+            },
+        ),
+        mock.patch.object(
+            hooks,
+            "get_player_bans",
+            return_value={"VACBanned": True, "DaysSinceLastBan": 5},
+        ),
+        mock.patch.object(hooks, "CONNECT_STATE_HOOKS", [connect_hook, connect_hook]),
+    ):
+        hooks.handle_on_connect(rcon, log)
+
+    rcon.do_perma_ban.assert_called_once()
+    assert calls == ["toto", "toto"]
+
+
+def _get_index(model, name):
+    (index,) = [i for i in model.__table__.indexes if i.name == name]
+    return index
+
+
+def test_player_searches_match_the_trigram_indexes():
+    queries = []
+
+    class _Query(Query):
+        def count(self):
+            queries.append(self.statement)
+            return 0
+
+        def all(self):
+            return []
+
+    @contextmanager
+    def session():
+        yield mock.Mock(query=lambda *entities: _Query(entities))
+
+    with mock.patch.object(player_history, "enter_session", session):
+        get_players_by_appearance(player_name="Élodie", steam_id_64="4242")
+
+    sql = str(queries[0].compile(dialect=postgresql.dialect()))
+
+    # The index is on the expression, the filter must use the same one
+    names_index = _get_index(PlayerName, "ix_player_names_name_unaccent_trgm")
+    (expression,) = names_index.expressions
+    assert str(expression) == "f_unaccent(name) gin_trgm_ops"
+    assert "f_unaccent(player_names.name) ILIKE %(f_unaccent_1)s" in sql
+    assert queries[0].compile().params["f_unaccent_1"] == "%Elodie%"
+
+    steam_id_index = _get_index(PlayerSteamID, "ix_steam_id_64_steam_id_64_trgm")
+    assert steam_id_index.dialect_options["postgresql"]["ops"] == {
+        "steam_id_64": "gin_trgm_ops"
+    }
+    assert "steam_id_64.steam_id_64 ILIKE %(steam_id_64_1)s" in sql
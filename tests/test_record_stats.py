@@ -0,0 +1,41 @@
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+
+from rcon.workers import upsert_player_stats
+
+
+def _compiled_upsert(force):
+    sess = mock.MagicMock()
+    sess.execute.return_value.fetchall.return_value = [(True,), (False,)]
+    rows = [
+        dict(playersteamid_id=player_id, map_id=1, name=f"player {player_id}", kills=3)
+        for player_id in (1, 2)
+    ]
+
+    counts = upsert_player_stats(sess, rows, force=force)
+    stmt = sess.execute.call_args[0][0]
+    return counts, str(stmt.compile(dialect=postgresql.dialect()))
+
+
+def test_upsert_player_stats_force_updates():
+    counts, sql = _compiled_upsert(force=True)
+
+    assert counts == (1, 1)
+    assert "ON CONFLICT ON CONSTRAINT unique_map_player DO UPDATE" in sql
+    assert "kills = excluded.kills" in sql
+    assert "name = excluded.name" not in sql
+    assert "RETURNING xmax = 0" in sql
+
+
+def test_upsert_player_stats_keeps_existing():
+    _, sql = _compiled_upsert(force=False)
+
+    assert "ON CONFLICT ON CONSTRAINT unique_map_player DO NOTHING" in sql
+
+
+def test_upsert_player_stats_no_rows():
+    sess = mock.MagicMock()
+
+    assert upsert_player_stats(sess, [], force=True) == (0, 0)
+    sess.execute.assert_not_called()
@@ -0,0 +1,240 @@
+import datetime
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+import pandas as pd
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+
+from rcon import server_stats
+from rcon.server_stats import (
+    SessionSpan,
+    build_server_stats,
+    get_db_server_stats_bucket_players,
+    get_db_server_stats_buckets,
+    iter_covering_per_minute,
+    pick_stats_resolution,
+    presence_intervals,
+)
+from rcon.server_stats_benchmark import (
+    generate_maps,
+    generate_sessions,
+    reference_server_stats,
+)
+
+START = datetime.datetime(2023, 5, 1, 20, 0, 0)
+
+
+def test_iter_covering_per_minute_bounds_are_inclusive():
+    minutes = [START + datetime.timedelta(minutes=m) for m in range(5)]
+    intervals = [
+        (START + datetime.timedelta(minutes=1), START + datetime.timedelta(minutes=3)),
+        (START, START + datetime.timedelta(seconds=30)),
+    ]
+
+    assert list(iter_covering_per_minute(minutes, intervals)) == [
+        [1],
+        [0],
+        [0],
+        [0],
+        [],
+    ]
+
+
+@pytest.mark.parametrize("by_map", [True, False])
+@pytest.mark.parametrize("seed", range(3))
+def test_same_output_as_hour_index(seed, by_map):
+    end = START + datetime.timedelta(days=2)
+    series = pd.date_range(start=START, end=end, freq="T")
+    maps = generate_maps(START - datetime.timedelta(hours=1), end, seed)
+    sessions = generate_sessions(START, end, 300, seed)
+    vips = {s.steam_id_64 for s in sessions[::7]}
+
+    expected = reference_server_stats(series, maps, sessions, vips, by_map)
+    actual = build_server_stats(series, maps, sessions, vips, by_map)
+
+    assert actual == expected
+
+
+def test_models_are_returned():
+    series = pd.date_range(start=START, periods=2, freq="T")
+    steamid = object()
+    sessions = [
+        SessionSpan(
+            start=START,
+            end=START + datetime.timedelta(minutes=5),
+            steam_id_64="1",
+            steamid=steamid,
+        )
+    ]
+
+    stats = build_server_stats(
+        series, [], sessions, {"1"}, by_map=False, return_models=True
+    )
+
+    assert [(s["map"], s["count"], s["vip_count"]) for s in stats] == [
+        (None, 1, 1),
+        (None, 1, 1),
+    ]
+    assert stats[0]["players"] == [(steamid, True)]
+
+
+@pytest.mark.parametrize(
+    "range_,resolution",
+    [
+        (datetime.timedelta(hours=12), "minute"),
+        (datetime.timedelta(days=7), "hour"),
+        (datetime.timedelta(days=365), "day"),
+    ],
+)
+def test_pick_stats_resolution(range_, resolution):
+    assert pick_stats_resolution(START, START + range_) == resolution
+
+
+def test_invalid_resolution():
+    with pytest.raises(ValueError):
+        get_db_server_stats_buckets(START, START, resolution="week")
+
+
+class _RecordingSession:
+    """Keeps the statements instead of running them, without rows"""
+
+    def __init__(self):
+        self.statements = []
+        self.params = []
+
+    def query(self, *entities):
+        sess = self
+
+        class _Query(Query):
+            def all(self):
+                sess.statements.append(self.statement)
+                return []
+
+        return _Query(entities)
+
+    def execute(self, statement, params=None):
+        self.statements.append(statement)
+        self.params.append(params)
+        return mock.Mock(fetchall=list)
+
+
+@pytest.fixture
+def recording_session():
+    sess = _RecordingSession()
+
+    @contextmanager
+    def enter_session():
+        yield sess
+
+    with mock.patch.object(server_stats, "enter_session", enter_session):
+        yield sess
+
+
+def _sql(statement):
+    return " ".join(str(statement.compile(dialect=postgresql.dialect())).split())
+
+
+def test_buckets_by_map_are_grouped_in_postgres(recording_session):
+    end = START + datetime.timedelta(hours=6)
+
+    assert get_db_server_stats_buckets(START, end, "hour", server_number=1) == {}
+
+    (statement,) = recording_session.statements
+    sql = _sql(statement)
+    bucket = "date_trunc('hour', server_counts.datapoint_time)"
+    assert f"SELECT {bucket} AS bucket, map_history.map_name" in sql
+    assert "avg(server_counts.count) AS avg_count" in sql
+    assert "max(server_counts.vip_count) AS max_vip_count" in sql
+    assert "JOIN map_history ON server_counts.map_id = map_history.id" in sql
+    # The same expression in both, not two bound parameters
+    assert f"GROUP BY {bucket}, map_history.map_name ORDER BY {bucket}" in sql
+
+
+def test_continuous_buckets_left_join_a_series(recording_session):
+    end = START + datetime.timedelta(days=2)
+
+    assert get_db_server_stats_buckets(START, end, "hour", False, 1) == []
+
+    (statement,) = recording_session.statements
+    sql = _sql(statement)
+    assert (
+        "SELECT generate_series( date_trunc(%(resolution)s, CAST(%(start)s AS timestamp)),"
+        " %(end)s, %(step)s ) AS bucket" in sql
+    )
+    assert "FROM buckets b LEFT JOIN server_counts c" in sql
+    assert "c.datapoint_time < b.bucket + %(step)s" in sql
+    assert "GROUP BY b.bucket ORDER BY b.bucket" in sql
+    assert recording_session.params == [
+        dict(
+            resolution="hour",
+            start=START,
+            end=end,
+            step=datetime.timedelta(hours=1),
+            server_number=1,
+        )
+    ]
+
+
+def test_bucket_players_minutes_are_clipped_to_the_bucket(recording_session):
+    assert get_db_server_stats_bucket_players(START, "hour", server_number=1) == []
+
+    (statement,) = recording_session.statements
+    sql = _sql(statement)
+    assert (
+        'sum(EXTRACT(epoch FROM least(player_presence."end", %(least_1)s)'
+        " - greatest(player_presence.start, %(greatest_1)s)) / %(param_1)s"
+        " + %(param_2)s) AS minutes" in sql
+    )
+    assert "bool_or(player_presence.vip) AS vip" in sql
+    assert (
+        "GROUP BY player_presence.playersteamid_id, steam_id_64.steam_id_64"
+        " ORDER BY minutes DESC, steam_id_64.steam_id_64" in sql
+    )
+    params = statement.compile(dialect=postgresql.dialect()).params
+    assert params["least_1"] == START + datetime.timedelta(minutes=59)
+    assert params["greatest_1"] == START
+
+
+def test_presence_intervals_merge_consecutive_minutes():
+    alice, bob = SimpleNamespace(id=1), SimpleNamespace(id=2)
+    minute = datetime.timedelta(minutes=1)
+    stats = [
+        {"minute": START, "players": [(alice, False), (bob, True)]},
+        {"minute": START + minute, "players": [(alice, False), (alice, False)]},
+        {"minute": START + 2 * minute, "players": [(alice, True), (bob, True)]},
+        {"minute": START + 4 * minute, "players": [(alice, True)]},
+    ]
+
+    assert presence_intervals(stats) == [
+        (1, START, START + minute, False),
+        (2, START, START, True),
+        (1, START + 2 * minute, START + 2 * minute, True),
+        (2, START + 2 * minute, START + 2 * minute, True),
+        (1, START + 4 * minute, START + 4 * minute, True),
+    ]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_presence_intervals_give_back_the_players_per_minute(seed):
+    end = START + datetime.timedelta(hours=6)
+    series = pd.date_range(start=START, end=end, freq="T")
+    sessions = generate_sessions(START, end, 100, seed)
+    for session in sessions:
+        session.steamid = SimpleNamespace(id=int(session.steam_id_64))
+    stats = build_server_stats(
+        series, [], sessions, set(), by_map=False, return_models=True
+    )
+
+    intervals = presence_intervals(stats)
+    covering = iter_covering_per_minute(
+        [item["minute"] for item in stats], [(i[1], i[2]) for i in intervals]
+    )
+
+    assert len(intervals) < sum(item["count"] for item in stats)
+    for item, idxs in zip(stats, covering):
+        assert sorted(intervals[idx][0] for idx in idxs) == sorted(
+            {steamid.id for steamid, _ in item["players"]}
+        )
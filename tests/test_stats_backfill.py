@@ -0,0 +1,95 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from rcon import stats_backfill
+
+
+def test_backfill_resumes_and_counts():
+    def backfill_map(map_id, force):
+        if map_id == 3:
+            raise ValueError("broken map")
+        return {"inserted": 10, "updated": 2}
+
+    progresses = []
+    with (
+        mock.patch.object(stats_backfill, "enter_session"),
+        mock.patch.object(
+            stats_backfill, "get_maps_to_backfill", return_value=[1, 2, 3, 4]
+        ),
+        mock.patch.object(stats_backfill, "_get_done_maps", return_value={1}),
+        mock.patch.object(stats_backfill, "_set_map_done") as set_map_done,
+        mock.patch.object(stats_backfill, "get_engine"),
+        mock.patch.object(stats_backfill, "ProcessPoolExecutor", ThreadPoolExecutor),
+        mock.patch.object(
+            stats_backfill, "backfill_map", side_effect=backfill_map
+        ) as backfill,
+    ):
+        progress = stats_backfill.backfill_player_stats(
+            datetime.datetime(2023, 1, 1),
+            datetime.datetime(2023, 2, 1),
+            on_progress=progresses.append,
+        )
+
+    assert sorted(c.args[0] for c in backfill.call_args_list) == [2, 3, 4]
+    assert sorted(c.args[1] for c in set_map_done.call_args_list) == [2, 4]
+    assert progress["total"] == 4
+    assert progress["done"] == 3
+    assert progress["failed"] == 1
+    assert progress["inserted"] == 20
+    assert progress["updated"] == 4
+    assert len(progresses) == 3
+    assert progresses[-1]["eta_secs"] == 0
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.sets = {}
+
+    def smembers(self, key):
+        return {str(m).encode() for m in self.sets.get(key, ())}
+
+    def sadd(self, key, member):
+        self.sets.setdefault(key, set()).add(member)
+
+    def expire(self, key, ttl):
+        pass
+
+    def delete(self, key):
+        self.sets.pop(key, None)
+
+
+def test_backfill_without_end_resumes():
+    red = _FakeRedis()
+    maps = [[1, 2, 3], [1, 2, 3, 4]]
+    backfilled = []
+
+    def backfill_map(map_id, force):
+        if map_id == 3 and not backfilled.count(3):
+            backfilled.append(map_id)
+            raise ValueError("interrupted")
+        backfilled.append(map_id)
+        return {"inserted": 1, "updated": 0}
+
+    with (
+        mock.patch.object(stats_backfill, "enter_session"),
+        mock.patch.object(
+            stats_backfill, "get_maps_to_backfill", side_effect=lambda *a: maps.pop(0)
+        ),
+        mock.patch.object(stats_backfill, "get_redis_pool", return_value=True),
+        mock.patch.object(stats_backfill, "get_redis_client", return_value=red),
+        mock.patch.object(stats_backfill, "get_engine"),
+        mock.patch.object(stats_backfill, "ProcessPoolExecutor", ThreadPoolExecutor),
+        mock.patch.object(stats_backfill, "backfill_map", side_effect=backfill_map),
+    ):
+        first = stats_backfill.backfill_player_stats(datetime.datetime(2023, 1, 1))
+        second = stats_backfill.backfill_player_stats(datetime.datetime(2023, 1, 1))
+
+    assert first["failed"] == 1
+    # Only the failed map and the one started since are done again
+    assert sorted(backfilled[3:]) == [3, 4]
+    assert second["total"] == 4
+    assert second["done"] == 4
+    assert list(red.sets) == [
+        f"{stats_backfill.BACKFILL_DONE_KEY}:20230101000000:open:all:0"
+    ]
@@ -0,0 +1,79 @@
+from contextlib import nullcontext
+from unittest import mock
+
+from rcon.stats_loop import (
+    REGISTERED_SERIES,
+    PlayerCount,
+    SeriesCollector,
+    VipCount,
+    take_snapshot,
+)
+
+RAW_RESPONSES = {
+    "gamestate": (
+        "Players: Allied: 40 - Axis: 38\n"
+        "Score: Allied: 3 - Axis: 2\n"
+        "Remaining Time: 0:11:51\n"
+        "Map: foy_warfare\n"
+        "Next Map: stmariedumont_warfare"
+    ),
+    "slots": "78/100",
+    "playerids": ["Some guy : 76561198000000001", "Other : 76561198000000002"],
+    "vipids": ['76561198000000002 "Other"', '76561198000000003 "Away"'],
+}
+
+
+def test_take_snapshot_uses_one_connection():
+    rcon = mock.MagicMock()
+    conn = object()
+    rcon.with_connection.return_value = nullcontext(conn)
+    rcon._get.side_effect = lambda item, *args, **kwargs: RAW_RESPONSES[item]
+
+    snapshot = take_snapshot(rcon)
+
+    rcon.with_connection.assert_called_once()
+    assert {call.kwargs["conn"] for call in rcon._get.call_args_list} == {conn}
+    assert {k: v for k, v in snapshot.items() if k != "timestamp_ms"} == {
+        "players": 78,
+        "max_players": 100,
+        "num_allied_players": 40,
+        "num_axis_players": 38,
+        "allied_score": 3,
+        "axis_score": 2,
+        "vips": 1,
+    }
+
+
+def test_all_series_written_with_one_madd():
+    client = mock.MagicMock()
+    collector = SeriesCollector(client, [s(client) for s in REGISTERED_SERIES])
+    snapshot = {
+        "timestamp_ms": 1000,
+        "players": 78,
+        "max_players": 100,
+        "num_allied_players": 40,
+        "num_axis_players": 38,
+        "allied_score": 3,
+        "axis_score": 2,
+        "vips": 1,
+    }
+
+    assert collector.record(snapshot) == len(REGISTERED_SERIES)
+
+    client.madd.assert_called_once()
+    (samples,) = client.madd.call_args.args
+    assert (PlayerCount.NAME, 1000, 78.0) in samples
+    assert (VipCount.NAME, 1000, 1.0) in samples
+
+
+def test_downsampled_range_bucket_size():
+    client = mock.MagicMock()
+    series = PlayerCount(client)
+
+    series.get_downsampled_range(0, 1000 * 60 * 60 * 24, max_points=24)
+    series.get_downsampled_range(0, 1000 * 60, max_points=24)
+
+    assert [c.kwargs["bucket_size_msec"] for c in client.range.call_args_list] == [
+        1000 * 60 * 60,
+        30000,
+    ]
@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from rcon.steam_api_standin import start_standin_server
+from rcon.steam_client import SteamAPIKeyError, SteamClient, TokenBucket
+
+
+@pytest.fixture
+def standin():
+    server = start_standin_server(api_key="key")
+    yield server
+    server.shutdown()
+
+
+def make_client(server, **kwargs):
+    host, port = server.server_address
+    return SteamClient(
+        "key", base_url=f"http://{host}:{port}", rate_per_sec=1000, burst=1000, **kwargs
+    )
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate_per_sec=2, capacity=2, clock=lambda: now[0])
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    now[0] = 0.5
+    assert bucket.try_acquire() == 0
+
+
+def test_bulk_lookups_are_chunked(standin):
+    client = make_client(standin)
+    steam_ids = [str(76561198000000001 + i) for i in range(250)]
+
+    profiles = client.get_player_summaries(steam_ids)
+    bans = client.get_player_bans(steam_ids)
+
+    # The stand-in doesn't know IDs ending in 0
+    expected = {i for i in steam_ids if not i.endswith("0")}
+    assert set(profiles) == expected
+    assert set(bans) == expected
+    assert standin.requests_count == 6
+
+
+def test_single_lookups_are_batched(standin):
+    client = make_client(standin, batch_window_secs=0.2)
+    steam_ids = [str(76561198000000001 + i) for i in range(20)]
+    results = {}
+
+    def lookup(steam_id):
+        results[steam_id] = client.get_player_summary(steam_id)
+
+    threads = [threading.Thread(target=lookup, args=(i,)) for i in steam_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert standin.requests_count == 1
+    assert results["76561198000000001"]["steamid"] == "76561198000000001"
+    assert results["76561198000000010"] is None
+
+
+def test_invalid_key(standin):
+    client = make_client(standin)
+    client.api_key = "invalid"
+
+    with pytest.raises(SteamAPIKeyError):
+        client.get_player_summaries(["76561198000000001"])
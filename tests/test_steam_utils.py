@@ -0,0 +1,156 @@
+import datetime
+from contextlib import contextmanager
+from unittest import mock
+
+import pytest
+
+from rcon import steam_utils
+from rcon.models import PlayerSteamID
+from rcon.steam_utils import (
+    ENRICH_CHECKPOINT_KEY,
+    _iter_players_to_enrich,
+    enrich_db_users,
+)
+
+PLAYERS = [(i, str(76561198000000000 + i)) for i in (1, 2, 5, 7, 9, 12)]
+
+
+class _FakeQuery:
+    """The players query, keeps the rows after the keyset of its filter"""
+
+    def __init__(self, sess):
+        self.sess = sess
+        self.after_id = None
+        self.size = None
+
+    def outerjoin(self, *args):
+        return self
+
+    def filter(self, condition):
+        left = getattr(condition, "left", None)
+        if left is not None and left.compare(PlayerSteamID.__table__.c.id):
+            self.after_id = condition.right.value
+            self.sess.after_ids.append(self.after_id)
+        return self
+
+    def order_by(self, *args):
+        return self
+
+    def limit(self, size):
+        self.size = size
+        return self
+
+    def all(self):
+        return [row for row in self.sess.rows if row[0] > self.after_id][: self.size]
+
+
+class _FakeSession:
+    def __init__(self, rows):
+        self.rows = rows
+        self.after_ids = []
+        self.commit = mock.Mock()
+
+    def query(self, *args):
+        return _FakeQuery(self)
+
+
+class _FakeRedis:
+    def __init__(self, checkpoint=None):
+        self.values = {}
+        if checkpoint is not None:
+            self.values[ENRICH_CHECKPOINT_KEY] = str(checkpoint).encode()
+        self.checkpoints = []
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def setex(self, key, ttl, value):
+        self.values[key] = str(value).encode()
+        self.checkpoints.append(value)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+@pytest.fixture
+def enrich():
+    sess = _FakeSession(PLAYERS)
+
+    @contextmanager
+    def enter_session():
+        yield sess
+
+    def run(red, fetch=lambda ids: {i: {"steamid": i} for i in ids}, **kwargs):
+        fetched = []
+
+        def fetch_steam_profiles(steam_ids):
+            fetched.append(steam_ids)
+            return fetch(steam_ids)
+
+        with mock.patch.multiple(
+            steam_utils,
+            get_steam_api_key=lambda: "key",
+            enter_session=enter_session,
+            get_redis_pool=lambda: True,
+            get_redis_client=lambda: red,
+            _fetch_steam_profiles=fetch_steam_profiles,
+            upsert_steam_profiles=mock.Mock(side_effect=lambda s, p, f: len(f)),
+        ):
+            result = enrich_db_users(chunk_size=2, **kwargs)
+            saved = [
+                c.args[1] for c in steam_utils.upsert_steam_profiles.call_args_list
+            ]
+        return result, fetched, saved
+
+    return run
+
+
+def test_players_are_paged_by_id():
+    sess = _FakeSession(PLAYERS)
+
+    pages = list(
+        _iter_players_to_enrich(sess, max_age=datetime.datetime.utcnow(), chunk_size=2)
+    )
+
+    assert [sorted(page.values()) for page in pages] == [[1, 2], [5, 7], [9, 12]]
+    assert pages[0] == {PLAYERS[0][1]: 1, PLAYERS[1][1]: 2}
+    # Each page starts after the last ID of the previous one
+    assert sess.after_ids == [0, 2, 7, 12]
+
+
+def test_enrich_resumes_from_the_checkpoint(enrich):
+    red = _FakeRedis(checkpoint=5)
+
+    result, fetched, saved = enrich(red)
+
+    assert fetched == [[PLAYERS[3][1], PLAYERS[4][1]], [PLAYERS[5][1]]]
+    assert [sorted(page.values()) for page in saved] == [[7, 9], [12]]
+    assert result == dict(players=3, saved=3)
+    assert red.checkpoints == [9, 12]
+    # The run went through, the next one starts over
+    assert red.get(ENRICH_CHECKPOINT_KEY) is None
+
+
+def test_enrich_without_resume_ignores_the_checkpoint(enrich):
+    red = _FakeRedis(checkpoint=5)
+
+    result, _, _ = enrich(red, resume=False)
+
+    assert result == dict(players=6, saved=6)
+
+
+def test_failed_lookup_leaves_the_checkpoint(enrich):
+    red = _FakeRedis()
+
+    def fetch(steam_ids):
+        if PLAYERS[2][1] in steam_ids:
+            return None
+        return {i: {} for i in steam_ids}
+
+    result, _, saved = enrich(red, fetch=fetch)
+
+    assert [sorted(page.values()) for page in saved] == [[1, 2]]
+    assert result == dict(players=2, saved=2)
+    # The next run retries from the failed page
+    assert red.checkpoints == [2]
+    assert red.get(ENRICH_CHECKPOINT_KEY) == b"2"
@@ -0,0 +1,116 @@
+import pickle
+from unittest import mock
+
+import pytest
+
+from rcon.team_view import (
+    DIFFS_KEY,
+    SNAPSHOT_KEY,
+    TeamViewService,
+    apply_team_view_diff,
+    diff_team_view_players,
+    is_empty_diff,
+)
+
+
+def _player(steam_id_64, team="allies", unit_name="able", role="rifleman", **scores):
+    return {
+        "name": f"player_{steam_id_64}",
+        "steam_id_64": steam_id_64,
+        "team": team,
+        "unit_id": 0,
+        "unit_name": unit_name,
+        "role": role,
+        "loadout": "standard",
+        "level": 10,
+        "is_vip": False,
+        **{
+            field: scores.get(field, 0)
+            for field in ("kills", "deaths", "combat", "offense", "defense", "support")
+        },
+    }
+
+
+def _players(*players):
+    return {p["steam_id_64"]: p for p in players}
+
+
+def test_diff():
+    previous = _players(_player("1"), _player("2"), _player("3", kills=2))
+    current = _players(
+        _player("1"),
+        _player("3", team="axis", unit_name="baker", kills=3, combat=20),
+        _player("4"),
+    )
+
+    diff = diff_team_view_players(previous, current, fail_count=1)
+
+    assert diff == {
+        "reset": False,
+        "joined": [current["4"]],
+        "left": ["2"],
+        "changed": {"3": {"team": "axis", "unit_name": "baker"}},
+        "score_deltas": {"3": {"kills": 1, "combat": 20}},
+        "fail_count": 1,
+    }
+    assert apply_team_view_diff(previous, diff) == current
+    assert previous["3"]["kills"] == 2
+
+
+def test_empty_diff():
+    players = _players(_player("1"), _player("2"))
+    assert is_empty_diff(diff_team_view_players(players, dict(players)))
+    assert not is_empty_diff(diff_team_view_players(players, players, reset=True))
+
+
+@pytest.fixture
+def service():
+    rcon = mock.MagicMock()
+    rcon.build_team_view.side_effect = lambda players, fail_count, profiles, vips: {
+        "fail_count": fail_count,
+        "players": sorted(players),
+    }
+    red = mock.MagicMock()
+    red.xadd.side_effect = [b"1-0", b"2-0", b"3-0"]
+    with mock.patch("rcon.team_view.ServerCtl.get_vip_ids", return_value=[]):
+        yield TeamViewService(rcon, red)
+
+
+def _tick(service, players):
+    service.rcon.get_detailed_players.return_value = {
+        "players": _players(*players),
+        "fail_count": 0,
+    }
+    return service.tick()
+
+
+def test_profiles_only_fetched_for_new_players(service):
+    with mock.patch(
+        "rcon.team_view.get_profiles",
+        side_effect=lambda ids: [{"steam_id_64": s} for s in ids],
+    ) as get_profiles:
+        _tick(service, [_player("1"), _player("2")])
+        _tick(service, [_player("1"), _player("2"), _player("3")])
+        _tick(service, [_player("2"), _player("3")])
+
+    assert [c.args[0] for c in get_profiles.call_args_list] == [["1", "2"], ["3"]]
+    assert set(service.profiles) == {"2", "3"}
+
+
+def test_publishes_snapshot_and_diffs(service):
+    with mock.patch("rcon.team_view.get_profiles", return_value=[]):
+        first = _tick(service, [_player("1")])
+        # Nothing changed, only the snapshot is refreshed
+        _tick(service, [_player("1")])
+        _tick(service, [_player("1", kills=1)])
+
+    assert first["reset"]
+    diffs = [pickle.loads(c.args[1]["diff"]) for c in service.red.xadd.call_args_list]
+    assert {c.args[0] for c in service.red.xadd.call_args_list} == {DIFFS_KEY}
+    assert [d["score_deltas"] for d in diffs] == [{}, {"1": {"kills": 1}}]
+
+    key, snapshot = service.red.set.call_args.args
+    snapshot = pickle.loads(snapshot)
+    assert key == SNAPSHOT_KEY
+    assert snapshot["id"] == "2-0"
+    assert snapshot["team_view"] == {"fail_count": 0, "players": ["1"]}